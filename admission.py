@@ -0,0 +1,94 @@
+"""
+Admission control for the API: shed load early instead of queueing on a slow database.
+
+Every request class ('ingest', 'predict', 'export') has its own budget:
+
+    max_in_flight            - concurrent requests of that class in this process; beyond it
+                               the request is rejected with 429
+    max_pool_utilization     - fraction of the database pool that may be checked out when a
+                               request of that class starts; beyond it the request is
+                               rejected with 503
+
+Ingestion gets a lower pool ceiling than prediction, so an ingestion storm (or a retrain
+holding connections) leaves connections for /predict. Both rejections carry Retry-After.
+Limits are per process (per gunicorn worker); 0 disables a limit.
+"""
+import os
+import threading
+
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+
+def _budget(kind, max_in_flight, max_pool_utilization):
+    prefix = f"ADMISSION_{kind.upper()}"
+    return {
+        'max_in_flight': int(os.environ.get(f"{prefix}_MAX_IN_FLIGHT", str(max_in_flight))),
+        'max_pool_utilization': float(os.environ.get(f"{prefix}_MAX_POOL_UTILIZATION", str(max_pool_utilization))),
+    }
+
+
+ADMISSION_BUDGETS = {
+    'ingest': _budget('ingest', 16, 0.7),
+    'predict': _budget('predict', 32, 1.0),
+    # Segment exports hold a connection for the whole stream (see /predict/segment)
+    'export': _budget('export', 2, 0.5),
+}
+
+
+class Rejection:
+    """Why a request was shed, and how it should be answered."""
+
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Tracks in-flight requests per class and decides whether a new one may start."""
+
+    def __init__(self, budgets, pool_usage, retry_after=ADMISSION_RETRY_AFTER_SECONDS):
+        self.budgets = budgets
+        self.pool_usage = pool_usage  # callable returning (connections in use, pool size)
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._in_flight = dict.fromkeys(budgets, 0)
+        self._counters = {kind: {'admitted': 0, 'shed_in_flight': 0, 'shed_pool': 0, 'pool_exhausted': 0}
+                          for kind in budgets}
+
+    def try_enter(self, kind):
+        """Admits one request of kind and returns None, or returns a Rejection. Pair with leave()."""
+        budget = self.budgets[kind]
+        in_use, pool_size = self.pool_usage()
+        with self._lock:
+            counters = self._counters[kind]
+            if budget['max_in_flight'] and self._in_flight[kind] >= budget['max_in_flight']:
+                counters['shed_in_flight'] += 1
+                return Rejection(429, f"too many concurrent {kind} requests", self.retry_after)
+            if budget['max_pool_utilization'] and pool_size and in_use >= budget['max_pool_utilization'] * pool_size:
+                counters['shed_pool'] += 1
+                return Rejection(503, "database connection pool saturated", self.retry_after)
+            self._in_flight[kind] += 1
+            counters['admitted'] += 1
+            return None
+
+    def leave(self, kind):
+        with self._lock:
+            self._in_flight[kind] -= 1
+
+    def pool_exhausted(self, kind):
+        """Records an admitted request that found no free connection; answer it like a shed one."""
+        with self._lock:
+            self._counters[kind]['pool_exhausted'] += 1
+        return Rejection(503, "database connection pool exhausted", self.retry_after)
+
+    def stats(self):
+        in_use, pool_size = self.pool_usage()
+        with self._lock:
+            return {
+                'pool': {'in_use': in_use, 'size': pool_size},
+                'classes': {
+                    kind: {'in_flight': self._in_flight[kind], **self.budgets[kind], **self._counters[kind]}
+                    for kind in self.budgets
+                },
+            }
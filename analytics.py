@@ -0,0 +1,325 @@
+"""
+Analytical (DuckDB) execution path for training-time feature extraction.
+
+Events are exported incrementally from customer_events_normalized into local Parquet
+segments (one per exported id range, plus a tail segment rewritten on every run for the
+events younger than the snapshot safety lag), with the hot fields already extracted into
+columns. The feature aggregation then runs as one vectorized SQL query over the segments
+and returns the same feature columns as features.calculate_features / snapshots.
+
+Already-exported events can be used instead of the database: NDJSON from get_events.py
+(--ndjson) or raw event archive segments (--archive).
+
+    python analytics.py                    # refresh segments and print a summary
+    python analytics.py --check 200        # compare 200 random customers with the pandas path
+
+Requires the optional duckdb package (pip install duckdb).
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from database import db
+from features import calculate_customer_features
+from ingest import TIMESTAMP_DIVISORS, TIMESTAMP_FIELDS, normalize_stored_events
+from snapshots import SNAPSHOT_SAFETY_LAG
+from windows import MAX_WINDOW_DAYS, WINDOW_DAYS, WINDOW_FEATURE_COLUMNS
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+ANALYTICS_DIR = os.environ.get("ANALYTICS_DIR", os.path.join(os.path.dirname(__file__), 'analytics_cache'))
+SEGMENTS_MANIFEST = 'segments.json'
+TAIL_SEGMENT = 'tail.parquet'
+
+# Like ingest.event_epoch_seconds: the first present field wins, and an unparseable one
+# falls back to "now" like FeatureState.fold
+_TIMESTAMP_SQL = "CASE " + " ".join(
+    f"WHEN json_extract_string(e, '$.{field}') IS NOT NULL "
+    f"THEN TRY_CAST(json_extract_string(e, '$.{field}') AS DOUBLE) / {TIMESTAMP_DIVISORS[field]!r}"
+    for field in TIMESTAMP_FIELDS
+) + " END"
+
+# Turns (id, customer_id, e JSON) rows into the columnar event layout of the segments
+_EXTRACT_SQL = f"""
+    SELECT
+        id,
+        customer_id,
+        lower(COALESCE(json_extract_string(e, '$.event_name'), json_extract_string(e, '$.event_type'))) AS event_name,
+        {_TIMESTAMP_SQL} AS event_ts,
+        TRY_CAST(json_extract_string(e, '$.value') AS DOUBLE) AS value,
+        CASE WHEN json_type(e, '$.items') = 'ARRAY' THEN json_extract(e, '$.items') END AS items
+    FROM ({{source}})
+"""
+
+# Rolling windows (see windows.py): UTC day of the event after today minus N days
+_IN_WINDOW = "floor(ts / 86400) > floor($now / 86400) - {days}"
+_WINDOW_SELECTS = ",\n".join(
+    f"""COUNT(*) FILTER (WHERE event_name = 'purchase' AND {_IN_WINDOW.format(days=days)}) AS purchases_{days}d,
+        COALESCE(SUM(COALESCE(ev.value, piv.items_value, 0.0))
+                 FILTER (WHERE event_name = 'purchase' AND {_IN_WINDOW.format(days=days)}), 0.0) AS purchase_value_{days}d,
+        COUNT(*) FILTER (WHERE event_name = 'page_view' AND {_IN_WINDOW.format(days=days)}) AS page_views_{days}d,
+        COUNT(*) FILTER (WHERE event_name = 'add_to_cart' AND {_IN_WINDOW.format(days=days)}) AS add_to_cart_{days}d"""
+    for days in WINDOW_DAYS
+)
+_WINDOW_COLUMNS = ", ".join(f"COALESCE(w.{column}, 0) AS {column}" for column in WINDOW_FEATURE_COLUMNS)
+
+_FEATURES_SQL = """
+    WITH ev AS (
+        SELECT id, customer_id, event_name, COALESCE(event_ts, $now) AS ts, value, items FROM ({events})
+    ),
+    item_rows AS (
+        SELECT id, customer_id, event_name, item
+        FROM (
+            SELECT id, customer_id, event_name, unnest(CAST(items AS JSON[])) AS item
+            FROM ev WHERE items IS NOT NULL AND event_name IN ('purchase', 'view_item')
+        )
+        WHERE json_type(item) = 'OBJECT'
+    ),
+    item_values AS (
+        SELECT
+            id, customer_id, event_name,
+            json_extract_string(item, '$.item_id') AS item_id,
+            json_extract_string(item, '$.item_brand') AS item_brand,
+            COALESCE(TRY_CAST(json_extract_string(item, '$.quantity') AS DOUBLE), 1.0) AS quantity,
+            COALESCE(TRY_CAST(COALESCE(json_extract_string(item, '$.price'), json_extract_string(item, '$.item_price'),
+                                       json_extract_string(item, '$.item_revenue')) AS DOUBLE), 0.0) AS price
+        FROM item_rows
+    ),
+    purchase_item_values AS (
+        SELECT id, SUM(price * quantity) AS items_value FROM item_values WHERE event_name = 'purchase' GROUP BY id
+    ),
+    purchases AS (
+        SELECT customer_id,
+               COUNT(*) AS number_of_purchases,
+               SUM(COALESCE(ev.value, piv.items_value, 0.0)) AS total_purchase_value,
+               MAX(ts) AS last_purchase_ts
+        FROM ev LEFT JOIN purchase_item_values piv USING (id)
+        WHERE event_name = 'purchase'
+        GROUP BY customer_id
+    ),
+    purchased_items AS (
+        SELECT customer_id, SUM(quantity) AS total_items_purchased,
+               COUNT(DISTINCT item_id) AS distinct_products_purchased,
+               COUNT(DISTINCT item_brand) AS distinct_brands_purchased
+        FROM item_values WHERE event_name = 'purchase' GROUP BY customer_id
+    ),
+    viewed_items AS (
+        SELECT customer_id, COUNT(DISTINCT item_id) AS distinct_products_viewed,
+               COUNT(DISTINCT item_brand) AS distinct_brands_viewed
+        FROM item_values WHERE event_name = 'view_item' GROUP BY customer_id
+    ),
+    customers AS (
+        SELECT customer_id,
+               MIN(ts) AS first_event_ts,
+               COUNT(*) FILTER (WHERE event_name = 'page_view') AS number_of_page_views,
+               COUNT(*) FILTER (WHERE event_name = 'add_to_cart') AS add_to_cart_count,
+               COUNT(*) FILTER (WHERE event_name = 'begin_checkout') AS begin_checkout_count
+        FROM ev GROUP BY customer_id
+    ),
+    windows AS (
+        SELECT ev.customer_id,
+        {window_selects}
+        FROM ev LEFT JOIN purchase_item_values piv USING (id)
+        WHERE {in_longest_window}
+        GROUP BY ev.customer_id
+    ),
+    features AS (
+        SELECT
+            c.customer_id,
+            COALESCE(p.total_purchase_value, 0.0) AS total_purchase_value,
+            COALESCE(p.number_of_purchases, 0) AS number_of_purchases,
+            CASE WHEN p.number_of_purchases > 0 THEN p.total_purchase_value / p.number_of_purchases ELSE 0.0 END
+                AS average_purchase_value,
+            COALESCE(pi.total_items_purchased, 0.0) AS total_items_purchased,
+            COALESCE(pi.distinct_products_purchased, 0) AS distinct_products_purchased,
+            COALESCE(pi.distinct_brands_purchased, 0) AS distinct_brands_purchased,
+            COALESCE(vi.distinct_products_viewed, 0) AS distinct_products_viewed,
+            COALESCE(vi.distinct_brands_viewed, 0) AS distinct_brands_viewed,
+            c.number_of_page_views,
+            CASE WHEN p.last_purchase_ts IS NULL THEN 0 ELSE CAST(floor(($now - p.last_purchase_ts) / 86400) AS BIGINT) END
+                AS days_since_last_purchase,
+            GREATEST(CAST(floor(($now - c.first_event_ts) / 86400) AS BIGINT), 1) AS time_since_first_event,
+            c.add_to_cart_count,
+            c.begin_checkout_count,
+            c.first_event_ts,
+            p.last_purchase_ts
+        FROM customers c
+        LEFT JOIN purchases p USING (customer_id)
+        LEFT JOIN purchased_items pi USING (customer_id)
+        LEFT JOIN viewed_items vi USING (customer_id)
+    )
+    SELECT
+        customer_id, total_purchase_value, number_of_purchases, average_purchase_value,
+        total_items_purchased, distinct_products_purchased, distinct_brands_purchased,
+        distinct_products_viewed, distinct_brands_viewed, number_of_page_views,
+        days_since_last_purchase, time_since_first_event,
+        number_of_purchases / time_since_first_event AS purchase_frequency,
+        total_purchase_value AS pltv,
+        add_to_cart_count, begin_checkout_count,
+        {window_columns},
+        first_event_ts AS first_event_at, last_purchase_ts AS last_purchase_at
+    FROM features
+    LEFT JOIN windows w USING (customer_id)
+    ORDER BY customer_id
+"""
+
+
+def _connect():
+    if duckdb is None:
+        raise RuntimeError("The analytical engine needs DuckDB: pip install duckdb")
+    return duckdb.connect()
+
+
+def _quote(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def _read_segments_manifest(directory):
+    path = os.path.join(directory, SEGMENTS_MANIFEST)
+    if not os.path.exists(path):
+        return {'last_event_id': 0, 'segments': []}
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _export_range(con, directory, name, after_id, up_to_id=None):
+    """Exports events with after_id < id <= up_to_id to the Parquet segment name. Returns its path."""
+    with tempfile.NamedTemporaryFile(suffix='.csv.gz', dir=directory, delete=False) as raw:
+        csv_path = raw.name
+    try:
+        with gzip.open(csv_path, 'wb') as out:
+            db.copy_events_csv(out, after_id=after_id, up_to_id=up_to_id)
+        source = (f"SELECT id, customer_id, CAST(event_data AS JSON) AS e FROM read_csv({_quote(csv_path)}, header=true, "
+                  f"columns={{'id': 'BIGINT', 'customer_id': 'VARCHAR', 'created_at': 'VARCHAR', 'event_data': 'VARCHAR'}})")
+        segment_path = os.path.join(directory, name)
+        temp_path = segment_path + '.tmp'
+        con.execute(f"COPY ({_EXTRACT_SQL.format(source=source)}) TO {_quote(temp_path)} (FORMAT parquet, COMPRESSION zstd)")
+        os.replace(temp_path, segment_path)
+        return segment_path
+    finally:
+        os.remove(csv_path)
+
+
+def refresh_event_segments(directory=None, rebuild=False, con=None):
+    """
+    Exports the events added since the last run into a new Parquet segment and rewrites
+    the tail segment. Returns the paths of every segment, tail included.
+
+    Segments only cover ids up to the snapshot safety lag watermark (see
+    Database.get_safe_event_watermark), so a late-committing insert is never skipped; younger
+    events live in the tail segment, which is re-exported on every run.
+    """
+    directory = directory or ANALYTICS_DIR
+    if rebuild and os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory, exist_ok=True)
+    con = con or _connect()
+
+    manifest = _read_segments_manifest(directory)
+    last_event_id = manifest['last_event_id']
+    watermark = db.get_safe_event_watermark(last_event_id, SNAPSHOT_SAFETY_LAG.total_seconds())
+    if watermark > last_event_id:
+        name = f"events-{last_event_id + 1:012d}-{watermark:012d}.parquet"
+        _export_range(con, directory, name, last_event_id, watermark)
+        manifest = {'last_event_id': watermark, 'segments': manifest['segments'] + [name]}
+        temp_path = os.path.join(directory, SEGMENTS_MANIFEST + '.tmp')
+        with open(temp_path, 'w') as handle:
+            json.dump(manifest, handle, indent=2)
+        os.replace(temp_path, os.path.join(directory, SEGMENTS_MANIFEST))
+        print(f"Exported events {last_event_id + 1}..{watermark} to {name}.")
+
+    tail_path = _export_range(con, directory, TAIL_SEGMENT, manifest['last_event_id'])
+    return [os.path.join(directory, name) for name in manifest['segments']] + [tail_path]
+
+
+def _ndjson_source(pattern):
+    # get_events.py NDJSON export: {"id", "customer_id", "created_at", "event_data"}
+    return (f"SELECT id, customer_id, event_data AS e FROM read_json({_quote(pattern)}, format='newline_delimited', "
+            f"columns={{'id': 'BIGINT', 'customer_id': 'VARCHAR', 'created_at': 'VARCHAR', 'event_data': 'JSON'}})")
+
+
+def _archive_source(directory):
+    # Raw event archive: {"received_at", "customer_id", "fingerprint", "event"}; no event ids
+    pattern = os.path.join(directory, 'events-*.ndjson.gz')
+    return (f"SELECT row_number() OVER () AS id, customer_id, event AS e FROM read_json({_quote(pattern)}, "
+            f"format='newline_delimited', ignore_errors=true, "
+            f"columns={{'received_at': 'VARCHAR', 'customer_id': 'VARCHAR', 'fingerprint': 'VARCHAR', 'event': 'JSON'}})")
+
+
+def compute_features_frame(ndjson=None, archive=None, directory=None, now=None):
+    """
+    Returns the feature DataFrame (one row per customer, same columns as the snapshot and
+    pandas paths) computed by DuckDB from the Parquet segments, or from an NDJSON export
+    glob / raw event archive directory when given.
+    """
+    con = _connect()
+    now = time.time() if now is None else now
+    if ndjson:
+        events = _EXTRACT_SQL.format(source=_ndjson_source(ndjson))
+    elif archive:
+        events = _EXTRACT_SQL.format(source=_archive_source(archive))
+    else:
+        segments = refresh_event_segments(directory, con=con)
+        events = f"SELECT * FROM read_parquet([{', '.join(_quote(path) for path in segments)}])"
+    started = time.perf_counter()
+    features_df = con.execute(_FEATURES_SQL.format(
+        events=events, window_selects=_WINDOW_SELECTS, window_columns=_WINDOW_COLUMNS,
+        in_longest_window=_IN_WINDOW.format(days=MAX_WINDOW_DAYS)), {'now': now}).df()
+    print(f"DuckDB computed features for {len(features_df)} customers in {time.perf_counter() - started:.2f}s.")
+    return features_df
+
+
+def check_against_pandas(features_df, sample_size=200, seed=42):
+    """
+    Recomputes a random sample of customers with features.calculate_features and reports
+    every column that differs (day counts may differ by one across a day boundary).
+    """
+    customer_ids = features_df['customer_id'].tolist()
+    sample = random.Random(seed).sample(customer_ids, min(sample_size, len(customer_ids)))
+    rows = features_df.set_index('customer_id')
+    mismatches = []
+    for customer_id in sample:
+        stored = [row[1] for row in db.get_customer_events(customer_id)]
+        expected = calculate_customer_features(customer_id, normalize_stored_events(customer_id, stored))
+        if expected is None:
+            continue
+        actual = rows.loc[customer_id]
+        for column, expected_value in expected.items():
+            if column == 'customer_id' or column not in actual.index:
+                continue
+            tolerance = 1 if column in ('days_since_last_purchase', 'time_since_first_event') else 1e-6 * max(1.0, abs(float(expected_value)))
+            if abs(float(actual[column]) - float(expected_value)) > tolerance:
+                mismatches.append({'customer_id': customer_id, 'column': column,
+                                   'duckdb': float(actual[column]), 'pandas': float(expected_value)})
+    return {'checked': len(sample), 'mismatches': mismatches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DuckDB feature extraction over exported event segments.")
+    parser.add_argument('--ndjson', help="Read a get_events.py NDJSON export (glob) instead of the database.")
+    parser.add_argument('--archive', help="Read a raw event archive directory instead of the database.")
+    parser.add_argument('--rebuild', action='store_true', help="Re-export every segment.")
+    parser.add_argument('--check', type=int, metavar='N', help="Compare N random customers with the pandas path.")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        refresh_event_segments(rebuild=True)
+    features_df = compute_features_frame(ndjson=args.ndjson, archive=args.archive)
+    print(features_df.describe().transpose())
+    if args.check:
+        report = check_against_pandas(features_df, args.check)
+        print(f"Checked {report['checked']} customers against calculate_features: {len(report['mismatches'])} mismatches.")
+        for mismatch in report['mismatches'][:50]:
+            print(mismatch)
+
+
+if __name__ == "__main__":
+    main()
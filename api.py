@@ -1,19 +1,33 @@
 
+import functools
+import itertools
 import json
+import sys
 import time
-import joblib
-import pandas as pd
 import os
 import threading
-from flask import Flask, request, jsonify
+import zlib
+from flask import Flask, Response, request, jsonify
+from psycopg2 import pool
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from database import db  # Import the single db instance
-from features import calculate_features
-from model import retrain_and_save_model
+from database import db  # Import the single db instance (connects on first use)
+from ingest import BulkEventBatcher, extract_events, prepare_event, resolve_customer_id
+from ndjson_stream import NDJSONDecoder
+from recompute import recompute_scheduler
+from event_archive import event_archive
+from traffic_capture import traffic_capture
+from admission import ADMISSION_BUDGETS, AdmissionController
+from retrain_scheduler import RetrainScheduler
+
+# Events per database transaction on /events/bulk
+BULK_INGEST_BATCH_SIZE = int(os.environ.get("BULK_INGEST_BATCH_SIZE", "1000"))
+# Per-line rejection details returned by /events/bulk (counts are always complete)
+BULK_INGEST_MAX_ERRORS = int(os.environ.get("BULK_INGEST_MAX_ERRORS", "100"))
+BULK_READ_CHUNK_BYTES = 64 * 1024
 
 # Construct path to the model file relative to this script's location
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,12 +36,28 @@ model_path = os.path.join(script_dir, 'pltv_model.pkl')
 # Global variables for the loaded model and its features
 model = None
 model_features = []
+# Whether the loaded model expects NaN features filled with 0 (see model_backends)
+model_fill_missing = True
+# Stage profile stored in the loaded artifact by the retrain that produced it
+model_profile = None
+# What the loaded model was trained on, compared against the database by the retrain scheduler
+model_training_snapshot = None
+# Modification time of the artifact file that was loaded; another worker's retrain replaces it
+model_artifact_mtime = None
+# Set once a load has been attempted; the artifact is read on the first /predict unless
+# it was preloaded (see gunicorn.conf.py), so importing this module stays cheap
+model_load_attempted = False
+model_load_lock = threading.Lock()
 
 def load_model_artifact():
     """Loads the model artifact from disk and populates global variables."""
-    global model, model_features
+    global model, model_features, model_fill_missing, model_profile, model_training_snapshot, model_load_attempted, model_artifact_mtime
+    model_load_attempted = True
     try:
         if os.path.exists(model_path):
+            model_artifact_mtime = os.path.getmtime(model_path)
+            # joblib pulls in numpy/sklearn, so it is only imported when a model is actually loaded
+            import joblib
             model_artifact = joblib.load(model_path)
             if not isinstance(model_artifact, dict) or 'model' not in model_artifact or 'features' not in model_artifact:
                 app.logger.error("Model artifact 'pltv_model.pkl' is malformed or incomplete.")
@@ -36,6 +66,10 @@ def load_model_artifact():
                 return
             model = model_artifact['model']
             model_features = model_artifact['features']
+            # Artifacts from before fill_missing was recorded were all trained on filled features
+            model_fill_missing = model_artifact.get('fill_missing', True)
+            model_profile = model_artifact.get('profile')
+            model_training_snapshot = model_artifact.get('training_snapshot')
             app.logger.info(f"Model artifact loaded successfully. Features: {model_features}")
         else:
             app.logger.warning("Model artifact 'pltv_model.pkl' not found. Predictions will not be available until a model is trained.")
@@ -45,15 +79,106 @@ def load_model_artifact():
         model_features = None
         model_metrics = None
 
+def ensure_model_loaded():
+    """Loads the model artifact on first use when it was not preloaded."""
+    if not model_load_attempted:
+        with model_load_lock:
+            if not model_load_attempted:
+                load_model_artifact()
+
+def reload_model_if_changed():
+    """Reloads the artifact when the file on disk is not the one loaded, e.g. after a retrain in another worker."""
+    ensure_model_loaded()
+    try:
+        mtime = os.path.getmtime(model_path)
+    except OSError:
+        return
+    if mtime != model_artifact_mtime:
+        with model_load_lock:
+            if mtime != model_artifact_mtime:
+                load_model_artifact()
+
+def preload():
+    """
+    Loads the model and the heavy libraries up front. Called in the gunicorn master when
+    preload_app is set, so every forked worker shares the loaded model copy-on-write.
+    """
+    import pandas  # noqa: F401
+    load_model_artifact()
+
 app = Flask(__name__)
 
-# Initialize the database and create tables if they don't exist
-db.create_all_tables()
-# Load the model artifact on startup
-load_model_artifact()
+# Separate in-flight and pool budgets for ingestion and prediction (see admission.py)
+admission = AdmissionController(ADMISSION_BUDGETS, db.pool_usage)
+
+def shed_response(rejection):
+    response = jsonify({"error": rejection.reason})
+    response.status_code = rejection.status
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+def admitted(kind):
+    """Runs the view only if the admission budget of kind allows it; sheds with 429/503 otherwise."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            rejection = admission.try_enter(kind)
+            if rejection is not None:
+                return shed_response(rejection)
+            try:
+                return view(*args, **kwargs)
+            except pool.PoolError:
+                return shed_response(admission.pool_exhausted(kind))
+            finally:
+                admission.leave(kind)
+        return wrapper
+    return decorator
+
+# Schema migration is an explicit deploy step (python database.py), not done at import
+
+def archive_raw_events(inserted_events, raw_events_by_fingerprint):
+    """Appends the untouched payloads of newly inserted events to the raw event archive, if enabled."""
+    if event_archive is None:
+        return
+    try:
+        event_archive.append([
+            (record[0], record[3], raw_events_by_fingerprint[record[3]]) for record in inserted_events
+        ])
+    except Exception:
+        app.logger.exception("Failed to append raw events to the archive")
+
+def capture_request(events, arrived_at):
+    """Appends the raw /event request body to the traffic capture, if enabled (see traffic_capture.py)."""
+    if traffic_capture is None:
+        return
+    try:
+        first_event = next((evt for evt in events if isinstance(evt, dict)), None)
+        traffic_capture.capture(request.path, request.get_data(cache=True), request.content_type,
+                                customer_id=resolve_customer_id(first_event) if first_event else None,
+                                arrived_at=arrived_at)
+    except Exception:
+        app.logger.exception("Failed to capture the request")
+
+def ingest_prepared_events(prepared_events, raw_events_by_fingerprint):
+    """
+    Writes prepared events in one transaction, archives the raw payloads of the inserted ones
+    and schedules a recompute for customers with a new purchase. Returns the inserted records.
+    """
+    # Events are inserted and the counter deltas (including purchase count/value) are
+    # aggregated per customer and upserted together
+    inserted_events = db.ingest_events(prepared_events)
+    archive_raw_events(inserted_events, raw_events_by_fingerprint)
+
+    # Full recalculation of dependent features runs debounced in the recompute worker pool.
+    # Duplicate (retried) purchases were not inserted and trigger nothing.
+    for customer_id in {record[0] for record in inserted_events if record[2] == 'purchase'}:
+        recompute_scheduler.schedule(customer_id)
+    return inserted_events
 
 @app.route('/event', methods=['PUT', 'POST'])
+@admitted('ingest')
 def event():
+    arrived_at = time.time()
     try:
         app.logger.info(f"Incoming request Content-Type: {request.headers.get('Content-Type')}")
         app.logger.info(f"Incoming raw request data: {request.data.decode('utf-8', errors='ignore')}")
@@ -63,111 +188,95 @@ def event():
             return jsonify({"error": "Invalid JSON or empty request body"}), 400
         app.logger.info(f"Incoming event data: {json.dumps(event_data, indent=2)}")
 
-        events = []
-        if isinstance(event_data, dict) and 'events' in event_data:
-            raw_events = event_data['events']
-            if isinstance(raw_events, list):
-                events = raw_events
-            else:
-                events = [raw_events]
-        elif isinstance(event_data, list):
-            events = event_data
-        elif isinstance(event_data, dict):
-            events = [event_data]
-
-        if not events:
-            app.logger.error("Incoming event data must contain a top-level 'events' list or be a valid GA4 event object.")
-            return jsonify({"error": "Invalid event data format: expecting 'events' list or single event object"}), 400
-
-        processed_an_event = False
-        for single_event in events:
-            if not isinstance(single_event, dict):
-                app.logger.error("Skipping event because it is not a JSON object: %s", single_event)
-                continue
-            # Work on a copy so we can normalize fields without mutating the input
-            event_record = dict(single_event)
-            app.logger.info(f"Processing single event: {json.dumps(event_record, indent=2)}")
-            customer_id = event_record.get('user_pseudo_id') or event_record.get('client_id')
-
-            if not customer_id and isinstance(single_event, dict):
-                user_properties = event_record.get('user_properties')
-                if user_properties and isinstance(user_properties, dict):
-                    user_pseudo_id_obj = user_properties.get('user_pseudo_id')
-                    if user_pseudo_id_obj and isinstance(user_pseudo_id_obj, dict):
-                        customer_id = user_pseudo_id_obj.get('value')
-                
-                if not customer_id:
-                    client_info = event_record.get('client_info')
-                    if client_info and isinstance(client_info, dict):
-                        customer_id = client_info.get('client_id')
-                if not customer_id:
-                    customer_id = event_record.get('_ga')
-
-            if not customer_id:
-                app.logger.error("Skipping event: 'user_pseudo_id' or 'client_id' not found in event payload.")
-                continue
-
-            processed_an_event = True
-            event_name_raw = event_record.get('event_name') or event_record.get('event_type')
-            normalized_event_name = event_name_raw.lower() if isinstance(event_name_raw, str) else None
-            if normalized_event_name:
-                event_record['event_name'] = normalized_event_name
-
-            db.upsert_event(customer_id, event_record)
-            
-            event_name = normalized_event_name
-
-            if event_name == 'purchase':
-                try:
-                    customer_events_raw = db.get_customer_events(customer_id)
-                    if customer_events_raw:
-                        all_customer_event_dicts = []
-                        for _, event_data_dict, _ in customer_events_raw:
-                            evt = event_data_dict
-                            # Defensive: handle legacy string storage
-                            if isinstance(evt, str):
-                                try:
-                                    evt = json.loads(evt)
-                                except Exception:
-                                    continue
-                            if not isinstance(evt, dict):
-                                continue
-                            # Normalize and stamp customer_id
-                            evt = dict(evt)
-                            evt.setdefault('customer_id', customer_id)
-                            # Normalize event_name casing
-                            if 'event_name' in evt and isinstance(evt['event_name'], str):
-                                evt['event_name'] = evt['event_name'].lower()
-                            all_customer_event_dicts.append(evt)
-                        
-                        if all_customer_event_dicts:
-                            events_df = pd.DataFrame(all_customer_event_dicts)
-                            
-                            features = calculate_features(events_df)
-                            
-                            # calculate_features returns a DataFrame, extract the row for this customer
-                            if not features.empty:
-                                customer_features_dict = features[features['customer_id'] == customer_id].iloc[0].to_dict()
-                                db.upsert_customer_features(customer_features_dict)
-                                app.logger.info(f"Successfully recalculated features for customer {customer_id} after purchase.")
-                            else:
-                                app.logger.warning(f"No features calculated for customer {customer_id} after purchase.")
-                        else:
-                            app.logger.warning(f"No valid event data found for customer {customer_id} to calculate features.")
-                except Exception:
-                    app.logger.exception(f"Error during full feature recalculation for customer {customer_id}")
-            else:
-                db.update_features_incrementally(customer_id, event_record)
-
-        if not processed_an_event:
+        events = extract_events(event_data)
+        capture_request(events, arrived_at)
+
+        if not events:
+            app.logger.error("Incoming event data must contain a top-level 'events' list or be a valid GA4 event object.")
+            return jsonify({"error": "Invalid event data format: expecting 'events' list or single event object"}), 400
+
+        prepared_events = []
+        raw_events_by_fingerprint = {}
+        for single_event in events:
+            if not isinstance(single_event, dict):
+                app.logger.error("Skipping event because it is not a JSON object: %s", single_event)
+                continue
+            app.logger.info(f"Processing single event: {json.dumps(single_event, indent=2)}")
+            prepared = prepare_event(single_event)
+
+            if prepared is None:
+                app.logger.error("Skipping event: 'user_pseudo_id' or 'client_id' not found in event payload.")
+                continue
+
+            prepared_events.append(prepared)
+            raw_events_by_fingerprint[prepared[3]] = single_event
+
+        if not prepared_events:
             return jsonify({"error": "No valid events with customer_id found in the payload"}), 400
 
-        return jsonify({"message": "Events received and processed"}), 200
+        # One transaction for the whole payload
+        inserted_events = ingest_prepared_events(prepared_events, raw_events_by_fingerprint)
+
+        return jsonify({
+            "message": "Events received and processed",
+            "accepted": len(inserted_events),
+            "duplicates": len(prepared_events) - len(inserted_events),
+        }), 200
+    except pool.PoolError:
+        raise  # answered with 503 + Retry-After by admission control
     except Exception as e:
         app.logger.error(f"Error processing event: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/events/bulk', methods=['POST'])
+@admitted('ingest')
+def bulk_events():
+    """
+    Streams an application/x-ndjson body (optionally Content-Encoding: gzip), one event (or
+    {"events": [...]} payload) per line. Lines are parsed as they arrive, with the same
+    customer-ID resolution and event-name normalization as /event, and written in batches
+    of BULK_INGEST_BATCH_SIZE. Responds with per-line accept/reject counts.
+    """
+    content_type = (request.mimetype or '').lower()
+    if content_type not in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return jsonify({"error": "Content-Type must be application/x-ndjson"}), 415
+    content_encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if content_encoding not in ('', 'identity', 'gzip'):
+        return jsonify({"error": f"Unsupported Content-Encoding: {content_encoding}"}), 415
+
+    batcher = BulkEventBatcher(BULK_INGEST_BATCH_SIZE, BULK_INGEST_MAX_ERRORS)
+
+    def flush():
+        batch, raw_events_by_fingerprint = batcher.take_batch()
+        if batch:
+            inserted_events = ingest_prepared_events(batch, raw_events_by_fingerprint)
+            batcher.record_written(len(batch), len(inserted_events))
+
+    decoder = NDJSONDecoder(gzip=content_encoding == 'gzip')
+    try:
+        while True:
+            chunk = request.stream.read(BULK_READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            for parsed_line in decoder.feed(chunk):
+                if batcher.add_line(*parsed_line):
+                    flush()
+        for parsed_line in decoder.close():
+            batcher.add_line(*parsed_line)
+        flush()
+    except zlib.error as e:
+        # Batches before the corrupt part are already committed; report what happened so far
+        return jsonify({"error": f"Invalid gzip body: {e}", **batcher.result()}), 400
+    except pool.PoolError:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error processing bulk events: {e}")
+        return jsonify({"error": "Internal server error", **batcher.result()}), 500
+
+    return jsonify({"message": "Bulk events processed", **batcher.result()}), 200
+
 @app.route('/predict', methods=['GET', 'POST'])
+@admitted('predict')
 def predict():
     customer_id = None
     if request.method == 'GET':
@@ -180,6 +289,7 @@ def predict():
     if not customer_id:
         return jsonify({"error": "customer_id is required"}), 400
 
+    ensure_model_loaded()
     if model is None or not model_features:
         return jsonify({"error": "Model not loaded or trained yet. Please retrain the model."}), 503
 
@@ -188,12 +298,16 @@ def predict():
     if not customer_features_dict:
         return jsonify({"error": f"No features found for customer_id: {customer_id}"}), 404
 
+    import pandas as pd
+
     # Convert features to DataFrame for prediction
     # Ensure the order of features matches the model's expected features
     features_df = pd.DataFrame([customer_features_dict])
     
-    # Align columns with model_features, filling missing with 0
-    X_predict = features_df[model_features].fillna(0)
+    # Align columns with model_features, filling missing with 0 if the model was trained that way
+    X_predict = features_df[model_features]
+    if model_fill_missing:
+        X_predict = X_predict.fillna(0)
 
     try:
         prediction = model.predict(X_predict)[0]
@@ -202,28 +316,159 @@ def predict():
         app.logger.error(f"Error during prediction for customer {customer_id}: {e}")
         return jsonify({"error": "Error during prediction"}), 500
 
-def run_retrain_job():
-    """Background job: retrain model then reload artifact into memory."""
+@app.route('/predict/segment', methods=['GET', 'POST'])
+def predict_segment():
+    """
+    Streams the pLTV of every customer matching the filters as NDJSON (default) or CSV.
+    GET: ?where=number_of_purchases>=2&column=total_purchase_value&format=csv (where and
+    column repeatable); POST: {"where": [...], "columns": [...], "format": "csv"}.
+    """
+    from segments import SEGMENT_FORMATS, iter_segment_output, parse_columns, parse_filter
+
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        where, columns, fmt = body.get('where', []), body.get('columns', []), body.get('format', 'ndjson')
+    else:
+        where, columns = request.args.getlist('where'), request.args.getlist('column')
+        fmt = request.args.get('format', 'ndjson')
     try:
-        result = retrain_and_save_model()
-        app.logger.info(f"Retrain job result: {result}")
-    except Exception as exc:
-        app.logger.error(f"Retrain job failed: {exc}")
-        return
+        filters = [parse_filter(expression) for expression in where]
+        columns = parse_columns(columns)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    if fmt not in SEGMENT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(SEGMENT_FORMATS)}"}), 400
 
+    ensure_model_loaded()
+    if model is None or not model_features:
+        return jsonify({"error": "Model not loaded or trained yet. Please retrain the model."}), 503
+
+    # The stream outlives this function, so the admission slot is released when the response closes
+    rejection = admission.try_enter('export')
+    if rejection is not None:
+        return shed_response(rejection)
+    output = iter_segment_output(model, model_features, filters, columns, fmt, fill_missing=model_fill_missing)
     try:
-        load_model_artifact()
-        app.logger.info("Model artifact reloaded after retrain job.")
-    except Exception as exc:
-        app.logger.error(f"Failed to reload model artifact after retraining: {exc}")
+        # Produce the first chunk here so database errors still get a proper status code
+        first = next(output, '')
+    except pool.PoolError:
+        admission.leave('export')
+        return shed_response(admission.pool_exhausted('export'))
+    except Exception as e:
+        admission.leave('export')
+        app.logger.error(f"Error starting segment export: {e}")
+        return jsonify({"error": "Error during segment scoring"}), 500
+
+    response = Response(itertools.chain([first], output),
+                        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'text/csv')
+    response.call_on_close(lambda: (output.close(), admission.leave('export')))
+    return response
+
+# State of the last retrain job started by this process, served by GET /retrain/status
+retrain_status = {'state': 'idle', 'job_id': None, 'started_at': None, 'finished_at': None, 'result': None}
+retrain_profiler = None
+retrain_job_ids = itertools.count(1)
+retrain_status_lock = threading.Lock()
+# One retrain at a time per process: a job started while another runs waits for it, so the
+# newest job always trains on the latest data and saves the artifact last
+retrain_run_lock = threading.Lock()
+
+def start_retrain_job():
+    """
+    Marks a new retrain job as running and starts run_retrain_job in a background thread.
+    The new job becomes the current one: status and profile follow it from now on.
+    """
+    global retrain_profiler
+    from profiling import PipelineProfiler
+    profiler = PipelineProfiler()
+    with retrain_status_lock:
+        job_id = next(retrain_job_ids)
+        retrain_profiler = profiler
+        retrain_status.update(state='running', job_id=job_id, started_at=time.time(), finished_at=None, result=None)
+    thread = threading.Thread(target=run_retrain_job, args=(profiler, job_id))
+    thread.daemon = True  # Allow the main program to exit even if the thread is still running
+    thread.start()
+    return job_id
+
+def finish_retrain_job(job_id, state, result):
+    """Records the outcome of a job, unless a newer job has been started since."""
+    with retrain_status_lock:
+        if job_id is None or retrain_status['job_id'] == job_id:
+            retrain_status.update(state=state, finished_at=time.time(), result=result)
+
+def run_retrain_job(profiler=None, job_id=None):
+    """Background job: retrain model then reload artifact into memory."""
+    with retrain_run_lock:
+        try:
+            from model import retrain_and_save_model
+            result = retrain_and_save_model(profiler=profiler)
+            app.logger.info(f"Retrain job {job_id} result: {result}")
+        except Exception as exc:
+            app.logger.error(f"Retrain job {job_id} failed: {exc}")
+            finish_retrain_job(job_id, 'failed', str(exc))
+            return
+
+        try:
+            load_model_artifact()
+            app.logger.info("Model artifact reloaded after retrain job.")
+        except Exception as exc:
+            app.logger.error(f"Failed to reload model artifact after retraining: {exc}")
+        finish_retrain_job(job_id, 'succeeded', result)
 
 @app.route('/retrain', methods=['POST'])
 def retrain():
     # Run retraining in a background thread to avoid blocking the API
-    thread = threading.Thread(target=run_retrain_job)
-    thread.daemon = True  # Allow the main program to exit even if the thread is still running
-    thread.start()
-    return jsonify({"message": "Model retraining initiated in the background and will auto-reload on completion."}), 202
+    job_id = start_retrain_job()
+    return jsonify({
+        "message": "Model retraining initiated in the background and will auto-reload on completion.",
+        "job_id": job_id,
+    }), 202
+
+def get_training_snapshot():
+    # Evaluate against the artifact on disk: only the worker that retrained has reloaded it
+    reload_model_if_changed()
+    return model_training_snapshot if model is not None else None
+
+# Retrains on data volume / drift thresholds when RETRAIN_SCHEDULER=on (see retrain_scheduler.py)
+retrain_scheduler = RetrainScheduler(
+    get_training_snapshot, start_retrain_job, lambda: retrain_status['state'] == 'running'
+)
+
+@app.before_request
+def start_retrain_scheduler():
+    # Started on the first request so every gunicorn worker gets its own thread after fork
+    retrain_scheduler.ensure_started()
+
+@app.route('/retrain/decisions', methods=['GET'])
+def retrain_decisions():
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        "enabled": retrain_scheduler.enabled,
+        "check_interval_seconds": retrain_scheduler.check_interval,
+        "thresholds": retrain_scheduler.thresholds,
+        "decisions": retrain_scheduler.decisions(limit),
+    }), 200
+
+@app.route('/retrain/status', methods=['GET'])
+def retrain_status_view():
+    """
+    State of the last retrain job in this process with its per-stage profile (stages
+    completed so far while it runs). Before any job ran here, the loaded artifact's profile.
+    """
+    if retrain_profiler is not None:
+        profile = retrain_profiler.report()
+    else:
+        ensure_model_loaded()
+        profile = model_profile
+    return jsonify({**retrain_status, "profile": profile}), 200
+
+@app.route('/recompute/stats', methods=['GET'])
+def recompute_stats():
+    return jsonify(recompute_scheduler.stats()), 200
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats()), 200
 
 @app.route('/reload_model', methods=['POST'])
 def reload_model():
@@ -1,4 +1,7 @@
 from api import app
+from database import db
 
 if __name__ == '__main__':
+    # The local dev server applies the schema itself; deployments run `python database.py`
+    db.create_all_tables()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,5 @@
+from async_api import app
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=5000)
@@ -0,0 +1,266 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import pandas as pd
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Load environment variables from .env file
+load_dotenv()
+
+from async_database import async_db
+from ingest import BulkEventBatcher, extract_events, prepare_event
+from ndjson_stream import NDJSONDecoder
+from recompute import recompute_scheduler
+from event_archive import event_archive
+from admission import ADMISSION_BUDGETS, AdmissionController
+
+logger = logging.getLogger("pltv.async_api")
+
+# Construct path to the model file relative to this script's location
+script_dir = os.path.dirname(os.path.abspath(__file__))
+model_path = os.path.join(script_dir, 'pltv_model.pkl')
+
+# CPU-bound work (unpickling, model.predict) runs here so it
+# never blocks the event loop.
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("PLTV_ASYNC_EXECUTOR_WORKERS", "4")))
+
+BULK_INGEST_BATCH_SIZE = int(os.environ.get("BULK_INGEST_BATCH_SIZE", "1000"))
+BULK_INGEST_MAX_ERRORS = int(os.environ.get("BULK_INGEST_MAX_ERRORS", "100"))
+
+# Same per-class budgets as the Flask app, measured against the asyncpg pool
+admission = AdmissionController(ADMISSION_BUDGETS, async_db.pool_usage)
+
+# Global variables for the loaded model and its features
+model = None
+model_features = []
+# Whether the loaded model expects NaN features filled with 0 (see model_backends)
+model_fill_missing = True
+
+
+def _read_model_artifact():
+    """Reads and validates the model artifact. Returns (model, features, fill_missing) or (None, [], True)."""
+    if not os.path.exists(model_path):
+        logger.warning("Model artifact 'pltv_model.pkl' not found. Predictions will not be available until a model is trained.")
+        return None, [], True
+    model_artifact = joblib.load(model_path)
+    if not isinstance(model_artifact, dict) or 'model' not in model_artifact or 'features' not in model_artifact:
+        logger.error("Model artifact 'pltv_model.pkl' is malformed or incomplete.")
+        return None, [], True
+    logger.info(f"Model artifact loaded successfully. Features: {model_artifact['features']}")
+    # Artifacts from before fill_missing was recorded were all trained on filled features
+    return model_artifact['model'], model_artifact['features'], model_artifact.get('fill_missing', True)
+
+
+async def load_model_artifact():
+    """Loads the model artifact in the executor and swaps it in atomically."""
+    global model, model_features, model_fill_missing
+    loop = asyncio.get_running_loop()
+    try:
+        model, model_features, model_fill_missing = await loop.run_in_executor(executor, _read_model_artifact)
+    except Exception as e:
+        logger.error(f"Model artifact 'pltv_model.pkl' could not be loaded. Error: {e}")
+        model, model_features, model_fill_missing = None, [], True
+
+
+def _predict(current_model, current_features, fill_missing, customer_features_dict):
+    features_df = pd.DataFrame([customer_features_dict])
+    # Align columns with model_features, filling missing with 0 if the model was trained that way
+    X_predict = features_df[current_features]
+    if fill_missing:
+        X_predict = X_predict.fillna(0)
+    return float(current_model.predict(X_predict)[0])
+
+
+def admitted(kind):
+    """Sheds requests beyond the admission budget of kind with 429/503 and Retry-After."""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            rejection = admission.try_enter(kind)
+            if rejection is None:
+                try:
+                    return await endpoint(request)
+                finally:
+                    admission.leave(kind)
+            return JSONResponse({"error": rejection.reason}, status_code=rejection.status,
+                                headers={"Retry-After": str(rejection.retry_after)})
+        return wrapper
+    return decorator
+
+
+async def _ingest_prepared_events(prepared_events, raw_events_by_fingerprint):
+    inserted_events = await async_db.ingest_events(prepared_events)
+    if event_archive is not None and inserted_events:
+        # gzip compression is CPU work; keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(executor, event_archive.append, [
+            (record[0], record[3], raw_events_by_fingerprint[record[3]]) for record in inserted_events
+        ])
+
+    # Debounced full recalculation in the shared recompute worker pool (not for duplicates)
+    for customer_id in {record[0] for record in inserted_events if record[2] == 'purchase'}:
+        recompute_scheduler.schedule(customer_id)
+    return inserted_events
+
+
+@admitted('ingest')
+async def event(request):
+    try:
+        try:
+            event_data = await request.json()
+        except ValueError:
+            event_data = None
+        if event_data is None:
+            logger.error("Incoming request body is not valid JSON or is empty.")
+            return JSONResponse({"error": "Invalid JSON or empty request body"}, status_code=400)
+
+        events = extract_events(event_data)
+        if not events:
+            logger.error("Incoming event data must contain a top-level 'events' list or be a valid GA4 event object.")
+            return JSONResponse({"error": "Invalid event data format: expecting 'events' list or single event object"}, status_code=400)
+
+        prepared_events = []
+        raw_events_by_fingerprint = {}
+        for single_event in events:
+            prepared = prepare_event(single_event)
+            if prepared is None:
+                logger.error("Skipping event: not a JSON object or 'user_pseudo_id'/'client_id' not found in event payload.")
+                continue
+            prepared_events.append(prepared)
+            raw_events_by_fingerprint[prepared[3]] = single_event
+
+        if not prepared_events:
+            return JSONResponse({"error": "No valid events with customer_id found in the payload"}, status_code=400)
+
+        inserted_events = await _ingest_prepared_events(prepared_events, raw_events_by_fingerprint)
+
+        return JSONResponse({
+            "message": "Events received and processed",
+            "accepted": len(inserted_events),
+            "duplicates": len(prepared_events) - len(inserted_events),
+        }, status_code=200)
+    except Exception as e:
+        logger.error(f"Error processing event: {e}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+@admitted('ingest')
+async def bulk_events(request):
+    """Streaming NDJSON (optionally gzip) bulk ingestion; same contract as the Flask /events/bulk."""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type not in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return JSONResponse({"error": "Content-Type must be application/x-ndjson"}, status_code=415)
+    content_encoding = request.headers.get('content-encoding', '').strip().lower()
+    if content_encoding not in ('', 'identity', 'gzip'):
+        return JSONResponse({"error": f"Unsupported Content-Encoding: {content_encoding}"}, status_code=415)
+
+    batcher = BulkEventBatcher(BULK_INGEST_BATCH_SIZE, BULK_INGEST_MAX_ERRORS)
+
+    async def flush():
+        batch, raw_events_by_fingerprint = batcher.take_batch()
+        if batch:
+            inserted_events = await _ingest_prepared_events(batch, raw_events_by_fingerprint)
+            batcher.record_written(len(batch), len(inserted_events))
+
+    decoder = NDJSONDecoder(gzip=content_encoding == 'gzip')
+    try:
+        async for chunk in request.stream():
+            for parsed_line in decoder.feed(chunk):
+                if batcher.add_line(*parsed_line):
+                    await flush()
+        for parsed_line in decoder.close():
+            batcher.add_line(*parsed_line)
+        await flush()
+    except zlib.error as e:
+        # Batches before the corrupt part are already committed; report what happened so far
+        return JSONResponse({"error": f"Invalid gzip body: {e}", **batcher.result()}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error processing bulk events: {e}")
+        return JSONResponse({"error": "Internal server error", **batcher.result()}, status_code=500)
+
+    return JSONResponse({"message": "Bulk events processed", **batcher.result()}, status_code=200)
+
+
+@admitted('predict')
+async def predict(request):
+    customer_id = None
+    if request.method == 'GET':
+        customer_id = request.query_params.get('customer_id')
+    else:
+        try:
+            request_data = await request.json()
+        except ValueError:
+            request_data = None
+        if isinstance(request_data, dict):
+            customer_id = request_data.get('customer_id')
+
+    if not customer_id:
+        return JSONResponse({"error": "customer_id is required"}, status_code=400)
+
+    # Snapshot the globals so a concurrent reload can't mix model and feature list
+    current_model, current_features, fill_missing = model, model_features, model_fill_missing
+    if current_model is None or not current_features:
+        return JSONResponse({"error": "Model not loaded or trained yet. Please retrain the model."}, status_code=503)
+
+    customer_features_dict = await async_db.get_customer_features(customer_id)
+    if not customer_features_dict:
+        return JSONResponse({"error": f"No features found for customer_id: {customer_id}"}, status_code=404)
+
+    try:
+        loop = asyncio.get_running_loop()
+        prediction = await loop.run_in_executor(
+            executor, _predict, current_model, current_features, fill_missing, customer_features_dict
+        )
+        return JSONResponse({"pltv": prediction}, status_code=200)
+    except Exception as e:
+        logger.error(f"Error during prediction for customer {customer_id}: {e}")
+        return JSONResponse({"error": "Error during prediction"}, status_code=500)
+
+
+async def reload_model(request):
+    secret = request.query_params.get('secret')
+    if secret != os.environ.get("RETRAIN_SECRET_KEY"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    await load_model_artifact()
+    return JSONResponse({"message": "Model reload initiated."}, status_code=200)
+
+
+async def recompute_stats(request):
+    return JSONResponse(recompute_scheduler.stats(), status_code=200)
+
+
+async def admission_stats(request):
+    return JSONResponse(admission.stats(), status_code=200)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await async_db.connect()
+    await load_model_artifact()
+    try:
+        yield
+    finally:
+        await async_db.close()
+        executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/event', event, methods=['PUT', 'POST']),
+        Route('/events/bulk', bulk_events, methods=['POST']),
+        Route('/predict', predict, methods=['GET', 'POST']),
+        Route('/reload_model', reload_model, methods=['POST']),
+        Route('/recompute/stats', recompute_stats, methods=['GET']),
+        Route('/admission/stats', admission_stats, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
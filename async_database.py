@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import asyncpg
+from database import COLD_DELTA_COLUMNS, HOT_FEATURE_COLUMNS, epoch_to_datetime
+from ingest import aggregate_feature_deltas, EVENT_TIME_COLUMNS
+from dedup import recent_fingerprints
+from windows import BUCKET_COLUMNS, aggregate_daily_activity
+
+
+class AsyncDatabase:
+    """
+    asyncio counterpart of database.Database for the ASGI server.
+
+    Uses its own asyncpg pool, so the async server never blocks an event loop thread on
+    a Postgres round trip. Only the methods needed by the ingestion/prediction endpoints
+    are implemented; schema management stays in database.Database.
+    """
+
+    def __init__(self, min_conn=1, max_conn=50):
+        self.database_url = os.environ.get("DATABASE_URL")
+        self.min_conn = min_conn
+        self.max_conn = max_conn
+        self.pool = None
+
+    async def connect(self):
+        """Creates the connection pool. Must be awaited on server startup."""
+        if not self.database_url:
+            raise ValueError("DATABASE_URL environment variable not set")
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                self.database_url,
+                min_size=self.min_conn,
+                max_size=self.max_conn,
+                init=self._init_connection,
+            )
+
+    async def close(self):
+        """Closes the connection pool."""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def pool_usage(self):
+        """Returns (connections checked out, pool size) for admission control."""
+        if self.pool is None:
+            return 0, self.max_conn
+        return self.pool.get_size() - self.pool.get_idle_size(), self.max_conn
+
+    @staticmethod
+    async def _init_connection(conn):
+        # Decode/encode JSONB as Python objects, matching psycopg2's behaviour
+        await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def get_customer_features(self, customer_id):
+        """Retrieves pre-aggregated features for a specific customer."""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM customer_features WHERE customer_id = $1", customer_id)
+        return dict(row) if row else None
+
+    async def ingest_events(self, records):
+        """
+        Async version of Database.ingest_events: one transaction per batch, with the
+        customers, events and aggregated counter deltas each written by a single statement.
+        Duplicates are dropped by fingerprint and never update features. Returns the
+        records that were actually inserted.
+        """
+        records, _ = recent_fingerprints.drop_known(records)
+        if not records:
+            return []
+        customer_ids = sorted({record[0] for record in records})
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    INSERT INTO customers (customer_id)
+                    SELECT unnest($1::varchar[])
+                    ON CONFLICT (customer_id) DO NOTHING
+                """, customer_ids)
+                inserted_rows = await conn.fetch("""
+                    INSERT INTO customer_events_normalized (customer_id, event_data, fingerprint)
+                    SELECT * FROM unnest($1::varchar[], $2::jsonb[], $3::char(64)[])
+                    ON CONFLICT (fingerprint) DO NOTHING
+                    RETURNING fingerprint
+                """, [record[0] for record in records], [record[1] for record in records],
+                    [record[3] for record in records])
+                inserted_fingerprints = {row['fingerprint'] for row in inserted_rows}
+                inserted = [record for record in records if record[3] in inserted_fingerprints]
+                await self._apply_feature_deltas(conn, aggregate_feature_deltas(inserted))
+                await self._apply_daily_activity(conn, aggregate_daily_activity(inserted, time.time()))
+
+        recent_fingerprints.remember(record[3] for record in records)
+        return inserted
+
+    @staticmethod
+    async def _apply_feature_deltas(conn, deltas):
+        """Async version of Database._apply_feature_deltas: counters and purchase aggregates are written separately."""
+        customer_ids = sorted(deltas)
+        if not customer_ids:
+            return
+        purchasers = [customer_id for customer_id in customer_ids if deltas[customer_id]['number_of_purchases']]
+        others = [customer_id for customer_id in customer_ids if not deltas[customer_id]['number_of_purchases']]
+        counted = [customer_id for customer_id in customer_ids
+                   if any(deltas[customer_id][col] for col in HOT_FEATURE_COLUMNS)]
+        event_times = {col: {customer_id: epoch_to_datetime(deltas[customer_id].get(col)) for customer_id in customer_ids}
+                       for col in EVENT_TIME_COLUMNS}
+        if purchasers:
+            await conn.execute(f"""
+                INSERT INTO customer_feature_aggregates
+                    (customer_id, {", ".join(COLD_DELTA_COLUMNS)}, {", ".join(EVENT_TIME_COLUMNS)})
+                SELECT * FROM unnest($1::varchar[], $2::int[], $3::float8[], $4::timestamptz[], $5::timestamptz[])
+                ON CONFLICT (customer_id) DO UPDATE SET
+                    number_of_purchases = customer_feature_aggregates.number_of_purchases + EXCLUDED.number_of_purchases,
+                    total_purchase_value = customer_feature_aggregates.total_purchase_value + EXCLUDED.total_purchase_value,
+                    days_since_last_purchase = 0,
+                    first_event_at = CASE WHEN customer_feature_aggregates.first_event_at IS NOT NULL
+                        THEN LEAST(customer_feature_aggregates.first_event_at, EXCLUDED.first_event_at) END,
+                    last_purchase_at = GREATEST(customer_feature_aggregates.last_purchase_at, EXCLUDED.last_purchase_at),
+                    updated_at = CURRENT_TIMESTAMP
+            """, purchasers, *[[deltas[customer_id][col] for customer_id in purchasers] for col in COLD_DELTA_COLUMNS],
+                *[[event_times[col][customer_id] for customer_id in purchasers] for col in EVENT_TIME_COLUMNS])
+        if others:
+            await conn.execute("""
+                INSERT INTO customer_feature_aggregates (customer_id, first_event_at)
+                SELECT * FROM unnest($1::varchar[], $2::timestamptz[])
+                ON CONFLICT (customer_id) DO UPDATE SET first_event_at = EXCLUDED.first_event_at
+                WHERE EXCLUDED.first_event_at < customer_feature_aggregates.first_event_at
+            """, others, [event_times['first_event_at'][customer_id] for customer_id in others])
+        if counted:
+            await conn.execute(f"""
+                INSERT INTO customer_feature_counters (customer_id, {", ".join(HOT_FEATURE_COLUMNS)})
+                SELECT * FROM unnest($1::varchar[], $2::int[], $3::int[], $4::int[])
+                ON CONFLICT (customer_id) DO UPDATE SET
+                    number_of_page_views = customer_feature_counters.number_of_page_views + EXCLUDED.number_of_page_views,
+                    add_to_cart_count = customer_feature_counters.add_to_cart_count + EXCLUDED.add_to_cart_count,
+                    begin_checkout_count = customer_feature_counters.begin_checkout_count + EXCLUDED.begin_checkout_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, counted, *[[deltas[customer_id][col] for customer_id in counted] for col in HOT_FEATURE_COLUMNS])
+
+    @staticmethod
+    async def _apply_daily_activity(conn, buckets):
+        """Async version of Database._apply_daily_activity."""
+        if not buckets:
+            return
+        keys = sorted(buckets)
+        await conn.execute(f"""
+            INSERT INTO customer_daily_activity (customer_id, day, {", ".join(BUCKET_COLUMNS)})
+            SELECT * FROM unnest($1::varchar[], $2::date[], $3::int[], $4::float8[], $5::int[], $6::int[])
+            ON CONFLICT (customer_id, day) DO UPDATE SET
+                {", ".join(f"{column} = customer_daily_activity.{column} + EXCLUDED.{column}" for column in BUCKET_COLUMNS)}
+        """, [key[0] for key in keys], [key[1] for key in keys],
+            *[[buckets[key][i] for key in keys] for i in range(len(BUCKET_COLUMNS))])
+
+
+# --- Global Async Database Instance ---
+async_db = AsyncDatabase()
@@ -1,45 +1,126 @@
-import json
-import pandas as pd
 from database import db
-from features import calculate_features
+from features import build_event_frame, calculate_features
+from ingest import normalize_stored_events
+from snapshots import SNAPSHOT_SAFETY_LAG, iter_customer_features
 
 
-def backfill():
+# Name of the incremental backfill's row in pipeline_watermarks
+BACKFILL_WATERMARK = 'backfill_features'
+BACKFILL_BATCH_SIZE = 500
+
+
+def backfill(full=False):
     """
     Rebuilds customer_features from customer_events_normalized.
     Safe to run multiple times; uses upsert on customer_id.
+
+    Each customer's features come from their snapshot plus the events after its watermark,
+    and long tails are compacted into new snapshots as a side effect.
+
+    Only customers with events after the persisted backfill watermark are recomputed
+    (every customer on the first run or with full=True), so a nightly run costs time
+    proportional to the day's activity. The watermark is advanced in the same transaction
+    as the last feature batch, and only to events older than the snapshot safety lag, so
+    late-committing inserts are picked up by the next run.
+
+    Returns the number of customers recomputed.
+    """
+    watermark = db.get_watermark(BACKFILL_WATERMARK)
+    # Fix the new watermark before scanning: everything up to it is covered by this run
+    new_watermark = db.get_safe_event_watermark(watermark or 0, SNAPSHOT_SAFETY_LAG.total_seconds())
+
+    if full or watermark is None:
+        customer_ids = None
+        print("Backfilling features for every customer...")
+    else:
+        customer_ids = db.get_customers_with_events_after(watermark)
+        print(f"Backfilling features for {len(customer_ids)} customers with events after id {watermark}...")
+
+    batch = []
+    recomputed = 0
+    failed = False
+    if customer_ids is None or customer_ids:
+        for features_dict in iter_customer_features(customer_ids=customer_ids, compact=True):
+            batch.append(features_dict)
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                failed = not _upsert_batch(batch) or failed
+                recomputed += len(batch)
+                batch = []
+
+    if failed:
+        # Leave the watermark where it was so the next run retries the failed customers
+        _upsert_batch(batch)
+        print("Some feature batches failed; backfill watermark not advanced.")
+    elif _upsert_batch(batch, watermark=(BACKFILL_WATERMARK, new_watermark)):
+        print(f"Backfill watermark advanced to event id {new_watermark}.")
+    print(f"Pruned {db.prune_daily_activity()} expired daily activity buckets.")
+    return recomputed + len(batch)
+
+
+def backfill_duckdb():
+    """
+    Rebuilds customer_features for every customer with one DuckDB scan over the exported
+    event segments (see analytics.py) instead of per-customer folds. Advances the backfill
+    watermark like backfill(full=True), so incremental runs can follow.
+
+    Returns the number of customers written.
+    """
+    import analytics
+
+    watermark = db.get_watermark(BACKFILL_WATERMARK)
+    new_watermark = db.get_safe_event_watermark(watermark or 0, SNAPSHOT_SAFETY_LAG.total_seconds())
+    features_df = analytics.compute_features_frame()
+    rows = features_df.to_dict('records')
+
+    failed = False
+    batches = [rows[start:start + BACKFILL_BATCH_SIZE] for start in range(0, len(rows), BACKFILL_BATCH_SIZE)] or [[]]
+    for batch in batches[:-1]:
+        failed = not _upsert_batch(batch) or failed
+    if failed:
+        _upsert_batch(batches[-1])
+        print("Some feature batches failed; backfill watermark not advanced.")
+    elif _upsert_batch(batches[-1], watermark=(BACKFILL_WATERMARK, new_watermark)):
+        print(f"Backfill watermark advanced to event id {new_watermark}.")
+    return len(rows)
+
+
+def _upsert_batch(batch, watermark=None):
+    try:
+        db.upsert_customer_features_many(batch, watermark=watermark)
+        return True
+    except Exception as exc:
+        print(f"Failed to upsert features for {len(batch)} customers: {exc}")
+        return False
+
+
+def backfill_full_replay():
+    """
+    Rebuilds customer_features by replaying every customer's entire event history through
+    calculate_features, over one typed event frame (see features.build_event_frame).
+    Slower than backfill(); kept as a reference path.
     """
     rows = db.get_all_customer_events()  # [(customer_id, event_data, created_at), ...]
-    events_by_customer = {}
-
-    for customer_id, raw_event, _ in rows:
-        evt = raw_event
-        if isinstance(evt, str):
-            try:
-                evt = json.loads(evt)
-            except Exception:
-                continue
-        if not isinstance(evt, dict):
-            continue
-        evt = dict(evt)
-        evt.setdefault("customer_id", customer_id)
-        if "event_name" in evt and isinstance(evt["event_name"], str):
-            evt["event_name"] = evt["event_name"].lower()
-        events_by_customer.setdefault(customer_id, []).append(evt)
-
-    for customer_id, events in events_by_customer.items():
-        if not events:
-            continue
-        df = pd.DataFrame(events)
-        features_df = calculate_features(df)
-        if features_df.empty:
-            continue
-        features_dict = features_df.iloc[0].to_dict()
-        try:
-            db.upsert_customer_features(features_dict)
-        except Exception as exc:
-            print(f"Failed to upsert features for {customer_id}: {exc}")
+    events_df, items_df = build_event_frame(
+        evt for customer_id, raw_event, _ in rows
+        for evt in normalize_stored_events(customer_id, [raw_event])
+    )
+    del rows
+    features_df = calculate_features(events_df, items_df)
+    if features_df.empty:
+        return
+    records = features_df.to_dict('records')
+    for start in range(0, len(records), BACKFILL_BATCH_SIZE):
+        _upsert_batch(records[start:start + BACKFILL_BATCH_SIZE])
 
 
 if __name__ == "__main__":
-    backfill()
+    import sys
+    if "--full-replay" in sys.argv:
+        backfill_full_replay()
+    elif "--duckdb" in sys.argv:
+        backfill_duckdb()
+    elif "--daily-activity" in sys.argv:
+        # Rebuilds the rolling-window buckets from the events (e.g. after enabling them)
+        db.rebuild_daily_activity()
+    else:
+        backfill(full="--full" in sys.argv)
@@ -0,0 +1,41 @@
+"""
+Benchmarks training time, validation MAE and serving cost of each model backend on the
+same training features:
+
+    python bench_backends.py --backend random_forest --backend hist_gradient_boosting
+"""
+import argparse
+
+from model import build_training_features, train_model
+from model_backends import BACKENDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model backends on the same training data.")
+    parser.add_argument('--backend', action='append', choices=sorted(BACKENDS),
+                        help="Backend to benchmark (repeatable, defaults to all).")
+    parser.add_argument('--engine', choices=['snapshot', 'pandas', 'cache', 'duckdb'], help="Training feature engine.")
+    args = parser.parse_args()
+
+    features_df = build_training_features(args.engine)
+    if features_df is None or features_df.empty:
+        print("No data available to benchmark.")
+        return
+
+    results = []
+    for name in args.backend or sorted(BACKENDS):
+        artifact = train_model(features_df, backend=name)
+        if artifact:
+            results.append(artifact['metrics'])
+
+    print(f"\n--- Backend comparison on {len(features_df)} customers ---")
+    print(f"{'backend':<24} {'train s':>9} {'MAE':>10} {'RMSE':>10} {'1-row ms':>9} {'1k ms':>8} {'MB':>8}")
+    for metrics in results:
+        serving = metrics['serving']
+        print(f"{metrics['backend']:<24} {metrics['training_seconds']:>9.1f} {metrics['mae']:>10.2f} "
+              f"{metrics['rmse']:>10.2f} {serving['single_row_latency_ms']:>9.2f} "
+              f"{serving['batch_latency_ms_per_1k']:>8.1f} {serving['artifact_size_mb']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
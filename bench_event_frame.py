@@ -0,0 +1,88 @@
+"""
+Measures the memory of the pandas feature pipeline on synthetic events:
+
+    object_frame        pd.DataFrame(list of event dicts), the all-object frame the pandas
+                        paths used to build
+    typed_frame         features.build_event_frame (categoricals, float64, datetime64)
+    calculate_features  features over the typed frame, for every customer at once
+
+Reported per stage: wall time, peak traced Python heap (tracemalloc, so numpy/pandas
+buffers are included) and the resulting frame size from memory_usage(deep=True).
+
+    python bench_event_frame.py --events 1000000 --customers 50000
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from features import build_event_frame, calculate_features
+from profiling import PipelineProfiler
+
+EVENT_MIX = ['page_view'] * 6 + ['view_item'] * 2 + ['add_to_cart', 'begin_checkout', 'purchase', 'session_start']
+
+
+def make_events(n_events, n_customers, seed):
+    """Normalized event dicts shaped like the stored projection (see ingest.project_event)."""
+    rng = random.Random(seed)
+    now = time.time()
+    # GA4 client ids look like "<random>.<first visit timestamp>"
+    customer_ids = [f"{rng.randrange(10**9, 10**10)}.{int(now) - rng.randrange(10**7)}" for _ in range(n_customers)]
+    events = []
+    for _ in range(n_events):
+        event_name = rng.choice(EVENT_MIX)
+        evt = {
+            'customer_id': customer_ids[rng.randrange(n_customers)],
+            'event_name': event_name,
+            'timestamp_micros': int((now - rng.random() * 365 * 86400) * 1_000_000),
+        }
+        if event_name in ('purchase', 'view_item', 'add_to_cart'):
+            evt['items'] = [{
+                'item_id': f"SKU_{rng.randrange(5000)}",
+                'item_brand': f"Brand {rng.randrange(200)}",
+                'quantity': rng.randrange(1, 4),
+                'price': round(rng.uniform(5, 200), 2),
+            } for _ in range(rng.randrange(1, 4))]
+        if event_name == 'purchase':
+            evt['value'] = round(sum(item['price'] * item['quantity'] for item in evt['items']), 2)
+        events.append(evt)
+    return events
+
+
+def frame_mb(*frames):
+    return sum(frame.memory_usage(deep=True).sum() for frame in frames) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of object vs typed event frames in the feature pipeline.")
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"Generating {args.events} events for {args.customers} customers...")
+    events = make_events(args.events, args.customers, args.seed)
+    profiler = PipelineProfiler(trace_memory=True, cprofile_dir=None)
+
+    with profiler.stage('object_frame', rows_in=len(events)) as stage:
+        object_df = pd.DataFrame(events)
+        stage['frame_mb'] = frame_mb(object_df)
+    del object_df
+    with profiler.stage('typed_frame', rows_in=len(events)) as stage:
+        events_df, items_df = build_event_frame(events)
+        stage['frame_mb'] = frame_mb(events_df, items_df)
+    with profiler.stage('calculate_features', rows_in=len(events_df)) as stage:
+        features_df = calculate_features(events_df, items_df)
+        stage['rows_out'] = len(features_df)
+
+    print(f"{'stage':<20} {'wall s':>8} {'peak MB':>9} {'frame MB':>9} {'bytes/event':>12}")
+    for stage in profiler.report()['stages']:
+        frame = stage.get('frame_mb')
+        print(f"{stage['stage']:<20} {stage['wall_seconds']:>8.2f} {stage['peak_traced_mb']:>9.1f} "
+              f"{frame if frame is not None else float('nan'):>9.1f} "
+              f"{frame * 1024 * 1024 / args.events if frame is not None else float('nan'):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
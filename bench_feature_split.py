@@ -0,0 +1,168 @@
+"""
+Compares per-event counter updates on the old wide customer_features row with the split
+layout (narrow low-fillfactor customer_feature_counters + cold aggregates).
+
+Both layouts are created in a scratch schema with autovacuum disabled, seeded with the same
+customers, and receive the same batches of page_view/add_to_cart/begin_checkout increments
+through the same multi-row upsert used by ingestion. Reported per layout: update throughput,
+the share of heap-only-tuple (HOT) updates, dead tuples left behind, and heap/index size.
+
+    python bench_feature_split.py --customers 50000 --events 500000
+
+Needs DATABASE_URL. The scratch schema is dropped afterwards unless --keep is given.
+"""
+import argparse
+import random
+import time
+
+from psycopg2 import extras
+
+from database import FEATURE_COLUMNS, HOT_FEATURE_COLUMNS, db
+
+SCHEMA = 'bench_feature_split'
+
+COLD_COLUMNS = sorted(FEATURE_COLUMNS - set(HOT_FEATURE_COLUMNS) - {'customer_id'})
+
+LAYOUTS = {
+    # The pre-split table: one wide row per customer, default fillfactor
+    'wide': {
+        'ddl': [f"""
+            CREATE TABLE {SCHEMA}.wide_features (
+                id SERIAL PRIMARY KEY,
+                customer_id VARCHAR(255) UNIQUE NOT NULL,
+                {", ".join(f"{column} FLOAT DEFAULT 0" for column in COLD_COLUMNS)},
+                {", ".join(f"{column} INTEGER DEFAULT 0" for column in HOT_FEATURE_COLUMNS)},
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            ) WITH (autovacuum_enabled = false)
+        """],
+        'table': 'wide_features',
+    },
+    # The split layout, same DDL options as database.create_all_tables
+    'split': {
+        'ddl': [f"""
+            CREATE TABLE {SCHEMA}.cold_features (
+                id SERIAL PRIMARY KEY,
+                customer_id VARCHAR(255) UNIQUE NOT NULL,
+                {", ".join(f"{column} FLOAT DEFAULT 0" for column in COLD_COLUMNS)},
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            ) WITH (autovacuum_enabled = false)
+        """, f"""
+            CREATE TABLE {SCHEMA}.hot_counters (
+                customer_id VARCHAR(255) PRIMARY KEY,
+                {", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in HOT_FEATURE_COLUMNS)},
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            ) WITH (fillfactor = 50, autovacuum_enabled = false)
+        """],
+        'table': 'hot_counters',
+    },
+}
+
+
+def _increment_sql(table):
+    updates = ", ".join(f"{column} = {table}.{column} + EXCLUDED.{column}" for column in HOT_FEATURE_COLUMNS)
+    return f"""
+        INSERT INTO {SCHEMA}.{table} (customer_id, {", ".join(HOT_FEATURE_COLUMNS)}) VALUES %s
+        ON CONFLICT (customer_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+    """
+
+
+def _autocommit(*statements):
+    """Runs statements outside a transaction block (VACUUM cannot run inside one)."""
+    with db.get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for statement in statements:
+                    cur.execute(statement)
+        finally:
+            conn.autocommit = False
+
+
+def setup(customers):
+    with db.get_cursor(commit=True) as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        for layout in LAYOUTS.values():
+            for ddl in layout['ddl']:
+                cur.execute(ddl)
+        ids = [(f"bench-{i:08d}",) for i in range(customers)]
+        for table in ('wide_features', 'cold_features', 'hot_counters'):
+            extras.execute_values(cur, f"INSERT INTO {SCHEMA}.{table} (customer_id) VALUES %s", ids, page_size=5000)
+    # Baseline sizes and statistics after the initial load
+    _autocommit(f"VACUUM ANALYZE {SCHEMA}.wide_features", f"VACUUM ANALYZE {SCHEMA}.hot_counters")
+
+
+def make_batches(customers, events, batch_size, seed):
+    """Random event batches as per-customer deltas, like ingest.aggregate_feature_deltas produces."""
+    rng = random.Random(seed)
+    batches = []
+    for start in range(0, events, batch_size):
+        deltas = {}
+        for _ in range(min(batch_size, events - start)):
+            customer_id = f"bench-{rng.randrange(customers):08d}"
+            delta = deltas.setdefault(customer_id, [0] * len(HOT_FEATURE_COLUMNS))
+            delta[rng.choice([0, 0, 0, 1, 2])] += 1
+        batches.append([(customer_id, *delta) for customer_id, delta in sorted(deltas.items())])
+    return batches
+
+
+def run_updates(table, batches):
+    sql = _increment_sql(table)
+    started = time.perf_counter()
+    for rows in batches:
+        with db.get_cursor(commit=True) as cur:
+            extras.execute_values(cur, sql, rows, page_size=1000)
+    return time.perf_counter() - started
+
+
+def table_stats(table):
+    try:
+        _autocommit("SELECT pg_stat_force_next_flush()")  # PostgreSQL 15+
+    except Exception:
+        pass
+    time.sleep(1.5)  # statistics are reported asynchronously
+    with db.get_cursor() as cur:
+        cur.execute("""
+            SELECT n_tup_upd, n_tup_hot_upd, n_dead_tup,
+                   pg_relation_size(relid), pg_indexes_size(relid)
+            FROM pg_stat_user_tables WHERE schemaname = %s AND relname = %s
+        """, (SCHEMA, table))
+        updated, hot, dead, heap_bytes, index_bytes = cur.fetchone()
+    return {
+        'updates': updated,
+        'hot_updates_pct': 100.0 * hot / updated if updated else 0.0,
+        'dead_tuples': dead,
+        'heap_mb': heap_bytes / (1024 * 1024),
+        'index_mb': index_bytes / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counter update throughput and bloat: wide row vs split tables.")
+    parser.add_argument('--customers', type=int, default=50000)
+    parser.add_argument('--events', type=int, default=500000)
+    parser.add_argument('--batch-size', type=int, default=500, help="Events per ingestion batch/transaction.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch schema for inspection.")
+    args = parser.parse_args()
+
+    print(f"Seeding {args.customers} customers in schema {SCHEMA}...")
+    setup(args.customers)
+    batches = make_batches(args.customers, args.events, args.batch_size, args.seed)
+    try:
+        before = {name: table_stats(layout['table']) for name, layout in LAYOUTS.items()}
+        print(f"{'layout':<8} {'events/s':>10} {'HOT %':>7} {'dead tuples':>12} {'heap MB':>16} {'index MB':>16}")
+        for name, layout in LAYOUTS.items():
+            seconds = run_updates(layout['table'], batches)
+            after = table_stats(layout['table'])
+            print(f"{name:<8} {args.events / seconds:>10.0f} {after['hot_updates_pct']:>7.1f} {after['dead_tuples']:>12} "
+                  f"{before[name]['heap_mb']:>7.1f} -> {after['heap_mb']:<6.1f} "
+                  f"{before[name]['index_mb']:>7.1f} -> {after['index_mb']:<6.1f}")
+    finally:
+        if not args.keep:
+            with db.get_cursor(commit=True) as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
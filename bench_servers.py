@@ -0,0 +1,86 @@
+"""
+Load benchmark for the pLTV API servers.
+
+Fires a fixed number of /event and /predict requests at a base URL with a configurable
+number of concurrent in-flight requests, then reports throughput, latency percentiles
+and error counts. Run it once against the Flask app (gunicorn app:app) and once against
+the async server (uvicorn asgi_app:app) with the same settings to compare them.
+
+Example:
+    python bench_servers.py --base-url http://127.0.0.1:5000 --requests 5000 --concurrency 1000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_benchmark(base_url, total_requests, concurrency, customers, predict_ratio):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    status_counts = {}
+    errors = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+
+        async def one_request(i):
+            nonlocal errors
+            customer_id = f"bench_customer_{i % customers}"
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    if predict_ratio and i % predict_ratio == 0:
+                        response = await client.post("/predict", json={"customer_id": customer_id})
+                    else:
+                        payload = {"events": [{
+                            "event_name": "page_view",
+                            "client_id": customer_id,
+                            "timestamp_micros": int(time.time() * 1_000_000),
+                        }]}
+                        response = await client.post("/event", json=payload)
+                    status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "status_counts": status_counts,
+        "transport_errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pLTV API (Flask or async server).")
+    parser.add_argument('--base-url', default="http://127.0.0.1:5000")
+    parser.add_argument('--requests', type=int, default=2000, help="Total number of requests to send.")
+    parser.add_argument('--concurrency', type=int, default=200, help="Maximum in-flight requests.")
+    parser.add_argument('--customers', type=int, default=100, help="Number of distinct customer IDs to spread load over.")
+    parser.add_argument('--predict-ratio', type=int, default=10,
+                        help="Send a /predict for every Nth request (0 disables predictions).")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.base_url, args.requests, args.concurrency, args.customers, args.predict_ratio))
+    print(f"--- Benchmark against {args.base_url} ---")
+    for key, value in result.items():
+        print(f"{key}: {value}")
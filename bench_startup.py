@@ -0,0 +1,95 @@
+"""
+Measures API cold-start cost: the time to import api.py in a fresh interpreter, and the
+time from launching gunicorn until the first /predict request is answered.
+
+    python bench_startup.py                 # current working tree
+    python bench_startup.py --ref HEAD~1    # the same measurements on another git revision
+
+A revision is measured from a temporary git worktree, so before/after numbers come from
+identical runs. Needs DATABASE_URL for the first-request measurement.
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import api; print(time.perf_counter() - t)"
+
+
+def measure_import(workdir, repeats):
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=workdir,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(workdir, customer_id, timeout=120.0):
+    """Launches gunicorn and returns the seconds until /predict first answers (any status)."""
+    port = _free_port()
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", "1", "api:app"]
+    if os.path.exists(os.path.join(workdir, "gunicorn.conf.py")):
+        command[3:3] = ["-c", "gunicorn.conf.py"]
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                requests.get(f"http://127.0.0.1:{port}/predict", params={"customer_id": customer_id}, timeout=timeout)
+                return time.perf_counter() - started
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.05)
+        raise TimeoutError("server did not answer in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import time and time-to-first-request.")
+    parser.add_argument("--ref", help="Git revision to measure instead of the working tree.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--customer-id", default="bench-startup")
+    parser.add_argument("--skip-server", action="store_true", help="Only measure the import time.")
+    args = parser.parse_args()
+
+    workdir = os.path.dirname(os.path.abspath(__file__))
+    worktree = None
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix="pltv-startup-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=workdir, check=True,
+                       stdout=subprocess.DEVNULL)
+        for name in (".env", "pltv_model.pkl"):
+            if os.path.exists(os.path.join(workdir, name)):
+                shutil.copy(os.path.join(workdir, name), worktree)
+        workdir = worktree
+
+    try:
+        timings = measure_import(workdir, args.repeats)
+        print(f"import api: median {statistics.median(timings) * 1000:.0f} ms "
+              f"(min {min(timings) * 1000:.0f} ms, {args.repeats} runs)")
+        if not args.skip_server:
+            first = [measure_first_request(workdir, args.customer_id) for _ in range(args.repeats)]
+            print(f"time to first /predict: median {statistics.median(first) * 1000:.0f} ms "
+                  f"(min {min(first) * 1000:.0f} ms, {args.repeats} runs)")
+    finally:
+        if worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+if __name__ == "__main__":
+    main()
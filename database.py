@@ -1,31 +1,224 @@
 import os
+import threading
+import time
 import psycopg2
 from psycopg2 import pool
 from contextlib import contextmanager
 import json
+import csv
+import io
 from psycopg2 import extras
+from datetime import datetime, timezone
+from ingest import aggregate_feature_deltas, COUNTER_COLUMNS, DELTA_COLUMNS, EVENT_TIME_COLUMNS
+from dedup import recent_fingerprints
+from windows import (BUCKET_COLUMNS, MAX_WINDOW_DAYS, WINDOW_DAYS, WINDOW_FEATURE_COLUMNS,
+                     aggregate_daily_activity, utc_day, window_start)
+
+# Whitelist of customer_features columns writable by upserts (prevents SQL injection on column names)
+FEATURE_COLUMNS = {
+    'customer_id', 'total_purchase_value', 'number_of_purchases', 'average_purchase_value',
+    'total_items_purchased', 'distinct_products_purchased', 'distinct_brands_purchased',
+    'distinct_products_viewed', 'distinct_brands_viewed', 'number_of_page_views',
+    'days_since_last_purchase', 'time_since_first_event', 'purchase_frequency', 'pltv',
+    'add_to_cart_count', 'begin_checkout_count'
+}
+
+# Counters bumped by every page_view/add_to_cart/begin_checkout. They live in the narrow
+# customer_feature_counters table; every other feature lives in customer_feature_aggregates.
+HOT_FEATURE_COLUMNS = list(COUNTER_COLUMNS.values())
+COLD_DELTA_COLUMNS = [column for column in DELTA_COLUMNS if column not in HOT_FEATURE_COLUMNS]
+
+# Everything readable from customer_features: the stored features plus the rolling windows
+# summed from customer_daily_activity at read time (see windows.py)
+READABLE_FEATURE_COLUMNS = FEATURE_COLUMNS | set(WINDOW_FEATURE_COLUMNS)
+
+# Comparison operators accepted in segment filters (see segments.py)
+SEGMENT_OPERATORS = {'=', '!=', '>', '>=', '<', '<='}
+
+_UTC_TODAY = "(CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date"
+
+# Per-customer sums of the daily buckets over every window, aliased like WINDOW_FEATURE_COLUMNS
+_WINDOW_SUMS = ", ".join(f"SUM(d.{column}) FILTER (WHERE d.day > {_UTC_TODAY} - {days}) AS {column}_{days}d"
+                         for days in WINDOW_DAYS for column in BUCKET_COLUMNS)
+
+# Whole days from a stored TIMESTAMPTZ column until now, floored like the feature builders
+def _days_since(column):
+    return f"floor(extract(epoch FROM CURRENT_TIMESTAMP - a.{column}) / 86400)"
+
+# Time-relative features are derived from first_event_at/last_purchase_at at read time, so
+# they keep ageing for customers without new events. Rows written before those timestamps
+# were stored fall back to the values computed at write time.
+_TIME_RELATIVE_SELECTS = {
+    'days_since_last_purchase': f"""CASE WHEN a.last_purchase_at IS NULL THEN a.days_since_last_purchase
+            ELSE {_days_since('last_purchase_at')}::integer END""",
+    'time_since_first_event': f"""CASE WHEN a.first_event_at IS NULL THEN a.time_since_first_event
+            ELSE GREATEST({_days_since('first_event_at')}, 1)::integer END""",
+    'purchase_frequency': f"""CASE WHEN a.first_event_at IS NULL THEN a.purchase_frequency
+            ELSE (a.number_of_purchases / GREATEST({_days_since('first_event_at')}, 1))::float8 END""",
+}
+# Features whose value changes with the clock alone, without a row update
+READ_TIME_FEATURE_COLUMNS = list(_TIME_RELATIVE_SELECTS) + WINDOW_FEATURE_COLUMNS
+
+# Read path over the two tables; every customer with features has an aggregates row.
+# Window columns come last so CREATE OR REPLACE VIEW can add them to an existing view.
+CUSTOMER_FEATURES_VIEW = f"""
+    CREATE OR REPLACE VIEW customer_features AS
+    SELECT
+        a.customer_id,
+        {", ".join(f"{_TIME_RELATIVE_SELECTS[column]} AS {column}" if column in _TIME_RELATIVE_SELECTS else f"a.{column}"
+                   for column in sorted(FEATURE_COLUMNS - set(HOT_FEATURE_COLUMNS) - {'customer_id'}))},
+        {", ".join(f"COALESCE(c.{column}, 0) AS {column}" for column in HOT_FEATURE_COLUMNS)},
+        GREATEST(a.updated_at, c.updated_at) AS updated_at,
+        {", ".join(f"COALESCE(w.{column}, 0) AS {column}" for column in WINDOW_FEATURE_COLUMNS)}
+    FROM customer_feature_aggregates a
+    LEFT JOIN customer_feature_counters c USING (customer_id)
+    LEFT JOIN LATERAL (
+        SELECT {_WINDOW_SUMS}
+        FROM customer_daily_activity d
+        WHERE d.customer_id = a.customer_id AND d.day > {_UTC_TODAY} - {MAX_WINDOW_DAYS}
+    ) w ON TRUE
+"""
+
+def epoch_to_datetime(seconds):
+    """Epoch seconds as an aware UTC datetime; None or NaN (no such event) becomes NULL."""
+    if seconds is None or seconds != seconds:
+        return None
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
 
 class Database:
-    def __init__(self, min_conn=1, max_conn=10):
-        self.database_url = os.environ.get("DATABASE_URL")
-        if not self.database_url:
-            raise ValueError("DATABASE_URL environment variable not set")
-        self.pool = pool.SimpleConnectionPool(min_conn, max_conn, self.database_url)
+    """
+    Connection pool wrapper. Constructing it has no side effects: the pool is opened on
+    first use, DATABASE_URL is read at that point (so a later load_dotenv still applies),
+    and a forked child (e.g. a gunicorn worker of a preloaded master) opens its own pool
+    instead of sharing the parent's sockets. Schema changes are an explicit step
+    (python database.py), not part of startup.
+
+    Read-only scans and lookups can be served by read replicas: set DATABASE_REPLICA_URLS
+    to a comma-separated list of DSNs. Each replica gets its own pool and replicas are
+    used round-robin; writes always go to the primary (DATABASE_URL). Code that must read
+    its own writes wraps the reads in `with db.primary_reads():`. Without replicas, or when
+    a replica cannot be reached, every read goes to the primary.
+    """
+
+    def __init__(self, min_conn=1, max_conn=10, replica_urls=None):
+        self.min_conn = min_conn
+        self.max_conn = max_conn
+        self.database_url = None
+        self.replica_urls = replica_urls
+        self._pool = None
+        self._replica_pools = None
+        self._replica_turn = 0
+        self._pool_lock = threading.Lock()
+        self._in_use = 0
+        self._local = threading.local()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_pool)
+
+    @property
+    def pool(self):
+        """The connection pool, connected on first access."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self.database_url = os.environ.get("DATABASE_URL")
+                    if not self.database_url:
+                        raise ValueError("DATABASE_URL environment variable not set")
+                    self._pool = pool.ThreadedConnectionPool(self.min_conn, self.max_conn, self.database_url)
+        return self._pool
+
+    @property
+    def replica_pools(self):
+        """One pool per replica DSN (empty without replicas), created on first access."""
+        if self._replica_pools is None:
+            with self._pool_lock:
+                if self._replica_pools is None:
+                    if self.replica_urls is None:
+                        self.replica_urls = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+                    # Replica pools connect lazily (minconn=0) so an unreachable replica never blocks startup
+                    self._replica_pools = [pool.ThreadedConnectionPool(0, self.max_conn, url) for url in self.replica_urls]
+        return self._replica_pools
+
+    def _forget_pool(self):
+        # The inherited sockets belong to the parent; closing them here would end its sessions
+        self._pool = None
+        self._replica_pools = None
+        self._pool_lock = threading.Lock()
+        self._in_use = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def primary_reads(self):
+        """Routes every read of the current thread to the primary inside the block (read-your-writes)."""
+        previous = getattr(self._local, 'primary_reads', False)
+        self._local.primary_reads = True
+        try:
+            yield
+        finally:
+            self._local.primary_reads = previous
+
+    def pool_usage(self):
+        """Returns (connections checked out, pool size) for admission control."""
+        return self._in_use, self.max_conn
+
+    def close(self):
+        """Closes every pooled connection; the next use reconnects."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            for replica_pool in self._replica_pools or []:
+                replica_pool.closeall()
+            self._replica_pools = None
 
     @contextmanager
-    def get_connection(self):
-        """Context manager to get a connection from the pool."""
+    def get_connection(self, role='primary'):
+        """
+        Context manager to get a connection from the pool.
+        role='replica' takes it from a replica pool when one is configured and reachable.
+        """
+        if role == 'replica' and not getattr(self._local, 'primary_reads', False) and self.replica_pools:
+            replica_conn = self._get_replica_connection()
+            if replica_conn is not None:
+                replica_pool, conn = replica_conn
+                try:
+                    yield conn
+                finally:
+                    replica_pool.putconn(conn)
+                return
+
+        # Raises pool.PoolError when every connection is checked out (see admission.py)
         conn = self.pool.getconn()
+        with self._pool_lock:
+            self._in_use += 1
         try:
             yield conn
         finally:
+            with self._pool_lock:
+                self._in_use -= 1
             self.pool.putconn(conn)
 
+    def _get_replica_connection(self):
+        """Returns (pool, connection) from the next reachable replica, or None to fall back to the primary."""
+        replica_pools = self.replica_pools
+        for _ in range(len(replica_pools)):
+            with self._pool_lock:
+                self._replica_turn = (self._replica_turn + 1) % len(replica_pools)
+                replica_pool = replica_pools[self._replica_turn]
+            try:
+                return replica_pool, replica_pool.getconn()
+            except (psycopg2.OperationalError, pool.PoolError) as exc:
+                print(f"Replica unavailable, trying the next one or the primary: {exc}")
+        return None
+
     @contextmanager
-    def get_cursor(self, commit=False):
-        """Context manager to get a cursor from a connection."""
-        with self.get_connection() as conn:
-            cur = conn.cursor()
+    def get_cursor(self, commit=False, name=None, role='primary'):
+        """
+        Context manager to get a cursor from a connection.
+        Pass a name to get a server-side cursor that streams rows instead of fetching them all.
+        role='replica' is for read-only queries that may be served by a read replica.
+        """
+        with self.get_connection(role) as conn:
+            cur = conn.cursor(name=name) if name else conn.cursor()
             try:
                 yield cur
                 if commit:
@@ -57,8 +250,25 @@ class Database:
             cur.execute("""
                 CREATE INDEX IF NOT EXISTS idx_customer_events_normalized_customer_id ON customer_events_normalized (customer_id);
             """)
+            # Event fingerprint (see ingest.event_fingerprint) makes ingestion idempotent.
+            # Legacy rows keep a NULL fingerprint, which the unique index ignores.
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS customer_features (
+                ALTER TABLE customer_events_normalized ADD COLUMN IF NOT EXISTS fingerprint CHAR(64);
+            """)
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_customer_events_normalized_fingerprint ON customer_events_normalized (fingerprint);
+            """)
+            # customer_features used to be one wide table; it becomes the cold aggregates table
+            # and customer_features is recreated below as a view over aggregates + counters
+            cur.execute("""
+                DO $$ BEGIN
+                    IF EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = current_schema() AND tablename = 'customer_features') THEN
+                        ALTER TABLE customer_features RENAME TO customer_feature_aggregates;
+                    END IF;
+                END $$;
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS customer_feature_aggregates (
                     id SERIAL PRIMARY KEY,
                     customer_id VARCHAR(255) UNIQUE NOT NULL,
                     total_purchase_value FLOAT DEFAULT 0,
@@ -69,13 +279,94 @@ class Database:
                     distinct_brands_purchased INTEGER DEFAULT 0,
                     distinct_products_viewed INTEGER DEFAULT 0,
                     distinct_brands_viewed INTEGER DEFAULT 0,
-                    number_of_page_views INTEGER DEFAULT 0,
                     days_since_last_purchase INTEGER DEFAULT 0,
                     time_since_first_event INTEGER DEFAULT 0,
                     purchase_frequency FLOAT DEFAULT 0,
                     pltv FLOAT DEFAULT 0,
-                    add_to_cart_count INTEGER DEFAULT 0,
-                    begin_checkout_count INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    first_event_at TIMESTAMP WITH TIME ZONE,
+                    last_purchase_at TIMESTAMP WITH TIME ZONE
+                )
+            """)
+            # Tables created before the time-relative features were derived at read time;
+            # `python backfill_features.py --full` fills the timestamps in
+            cur.execute("""
+                ALTER TABLE customer_feature_aggregates
+                    ADD COLUMN IF NOT EXISTS first_event_at TIMESTAMP WITH TIME ZONE,
+                    ADD COLUMN IF NOT EXISTS last_purchase_at TIMESTAMP WITH TIME ZONE
+            """)
+            # Hot counters: narrow rows, no index on the counter columns and half-empty pages,
+            # so the per-event increments stay small and are pruned without a full vacuum
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS customer_feature_counters (
+                    customer_id VARCHAR(255) PRIMARY KEY,
+                    number_of_page_views INTEGER NOT NULL DEFAULT 0,
+                    add_to_cart_count INTEGER NOT NULL DEFAULT 0,
+                    begin_checkout_count INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                ) WITH (fillfactor = 50, autovacuum_vacuum_scale_factor = 0.05)
+            """)
+            # Move the counters of a pre-split customer_features table over, then drop them there.
+            # Only the old wide layout has the counter columns on the aggregates table.
+            cur.execute("""
+                DO $$ BEGIN
+                    IF (SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = current_schema()
+                        AND table_name = 'customer_feature_aggregates'
+                        AND column_name IN ('number_of_page_views', 'add_to_cart_count', 'begin_checkout_count')) = 3 THEN
+                        DROP VIEW IF EXISTS customer_features;
+                        INSERT INTO customer_feature_counters (customer_id, number_of_page_views, add_to_cart_count, begin_checkout_count, updated_at)
+                        SELECT customer_id, COALESCE(number_of_page_views, 0), COALESCE(add_to_cart_count, 0),
+                               COALESCE(begin_checkout_count, 0), updated_at
+                        FROM customer_feature_aggregates
+                        ON CONFLICT (customer_id) DO NOTHING;
+                        ALTER TABLE customer_feature_aggregates
+                            DROP COLUMN number_of_page_views, DROP COLUMN add_to_cart_count, DROP COLUMN begin_checkout_count;
+                    END IF;
+                END $$;
+            """)
+            # Per-customer, per-UTC-day activity behind the rolling-window features
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS customer_daily_activity (
+                    customer_id VARCHAR(255) NOT NULL,
+                    day DATE NOT NULL,
+                    purchases INTEGER NOT NULL DEFAULT 0,
+                    purchase_value FLOAT NOT NULL DEFAULT 0,
+                    page_views INTEGER NOT NULL DEFAULT 0,
+                    add_to_cart INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (customer_id, day)
+                ) WITH (fillfactor = 70)
+            """)
+            # Incremental readers (see iter_customer_features_rows) select changed rows by updated_at
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_feature_aggregates_updated_at ON customer_feature_aggregates (updated_at)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_feature_counters_updated_at ON customer_feature_counters (updated_at)")
+            cur.execute(CUSTOMER_FEATURES_VIEW)
+            # Resume points of bulk imports (see ga4_export_importer.py)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS import_progress (
+                    source TEXT PRIMARY KEY,
+                    byte_offset BIGINT NOT NULL DEFAULT 0,
+                    rows_imported BIGINT NOT NULL DEFAULT 0,
+                    completed BOOLEAN NOT NULL DEFAULT FALSE,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Compacted per-customer aggregate state covering all events with id <= last_event_id
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS customer_feature_snapshots (
+                    customer_id VARCHAR(255) PRIMARY KEY REFERENCES customers(customer_id) ON DELETE CASCADE,
+                    last_event_id INTEGER NOT NULL,
+                    state JSONB NOT NULL,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Snapshots written before daily buckets were tracked would hide their events from
+            # the windows; drop them so the next recompute replays and re-compacts those customers
+            cur.execute("DELETE FROM customer_feature_snapshots WHERE NOT state ? 'daily'")
+            # Highest customer_events_normalized.id fully processed by each batch pipeline (see backfill_features.py)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS pipeline_watermarks (
+                    name TEXT PRIMARY KEY,
+                    last_event_id BIGINT NOT NULL,
                     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
                 )
             """)
@@ -83,10 +374,62 @@ class Database:
 
     def get_all_customer_events(self):
         """Retrieves all customer event data from the customer_events_normalized table."""
-        with self.get_cursor() as cur:
+        with self.get_cursor(role='replica') as cur:
             cur.execute("SELECT customer_id, event_data, created_at FROM customer_events_normalized ORDER BY customer_id, created_at")
             return cur.fetchall()
 
+    @staticmethod
+    def _event_filters(customer_id=None, event_name=None, since=None, until=None, after_id=None, up_to_id=None):
+        """
+        Builds the WHERE clause and parameters for filtered event scans (time range on
+        created_at, id range after_id < id <= up_to_id).
+        """
+        clauses, params = [], []
+        if customer_id:
+            clauses.append("customer_id = %s")
+            params.append(customer_id)
+        if event_name:
+            clauses.append("event_data->>'event_name' = %s")
+            params.append(event_name.lower())
+        if since:
+            clauses.append("created_at >= %s")
+            params.append(since)
+        if until:
+            clauses.append("created_at < %s")
+            params.append(until)
+        if after_id is not None:
+            clauses.append("id > %s")
+            params.append(after_id)
+        if up_to_id is not None:
+            clauses.append("id <= %s")
+            params.append(up_to_id)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        return where, params
+
+    def iter_events(self, customer_id=None, event_name=None, since=None, until=None, itersize=5000):
+        """
+        Streams (id, customer_id, event_data, created_at) rows matching the filters through a
+        server-side cursor, ordered by id, without loading the result set into memory.
+        """
+        where, params = self._event_filters(customer_id, event_name, since, until)
+        with self.get_cursor(name="event_export", role='replica') as cur:
+            cur.itersize = itersize
+            cur.execute(f"SELECT id, customer_id, event_data, created_at FROM customer_events_normalized {where} ORDER BY id", params)
+            for row in cur:
+                yield row
+
+    def copy_events_csv(self, out, customer_id=None, event_name=None, since=None, until=None, after_id=None, up_to_id=None):
+        """
+        Writes the events matching the filters to the file-like object out as CSV (with a
+        header row) using COPY ... TO STDOUT, so rows stream straight from the server.
+        """
+        where, params = self._event_filters(customer_id, event_name, since, until, after_id, up_to_id)
+        with self.get_cursor(role='replica') as cur:
+            query = cur.mogrify(
+                f"SELECT id, customer_id, created_at, event_data FROM customer_events_normalized {where} ORDER BY id", params
+            ).decode('utf-8')
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", out)
+
     def clear_customers_table(self):
         """Clears the customers table."""
         with self.get_cursor(commit=True) as cur:
@@ -95,13 +438,68 @@ class Database:
 
     def get_customer_events(self, customer_id):
         """Retrieves all event data for a specific customer from the normalized table."""
-        with self.get_cursor() as cur:
+        with self.get_cursor(role='replica') as cur:
             cur.execute("SELECT customer_id, event_data, created_at FROM customer_events_normalized WHERE customer_id = %s ORDER BY created_at ASC", (customer_id,))
             return cur.fetchall()
 
+    def get_customer_snapshot(self, customer_id):
+        """Returns (last_event_id, state) of the customer's feature snapshot, or None."""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT last_event_id, state FROM customer_feature_snapshots WHERE customer_id = %s", (customer_id,))
+            return cur.fetchone()
+
+    def get_customer_events_after(self, customer_id, after_event_id):
+        """Retrieves (id, event_data, created_at) for a customer's events with id > after_event_id, in id order."""
+        with self.get_cursor() as cur:
+            cur.execute("""
+                SELECT id, event_data, created_at FROM customer_events_normalized
+                WHERE customer_id = %s AND id > %s ORDER BY id
+            """, (customer_id, after_event_id))
+            return cur.fetchall()
+
+    def iter_customer_event_tails(self, customer_ids=None, itersize=5000):
+        """
+        Streams every customer's snapshot plus the events after its watermark, through a
+        server-side cursor, as (customer_id, last_event_id, state, event_id, event_data, created_at)
+        rows ordered by customer_id and event id. Customers with a snapshot but no newer events
+        yield one row with NULL event columns. Optionally restricted to customer_ids.
+        """
+        customer_filter = "WHERE c.customer_id = ANY(%(customer_ids)s)" if customer_ids is not None else ""
+        with self.get_cursor(name="customer_event_tails", role='replica') as cur:
+            cur.itersize = itersize
+            cur.execute(f"""
+                SELECT c.customer_id, s.last_event_id, s.state, e.id, e.event_data, e.created_at
+                FROM customers c
+                LEFT JOIN customer_feature_snapshots s ON s.customer_id = c.customer_id
+                LEFT JOIN customer_events_normalized e
+                    ON e.customer_id = c.customer_id AND e.id > COALESCE(s.last_event_id, 0)
+                {customer_filter}
+                ORDER BY c.customer_id, e.id
+            """, {'customer_ids': list(customer_ids) if customer_ids is not None else None})
+            for row in cur:
+                yield row
+
+    def upsert_customer_snapshots(self, snapshots):
+        """
+        Writes (customer_id, last_event_id, state) snapshots. A snapshot never moves its
+        watermark backwards.
+        """
+        if not snapshots:
+            return
+        with self.get_cursor(commit=True) as cur:
+            extras.execute_values(cur, """
+                INSERT INTO customer_feature_snapshots (customer_id, last_event_id, state) VALUES %s
+                ON CONFLICT (customer_id) DO UPDATE SET
+                    last_event_id = EXCLUDED.last_event_id,
+                    state = EXCLUDED.state,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE customer_feature_snapshots.last_event_id < EXCLUDED.last_event_id
+            """, [(customer_id, last_event_id, extras.Json(state)) for customer_id, last_event_id, state in sorted(snapshots, key=lambda snapshot: snapshot[0])],
+                page_size=500)
+
     def get_customer_features(self, customer_id):
         """Retrieves pre-aggregated features for a specific customer."""
-        with self.get_cursor() as cur:
+        with self.get_cursor(role='replica') as cur:
             cur.execute("SELECT * FROM customer_features WHERE customer_id = %s", (customer_id,))
             features = cur.fetchone()
             if features:
@@ -109,162 +507,459 @@ class Database:
                 return dict(zip(colnames, features))
             return None
 
+    def iter_customer_features_rows(self, columns, updated_after=None, itersize=10000):
+        """
+        Streams (customer_id, *columns, updated_at) tuples from customer_features through a
+        server-side cursor, optionally only rows updated after updated_after.
+        """
+        columns = [column for column in columns if column in FEATURE_COLUMNS and column != 'customer_id']
+        where, params = "", None
+        if updated_after is not None:
+            # a.updated_at > %s OR c.updated_at > %s on the base tables, one branch per
+            # updated_at index, instead of filtering the view's GREATEST() row by row
+            where = """WHERE customer_id IN (
+                SELECT customer_id FROM customer_feature_aggregates WHERE updated_at > %s
+                UNION
+                SELECT customer_id FROM customer_feature_counters WHERE updated_at > %s
+            )"""
+            params = (updated_after, updated_after)
+        with self.get_cursor(name="customer_features_rows", role='replica') as cur:
+            cur.itersize = itersize
+            cur.execute(f"""
+                SELECT customer_id, {", ".join(columns)}, updated_at FROM customer_features
+                {where}
+                ORDER BY customer_id
+            """, params)
+            for row in cur:
+                yield row
+
+    def iter_customer_feature_chunks(self, filters=(), chunk_size=10000):
+        """
+        Streams the customer_features rows matching filters, a list of (column, operator,
+        value) with an operator from SEGMENT_OPERATORS, ANDed together. Yields
+        (column_names, rows) chunks of up to chunk_size rows from a server-side cursor.
+        """
+        clauses, params = [], []
+        for column, operator, value in filters:
+            if column not in READABLE_FEATURE_COLUMNS or operator not in SEGMENT_OPERATORS:
+                raise ValueError(f"Unsupported segment filter: {column} {operator}")
+            clauses.append(f"{column} {operator} %s")
+            params.append(value)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        with self.get_cursor(name="customer_feature_segment", role='replica') as cur:
+            cur.itersize = chunk_size
+            cur.execute(f"SELECT * FROM customer_features {where} ORDER BY customer_id", params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [desc[0] for desc in cur.description], rows
+
+    def get_read_time_features(self, customer_ids):
+        """
+        Returns (customer_id, *READ_TIME_FEATURE_COLUMNS) rows for the given customers from
+        the customer_features view: the features that change with the clock alone.
+        """
+        if not customer_ids:
+            return []
+        with self.get_cursor(role='replica') as cur:
+            cur.execute(f"""
+                SELECT customer_id, {", ".join(READ_TIME_FEATURE_COLUMNS)}
+                FROM customer_features WHERE customer_id = ANY(%s)
+            """, (list(customer_ids),))
+            return cur.fetchall()
+
     def clear_customer_features_table(self):
-        """Clears the customer_features table."""
+        """Clears the customer features (aggregates and counters)."""
         with self.get_cursor(commit=True) as cur:
-            cur.execute("DELETE FROM customer_features")
+            cur.execute("DELETE FROM customer_feature_counters")
+            cur.execute("DELETE FROM customer_feature_aggregates")
+            cur.execute("DELETE FROM customer_daily_activity")
         print("Customer features table cleared.")
 
     def clear_all_tables(self):
         """Drops and recreates all tables for a clean slate."""
         with self.get_cursor(commit=True) as cur:
+            cur.execute("DROP TABLE IF EXISTS pipeline_watermarks CASCADE")
+            cur.execute("DROP TABLE IF EXISTS import_progress CASCADE")
+            cur.execute("DROP TABLE IF EXISTS customer_feature_snapshots CASCADE")
+            # Dropping the aggregates table drops the customer_features view with it
+            cur.execute("DROP TABLE IF EXISTS customer_feature_counters CASCADE")
+            cur.execute("DROP TABLE IF EXISTS customer_daily_activity CASCADE")
+            cur.execute("DROP TABLE IF EXISTS customer_feature_aggregates CASCADE")
+            # Pre-split schema, where customer_features is still a table
             cur.execute("DROP TABLE IF EXISTS customer_features CASCADE")
             cur.execute("DROP TABLE IF EXISTS customer_events_normalized CASCADE")
             cur.execute("DROP TABLE IF EXISTS customers CASCADE")
         print("All tables dropped.")
+        recent_fingerprints.clear()
         self.create_all_tables()
         print("All tables recreated.")
 
-    def upsert_event(self, customer_id, event_data):
-        """
-        Inserts a new event into the customer_events_normalized table.
-        Ensures the customer_id exists in the customers table.
+    def get_import_progress(self, source):
+        """Returns (byte_offset, rows_imported, completed) for an import source, or None."""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT byte_offset, rows_imported, completed FROM import_progress WHERE source = %s", (source,))
+            return cur.fetchone()
+
+    def copy_import_chunk(self, source, rows, end_offset, completed=False):
         """
-        if not customer_id:
-            raise ValueError("customer_id must be provided to upsert an event.")
+        Bulk-loads one chunk of prepared events with COPY and records the import offset in
+        the same transaction, so an interrupted import resumes exactly after the last
+        committed chunk. The inserted events inside the longest window are added to
+        customer_daily_activity in that transaction too, like ingest_events does.
 
-        event_json_obj = event_data # event_data is already a dict from api.py
+        Args:
+            source (str): Import source key (e.g. the absolute file path).
+            rows (list): (customer_id, event_json_text, fingerprint) tuples.
+            end_offset (int): Byte offset in the source just after this chunk.
+
+        Returns the number of events inserted (duplicates by fingerprint are skipped).
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
 
         with self.get_cursor(commit=True) as cur:
-            # 1. Ensure customer_id exists in the customers table
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS import_staging (
+                    customer_id VARCHAR(255), event_data JSONB, fingerprint CHAR(64)
+                ) ON COMMIT DELETE ROWS
+            """)
+            cur.copy_expert("COPY import_staging (customer_id, event_data, fingerprint) FROM STDIN WITH (FORMAT csv)", buffer)
             cur.execute("""
                 INSERT INTO customers (customer_id)
-                VALUES (%s)
-                ON CONFLICT (customer_id) DO NOTHING;
-            """, (customer_id,))
-
-            # 2. Insert the new event into customer_events_normalized
+                SELECT DISTINCT customer_id FROM import_staging
+                ON CONFLICT (customer_id) DO NOTHING
+            """)
+            cur.execute("""
+                INSERT INTO customer_events_normalized (customer_id, event_data, fingerprint)
+                SELECT customer_id, event_data, fingerprint FROM import_staging
+                ON CONFLICT (fingerprint) DO NOTHING
+                RETURNING customer_id, event_data
+            """)
+            inserted_rows = cur.fetchall()
+            inserted = len(inserted_rows)
+            now = time.time()
+            cutoff = window_start(utc_day(now), MAX_WINDOW_DAYS)
+            buckets = aggregate_daily_activity(inserted_rows, now)
+            self._apply_daily_activity(cur, {key: bucket for key, bucket in buckets.items() if key[1] > cutoff})
             cur.execute("""
-                INSERT INTO customer_events_normalized (customer_id, event_data)
-                VALUES (%s, %s);
-            """, (customer_id, extras.Json(event_json_obj)))
+                INSERT INTO import_progress (source, byte_offset, rows_imported, completed)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (source) DO UPDATE SET
+                    byte_offset = EXCLUDED.byte_offset,
+                    rows_imported = import_progress.rows_imported + EXCLUDED.rows_imported,
+                    completed = EXCLUDED.completed,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (source, end_offset, inserted, completed))
+        return inserted
 
+    def update_event_payloads(self, payloads):
+        """
+        Replaces the stored event_data of existing events, matched by fingerprint.
+
+        Args:
+            payloads (list): (fingerprint, event_data) tuples.
+
+        Returns the number of rows updated. Used to re-project events from the raw archive.
+        """
+        if not payloads:
+            return 0
+        with self.get_cursor(commit=True) as cur:
+            # cur.rowcount only covers the last page of execute_values, so count the returned rows
+            updated = extras.execute_values(cur, """
+                UPDATE customer_events_normalized AS e
+                SET event_data = v.event_data::jsonb
+                FROM (VALUES %s) AS v(fingerprint, event_data)
+                WHERE e.fingerprint = v.fingerprint
+                RETURNING 1
+            """, [(fingerprint, extras.Json(event_data)) for fingerprint, event_data in payloads], page_size=500, fetch=True)
+            return len(updated)
 
     def upsert_customer_features(self, features_dict):
         """Inserts or updates a customer's features in the database securely."""
-        # Whitelist of allowed columns to prevent SQL injection on column names
-        allowed_columns = {
-            'customer_id', 'total_purchase_value', 'number_of_purchases', 'average_purchase_value',
-            'total_items_purchased', 'distinct_products_purchased', 'distinct_brands_purchased',
-            'distinct_products_viewed', 'distinct_brands_viewed', 'number_of_page_views',
-            'days_since_last_purchase', 'time_since_first_event', 'purchase_frequency', 'pltv',
-            'add_to_cart_count', 'begin_checkout_count'
-        }
-        
-        # Filter the dictionary to only include allowed columns
-        filtered_features = {k: v for k, v in features_dict.items() if k in allowed_columns}
-        
-        if 'customer_id' not in filtered_features:
+        with self.get_cursor(commit=True) as cur:
+            self._upsert_features(cur, [features_dict])
+
+    def upsert_customer_features_many(self, features_rows, watermark=None):
+        """
+        Upserts a batch of feature dicts in one transaction. With watermark=(name, last_event_id)
+        the pipeline watermark is advanced in the same transaction, so it only moves once
+        the features it covers are committed. A watermark never moves backwards.
+        """
+        with self.get_cursor(commit=True) as cur:
+            if features_rows:
+                self._upsert_features(cur, features_rows)
+            if watermark is not None:
+                cur.execute("""
+                    INSERT INTO pipeline_watermarks (name, last_event_id) VALUES (%s, %s)
+                    ON CONFLICT (name) DO UPDATE SET
+                        last_event_id = EXCLUDED.last_event_id,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE pipeline_watermarks.last_event_id < EXCLUDED.last_event_id
+                """, watermark)
+
+    @staticmethod
+    def _upsert_features(cur, features_rows):
+        """
+        Writes full feature rows (only whitelisted keys, customer_id required): the counters
+        go to customer_feature_counters, everything else to customer_feature_aggregates.
+        EVENT_TIME_COLUMNS given as epoch seconds are stored with the aggregates.
+        """
+        columns = [key for key in features_rows[0] if key in FEATURE_COLUMNS]
+        if 'customer_id' not in columns:
             raise ValueError("customer_id is a required key for upserting features.")
+        rows = [{**row, **{key: epoch_to_datetime(row[key]) for key in EVENT_TIME_COLUMNS if key in row}}
+                for row in sorted(features_rows, key=lambda row: row['customer_id'])]
+        cold_columns = [key for key in columns if key not in HOT_FEATURE_COLUMNS]
+        cold_columns += [key for key in EVENT_TIME_COLUMNS if key in features_rows[0]]
+        hot_columns = [key for key in columns if key in HOT_FEATURE_COLUMNS]
+        for table, table_columns in (('customer_feature_aggregates', cold_columns),
+                                     ('customer_feature_counters', ['customer_id'] + hot_columns)):
+            update_str = ", ".join([f"{key} = EXCLUDED.{key}" for key in table_columns if key != 'customer_id'])
+            if not update_str and table == 'customer_feature_counters':
+                continue
+            # Every customer with features gets an aggregates row, even if only counters were given
+            conflict = f"DO UPDATE SET {update_str}, updated_at = CURRENT_TIMESTAMP" if update_str else "DO NOTHING"
+            extras.execute_values(cur, f"""
+                INSERT INTO {table} ({", ".join(table_columns)}) VALUES %s
+                ON CONFLICT (customer_id) {conflict}
+            """, [tuple(row.get(key) for key in table_columns) for row in rows], page_size=500)
+
+    def get_watermark(self, name):
+        """Returns the last_event_id processed by pipeline name, or None if it never ran."""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT last_event_id FROM pipeline_watermarks WHERE name = %s", (name,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def get_safe_event_watermark(self, after_event_id, safety_lag_seconds):
+        """
+        Returns the highest event id above after_event_id whose event is older than
+        safety_lag_seconds, or after_event_id when there is none. Ids are assigned at insert
+        but become visible at commit, so younger ids may still have lower-id gaps in flight.
+        """
+        with self.get_cursor(role='replica') as cur:
+            cur.execute("""
+                SELECT MAX(id) FROM customer_events_normalized
+                WHERE id > %s AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (after_event_id, safety_lag_seconds))
+            row = cur.fetchone()
+            return row[0] if row and row[0] is not None else after_event_id
 
-        columns = ", ".join(filtered_features.keys())
-        placeholders = ", ".join([f"%({key})s" for key in filtered_features.keys()])
-        update_str = ", ".join([f"{key} = EXCLUDED.{key}" for key in filtered_features if key != 'customer_id'])
+    def get_customers_with_events_after(self, after_event_id):
+        """Returns the distinct customer_ids with at least one event id > after_event_id."""
+        with self.get_cursor(role='replica') as cur:
+            cur.execute("SELECT DISTINCT customer_id FROM customer_events_normalized WHERE id > %s", (after_event_id,))
+            return [row[0] for row in cur.fetchall()]
 
-        query = f"""
-            INSERT INTO customer_features ({columns}) 
-            VALUES ({placeholders}) 
-            ON CONFLICT (customer_id) 
-            DO UPDATE SET {update_str}, updated_at = CURRENT_TIMESTAMP
+    def get_activity_since(self, after_event_id, customers_created_after):
+        """
+        Returns (events, changed_customers, new_customers): the events with id > after_event_id,
+        the distinct customers they belong to, and the customers created after the given time.
+        """
+        with self.get_cursor(role='replica') as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM customer_events_normalized WHERE id > %s),
+                    (SELECT COUNT(DISTINCT customer_id) FROM customer_events_normalized WHERE id > %s),
+                    (SELECT COUNT(*) FROM customers WHERE created_at > %s)
+            """, (after_event_id, after_event_id, customers_created_after))
+            return cur.fetchone()
+
+    def get_feature_bucket_counts(self, edges_by_column):
+        """
+        Histograms customer_features columns in one scan. edges_by_column maps a column to its
+        ascending bucket edges; NULLs count as 0. Returns {column: [count per bucket]} with
+        len(edges) + 1 buckets, bucket i holding the values with exactly i edges <= value.
+        """
+        columns = [column for column in edges_by_column if column in READABLE_FEATURE_COLUMNS and column != 'customer_id']
+        if not columns:
+            return {}
+        values = ", ".join(
+            f"('{column}', width_bucket(COALESCE({column}, 0)::float8, %s::float8[]))" for column in columns
+        )
+        with self.get_cursor(role='replica') as cur:
+            cur.execute(f"""
+                SELECT b.column_name, b.bucket, COUNT(*)
+                FROM customer_features f, LATERAL (VALUES {values}) AS b(column_name, bucket)
+                GROUP BY 1, 2
+            """, [list(edges_by_column[column]) for column in columns])
+            counts = {column: [0] * (len(edges_by_column[column]) + 1) for column in columns}
+            for column, bucket, count in cur.fetchall():
+                counts[column][bucket] = count
+            return counts
+
+    def claim_pipeline_run(self, name, last_event_id, min_interval_seconds):
+        """
+        Records a run of pipeline name unless its previous run is more recent than
+        min_interval_seconds. Atomic across processes: returns True for exactly one caller.
         """
-        
         with self.get_cursor(commit=True) as cur:
-            cur.execute(query, filtered_features)
-
-    def update_features_incrementally(self, customer_id, event):
-        """
-        Incrementally and atomically updates a customer's features based on a single event
-        using a single UPSERT query. This is far more efficient than a full recalculation.
-        """
-        def _calculate_purchase_value(evt):
-            # Prefer top-level value; otherwise derive from items
-            try:
-                direct_val = float(evt.get('value'))
-                return direct_val
-            except Exception:
-                pass
-
-            total = 0.0
-            items = evt.get('items')
-            if isinstance(items, list):
-                for item in items:
-                    if not isinstance(item, dict):
-                        continue
-                    price = item.get('price')
-                    if price is None:
-                        price = item.get('item_price')
-                    if price is None:
-                        price = item.get('item_revenue')
-                    qty = item.get('quantity', 1)
-                    try:
-                        price_num = float(price)
-                    except Exception:
-                        price_num = 0.0
-                    try:
-                        qty_num = float(qty)
-                    except Exception:
-                        qty_num = 1.0
-                    total += price_num * qty_num
-            return total
-
-        event_name = event.get('event_name') or event.get('event_type')
-        if not event_name:
-            return
-
-        query = None
-        params = {'customer_id': customer_id}
+            cur.execute("""
+                INSERT INTO pipeline_watermarks (name, last_event_id) VALUES (%s, %s)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_event_id = EXCLUDED.last_event_id,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE pipeline_watermarks.updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING name
+            """, (name, last_event_id, min_interval_seconds))
+            return cur.fetchone() is not None
 
-        if event_name == 'page_view':
-            query = """
-                INSERT INTO customer_features (customer_id, number_of_page_views) VALUES (%(customer_id)s, 1)
-                ON CONFLICT (customer_id) DO UPDATE SET
-                    number_of_page_views = customer_features.number_of_page_views + 1,
-                    updated_at = CURRENT_TIMESTAMP;
-            """
-        elif event_name == 'add_to_cart':
-            query = """
-                INSERT INTO customer_features (customer_id, add_to_cart_count) VALUES (%(customer_id)s, 1)
-                ON CONFLICT (customer_id) DO UPDATE SET
-                    add_to_cart_count = customer_features.add_to_cart_count + 1,
-                    updated_at = CURRENT_TIMESTAMP;
-            """
-        elif event_name == 'begin_checkout':
-            query = """
-                INSERT INTO customer_features (customer_id, begin_checkout_count) VALUES (%(customer_id)s, 1)
+    def ingest_events(self, records):
+        """
+        Writes a batch of prepared events in a single transaction.
+
+        Args:
+            records (list): (customer_id, event_record, event_name, fingerprint) tuples as
+                returned by ingest.prepare_event.
+
+        Customers and events are inserted with multi-row statements, and the incremental
+        counters are aggregated per customer and applied with one multi-row upsert, so a
+        batch costs a constant number of round trips instead of several per event.
+
+        Ingestion is idempotent: fingerprints seen recently by this process are dropped
+        before touching the database, and any other duplicate hits the unique fingerprint
+        index (ON CONFLICT DO NOTHING) and contributes no feature update.
+
+        Returns:
+            list: The records that were actually inserted (duplicates excluded).
+        """
+        records, _ = recent_fingerprints.drop_known(records)
+        if not records:
+            return []
+        customer_ids = sorted({record[0] for record in records})
+
+        with self.get_cursor(commit=True) as cur:
+            extras.execute_values(cur, """
+                INSERT INTO customers (customer_id) VALUES %s
+                ON CONFLICT (customer_id) DO NOTHING
+            """, [(customer_id,) for customer_id in customer_ids])
+            inserted_fingerprints = extras.execute_values(cur, """
+                INSERT INTO customer_events_normalized (customer_id, event_data, fingerprint) VALUES %s
+                ON CONFLICT (fingerprint) DO NOTHING
+                RETURNING fingerprint
+            """, [(record[0], extras.Json(record[1]), record[3]) for record in records], page_size=500, fetch=True)
+            inserted_fingerprints = {row[0] for row in inserted_fingerprints}
+            inserted = [record for record in records if record[3] in inserted_fingerprints]
+            self._apply_feature_deltas(cur, aggregate_feature_deltas(inserted))
+            self._apply_daily_activity(cur, aggregate_daily_activity(inserted, time.time()))
+
+        recent_fingerprints.remember(record[3] for record in records)
+        return inserted
+
+    def _apply_feature_deltas(self, cur, deltas):
+        """
+        Applies per-customer counter deltas (see ingest.aggregate_feature_deltas) with
+        multi-row INSERT ... ON CONFLICT statements. Rows are sorted by customer_id so
+        concurrent batches lock rows in the same order.
+
+        Page view / cart / checkout increments only update the narrow counters table (HOT
+        updates); the aggregates row is only updated for customers with purchases, and
+        otherwise just created if missing (the conditional update only writes when the
+        batch holds an event older than the stored first_event_at).
+
+        first_event_at and last_purchase_at only move outwards. A NULL first_event_at (a row
+        from before the timestamps were stored) stays NULL, so the view keeps using the
+        stored time_since_first_event instead of treating the customer as brand new.
+        """
+        if not deltas:
+            return
+        customer_ids = sorted(deltas)
+        purchasers = [customer_id for customer_id in customer_ids if deltas[customer_id]['number_of_purchases']]
+        others = [customer_id for customer_id in customer_ids if not deltas[customer_id]['number_of_purchases']]
+        event_times = {customer_id: [epoch_to_datetime(deltas[customer_id].get(col)) for col in EVENT_TIME_COLUMNS]
+                       for customer_id in customer_ids}
+        if purchasers:
+            extras.execute_values(cur, f"""
+                INSERT INTO customer_feature_aggregates
+                    (customer_id, {", ".join(COLD_DELTA_COLUMNS)}, {", ".join(EVENT_TIME_COLUMNS)}) VALUES %s
                 ON CONFLICT (customer_id) DO UPDATE SET
-                    begin_checkout_count = customer_features.begin_checkout_count + 1,
-                    updated_at = CURRENT_TIMESTAMP;
-            """
-        elif event_name == 'purchase':
-            purchase_value = _calculate_purchase_value(event)
-            params['purchase_value'] = purchase_value
-            query = """
-                INSERT INTO customer_features (customer_id, number_of_purchases, total_purchase_value, days_since_last_purchase)
-                VALUES (%(customer_id)s, 1, %(purchase_value)s, 0)
-                ON CONFLICT (customer_id) DO UPDATE SET
-                    number_of_purchases = customer_features.number_of_purchases + 1,
-                    total_purchase_value = customer_features.total_purchase_value + %(purchase_value)s,
+                    number_of_purchases = customer_feature_aggregates.number_of_purchases + EXCLUDED.number_of_purchases,
+                    total_purchase_value = customer_feature_aggregates.total_purchase_value + EXCLUDED.total_purchase_value,
                     days_since_last_purchase = 0,
-                    updated_at = CURRENT_TIMESTAMP;
-            """
-        
-        if query:
-            with self.get_cursor(commit=True) as cur:
-                cur.execute(query, params)
-        
-        # Note: This incremental update doesn't update complex, dependent features like
-        # average_purchase_value or purchase_frequency. A full recalculation is still
-        # needed for those. A hybrid approach (e.g., full recalc only on purchase) is the next step.
+                    first_event_at = CASE WHEN customer_feature_aggregates.first_event_at IS NOT NULL
+                        THEN LEAST(customer_feature_aggregates.first_event_at, EXCLUDED.first_event_at) END,
+                    last_purchase_at = GREATEST(customer_feature_aggregates.last_purchase_at, EXCLUDED.last_purchase_at),
+                    updated_at = CURRENT_TIMESTAMP
+            """, [(customer_id, *[deltas[customer_id][col] for col in COLD_DELTA_COLUMNS], *event_times[customer_id])
+                  for customer_id in purchasers], page_size=500)
+        if others:
+            extras.execute_values(cur, """
+                INSERT INTO customer_feature_aggregates (customer_id, first_event_at) VALUES %s
+                ON CONFLICT (customer_id) DO UPDATE SET first_event_at = EXCLUDED.first_event_at
+                WHERE EXCLUDED.first_event_at < customer_feature_aggregates.first_event_at
+            """, [(customer_id, event_times[customer_id][0]) for customer_id in others], page_size=500)
+        counter_rows = [
+            (customer_id, *[deltas[customer_id][col] for col in HOT_FEATURE_COLUMNS])
+            for customer_id in customer_ids if any(deltas[customer_id][col] for col in HOT_FEATURE_COLUMNS)
+        ]
+        if counter_rows:
+            extras.execute_values(cur, f"""
+                INSERT INTO customer_feature_counters (customer_id, {", ".join(HOT_FEATURE_COLUMNS)}) VALUES %s
+                ON CONFLICT (customer_id) DO UPDATE SET
+                    number_of_page_views = customer_feature_counters.number_of_page_views + EXCLUDED.number_of_page_views,
+                    add_to_cart_count = customer_feature_counters.add_to_cart_count + EXCLUDED.add_to_cart_count,
+                    begin_checkout_count = customer_feature_counters.begin_checkout_count + EXCLUDED.begin_checkout_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, counter_rows, page_size=500)
+
+    @staticmethod
+    def _apply_daily_activity(cur, buckets):
+        """
+        Adds daily activity buckets (see windows.aggregate_daily_activity) to
+        customer_daily_activity, in key order like _apply_feature_deltas.
+        """
+        if not buckets:
+            return
+        extras.execute_values(cur, f"""
+            INSERT INTO customer_daily_activity (customer_id, day, {", ".join(BUCKET_COLUMNS)}) VALUES %s
+            ON CONFLICT (customer_id, day) DO UPDATE SET
+                {", ".join(f"{column} = customer_daily_activity.{column} + EXCLUDED.{column}" for column in BUCKET_COLUMNS)}
+        """, [(customer_id, day, *bucket) for (customer_id, day), bucket in sorted(buckets.items())], page_size=500)
+
+    def prune_daily_activity(self):
+        """Deletes daily buckets that have left the longest window. Returns the number deleted."""
+        with self.get_cursor(commit=True) as cur:
+            cur.execute(f"DELETE FROM customer_daily_activity WHERE day <= {_UTC_TODAY} - %s", (MAX_WINDOW_DAYS,))
+            return cur.rowcount
+
+    def rebuild_daily_activity(self, batch_size=10000):
+        """
+        Recomputes customer_daily_activity from the events of the last MAX_WINDOW_DAYS days.
+        Runs in one transaction that blocks concurrent bucket writes, so ingestion waits
+        instead of adding increments that the rebuild would count a second time.
+        """
+        now = time.time()
+        buckets = {}
+        with self.get_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("LOCK TABLE customer_daily_activity IN SHARE ROW EXCLUSIVE MODE")
+                    cur.execute("DELETE FROM customer_daily_activity")
+                # Named cursor on the same connection, so it sees the events as of the lock
+                with conn.cursor(name="daily_activity_rebuild") as events:
+                    events.itersize = batch_size
+                    events.execute("SELECT customer_id, event_data FROM customer_events_normalized ORDER BY id")
+                    while True:
+                        rows = events.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        for key, bucket in aggregate_daily_activity(rows, now).items():
+                            total = buckets.setdefault(key, [0, 0.0, 0, 0])
+                            for i, value in enumerate(bucket):
+                                total[i] += value
+                cutoff = window_start(utc_day(now), MAX_WINDOW_DAYS)
+                buckets = {key: bucket for key, bucket in buckets.items() if key[1] > cutoff}
+                with conn.cursor() as cur:
+                    self._apply_daily_activity(cur, buckets)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        print(f"Rebuilt {len(buckets)} daily activity buckets.")
+        return len(buckets)
 
 
 # --- Global Database Instance ---
@@ -0,0 +1,70 @@
+"""
+Idempotent ingestion support: stable event fingerprints and an in-memory filter of
+recently seen fingerprints.
+
+sGTM and client retries resend identical payloads. Every event gets a fingerprint
+(see ingest.event_fingerprint) that is enforced by a unique index on
+customer_events_normalized, so a duplicate that reaches the database costs one
+ON CONFLICT DO NOTHING and never touches customer_features. The filter below lets
+most retries skip even that round trip.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+DEDUP_CACHE_SIZE = int(os.environ.get("DEDUP_CACHE_SIZE", "100000"))
+
+
+class RecentFingerprints:
+    """Thread-safe, bounded LRU set of event fingerprints already written (or rejected as duplicates)."""
+
+    def __init__(self, max_size=DEDUP_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+
+    def __contains__(self, fingerprint):
+        with self._lock:
+            return fingerprint in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def drop_known(self, records):
+        """
+        Returns (new_records, skipped): records whose fingerprint (record[3]) has not been
+        seen recently, with duplicates inside the batch itself removed as well.
+        """
+        new_records = []
+        batch_seen = set()
+        with self._lock:
+            for record in records:
+                fingerprint = record[3]
+                if fingerprint in batch_seen:
+                    continue
+                if fingerprint in self._entries:
+                    self._entries.move_to_end(fingerprint)
+                    continue
+                batch_seen.add(fingerprint)
+                new_records.append(record)
+            skipped = len(records) - len(new_records)
+            self.hits += skipped
+        return new_records, skipped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def remember(self, fingerprints):
+        """Adds fingerprints known to exist in the database, evicting the least recently used."""
+        with self._lock:
+            for fingerprint in fingerprints:
+                self._entries[fingerprint] = None
+                self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# --- Global Filter Instance (one per process) ---
+recent_fingerprints = RecentFingerprints()
@@ -0,0 +1,152 @@
+"""
+Compressed, append-only archive of raw (unprojected) event payloads.
+
+The hot table only keeps the projected event (see ingest.project_event). The original
+payload is appended here as gzip NDJSON in rotating segment files, so events can be
+replayed with a new projection when feature definitions change (see replay_archive.py).
+
+Enable by setting EVENT_ARCHIVE_DIR. Segments rotate when they reach
+EVENT_ARCHIVE_SEGMENT_MB of uncompressed data or EVENT_ARCHIVE_SEGMENT_SECONDS of age.
+"""
+import atexit
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+EVENT_ARCHIVE_DIR = os.environ.get("EVENT_ARCHIVE_DIR")
+EVENT_ARCHIVE_SEGMENT_MB = float(os.environ.get("EVENT_ARCHIVE_SEGMENT_MB", "64"))
+EVENT_ARCHIVE_SEGMENT_SECONDS = float(os.environ.get("EVENT_ARCHIVE_SEGMENT_SECONDS", "3600"))
+
+
+class RotatingSegmentWriter:
+    """
+    Thread-safe writer of NDJSON records into rotating segment files.
+
+    Each process writes its own segments (the pid is part of the file name), so gunicorn
+    workers never interleave writes. Closed segments are never modified again. With
+    compress=True segments are gzip members, sync-flushed at most every flush_seconds so
+    a crash loses little data without paying a flush per record.
+    """
+
+    def __init__(self, directory, prefix, max_bytes, max_seconds, compress=True, flush_seconds=5.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+        self._sequence = 0
+        self._opened_at = 0.0
+        self._last_flush = 0.0
+        self._bytes = 0
+
+    def write(self, record):
+        """Appends one JSON-serializable record as a line."""
+        line = (json.dumps(record, separators=(',', ':'), default=str) + "\n").encode('utf-8')
+        self.write_lines([line])
+
+    def write_lines(self, lines):
+        """Appends already-encoded NDJSON lines (bytes, each ending in a newline)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._file is None or self._pid != os.getpid() or self._should_rotate(now):
+                self._rotate(now)
+            for line in lines:
+                self._file.write(line)
+                self._bytes += len(line)
+            if now - self._last_flush >= self.flush_seconds:
+                self._flush(now)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+    def _should_rotate(self, now):
+        return self._bytes >= self.max_bytes or now - self._opened_at >= self.max_seconds
+
+    def _rotate(self, now):
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._sequence += 1
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        suffix = '.ndjson.gz' if self.compress else '.ndjson'
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{self._pid}-{self._sequence:05d}{suffix}")
+        self._file = gzip.open(path, 'ab') if self.compress else open(path, 'ab')
+        self._opened_at = now
+        self._last_flush = now
+        self._bytes = 0
+
+    def _flush(self, now):
+        if self.compress:
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            self._file.flush()
+        self._last_flush = now
+
+
+class RawEventArchive:
+    """Archives raw event payloads, keyed by the fingerprint of the stored projected event."""
+
+    def __init__(self, directory, segment_mb=EVENT_ARCHIVE_SEGMENT_MB, segment_seconds=EVENT_ARCHIVE_SEGMENT_SECONDS):
+        self.directory = directory
+        self.writer = RotatingSegmentWriter(
+            directory, 'events', max_bytes=int(segment_mb * 1024 * 1024), max_seconds=segment_seconds
+        )
+
+    def append(self, archived_events):
+        """
+        Appends (customer_id, fingerprint, raw_event) tuples as one NDJSON line each:
+        {"received_at", "customer_id", "fingerprint", "event"}.
+        """
+        received_at = datetime.now(timezone.utc).isoformat()
+        lines = [
+            (json.dumps({
+                'received_at': received_at,
+                'customer_id': customer_id,
+                'fingerprint': fingerprint,
+                'event': raw_event,
+            }, separators=(',', ':'), default=str) + "\n").encode('utf-8')
+            for customer_id, fingerprint, raw_event in archived_events
+        ]
+        if lines:
+            self.writer.write_lines(lines)
+
+    def close(self):
+        self.writer.close()
+
+
+def iter_archive(directory):
+    """Yields archived records from every segment in directory, oldest segment first."""
+    for path in sorted(glob.glob(os.path.join(directory, 'events-*.ndjson.gz'))):
+        with gzip.open(path, 'rt', encoding='utf-8') as segment:
+            try:
+                for line in segment:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A crash can leave a truncated last line in the active segment
+                        continue
+            except EOFError:
+                # Active or crashed segment without a gzip trailer: everything sync-flushed was read
+                continue
+
+
+# --- Global Archive Instance (None when archiving is disabled) ---
+event_archive = RawEventArchive(EVENT_ARCHIVE_DIR) if EVENT_ARCHIVE_DIR else None
+if event_archive is not None:
+    atexit.register(event_archive.close)
@@ -0,0 +1,237 @@
+"""
+Columnar, memory-mapped cache of customer_features for training and bulk scoring.
+
+The cache is a directory of generations, each holding one .npy file per column (rows
+sorted by customer_id), plus a manifest.json naming the current generation, its row
+count and its watermark (the latest customer_features.updated_at it contains):
+
+    feature_cache/
+        manifest.json
+        gen-000012/customer_id.npy, pltv.npy, number_of_purchases.npy, ...
+
+refresh() reads only the rows updated since the watermark and merges them into a new
+generation; the manifest is swapped atomically, so readers always see a complete one.
+Training (TRAINING_FEATURE_ENGINE=cache) and bulk scoring memory-map the columns instead
+of reading customer_features tuple by tuple. The rolling windows and the time-relative
+features (database.READ_TIME_FEATURE_COLUMNS) are not cached, since they change with the
+clock without a row update; with_read_time_features adds them to each batch from
+customer_features:
+
+    python feature_cache.py refresh [--rebuild]
+    python feature_cache.py score -o scores.csv
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from database import db, FEATURE_COLUMNS, READ_TIME_FEATURE_COLUMNS
+
+FEATURE_CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR", os.path.join(os.path.dirname(__file__), 'feature_cache'))
+# Rows updated up to this long before the watermark are re-read on refresh, so a transaction
+# that committed after a newer one (updated_at is the transaction start time) is not missed
+FEATURE_CACHE_OVERLAP_SECONDS = float(os.environ.get("FEATURE_CACHE_OVERLAP_SECONDS", "300"))
+
+CACHE_COLUMNS = sorted(FEATURE_COLUMNS - {'customer_id'} - set(READ_TIME_FEATURE_COLUMNS))
+MANIFEST_NAME = 'manifest.json'
+KEEP_GENERATIONS = 2
+
+
+def read_manifest(directory=None):
+    """Returns the current manifest dict, or None when no cache has been written."""
+    path = os.path.join(directory or FEATURE_CACHE_DIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def load_columns(columns=None, directory=None, manifest=None):
+    """Returns {column: read-only memory-mapped array} of the current generation, including customer_id."""
+    directory = directory or FEATURE_CACHE_DIR
+    manifest = manifest or read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No feature cache in {directory}; run feature_cache.py refresh first.")
+    generation_dir = os.path.join(directory, manifest['generation_dir'])
+    names = ['customer_id'] + [column for column in (columns or manifest['columns']) if column != 'customer_id']
+    return {name: np.load(os.path.join(generation_dir, f"{name}.npy"), mmap_mode='r') for name in names}
+
+
+def load_feature_frame(columns=None, directory=None):
+    """Returns the cached features as a DataFrame (customer_id plus columns)."""
+    return pd.DataFrame(load_columns(columns, directory))
+
+
+def with_read_time_features(batch):
+    """Returns batch with the READ_TIME_FEATURE_COLUMNS of its customers, as of now (0 when missing)."""
+    read_time = pd.DataFrame(db.get_read_time_features(batch['customer_id'].tolist()),
+                             columns=['customer_id', *READ_TIME_FEATURE_COLUMNS])
+    batch = batch.merge(read_time, on='customer_id', how='left')
+    batch[READ_TIME_FEATURE_COLUMNS] = batch[READ_TIME_FEATURE_COLUMNS].astype(float).fillna(0)
+    return batch
+
+
+def iter_feature_batches(batch_size=100000, columns=None, directory=None):
+    """Yields DataFrames of at most batch_size rows; memory stays bounded by the batch size."""
+    arrays = load_columns(columns, directory)
+    total = len(arrays['customer_id'])
+    for start in range(0, total, batch_size):
+        yield pd.DataFrame({name: np.asarray(array[start:start + batch_size]) for name, array in arrays.items()})
+
+
+def _read_changed_rows(updated_after):
+    customer_ids = []
+    values = [[] for _ in CACHE_COLUMNS]
+    watermark = None
+    for row in db.iter_customer_features_rows(CACHE_COLUMNS, updated_after):
+        customer_ids.append(row[0])
+        for i, value in enumerate(row[1:-1]):
+            values[i].append(value)
+        if row[-1] is not None and (watermark is None or row[-1] > watermark):
+            watermark = row[-1]
+    # np.array(..., dtype=float64) maps NULLs to NaN
+    changed = {column: np.array(values[i], dtype=np.float64) for i, column in enumerate(CACHE_COLUMNS)}
+    changed['customer_id'] = np.array(customer_ids, dtype=str)
+    return changed, watermark
+
+
+def _merge(base, changed):
+    """Merges changed rows into the sorted base arrays: existing customers are overwritten, new ones inserted."""
+    order = np.argsort(changed['customer_id'], kind='stable')
+    changed = {name: array[order] for name, array in changed.items()}
+    width = max(base['customer_id'].dtype.itemsize, changed['customer_id'].dtype.itemsize) // 4
+    base_ids = base['customer_id'].astype(f'<U{max(width, 1)}')
+    changed_ids = changed['customer_id'].astype(base_ids.dtype)
+
+    positions = np.searchsorted(base_ids, changed_ids)
+    clipped = np.minimum(positions, len(base_ids) - 1) if len(base_ids) else positions
+    found = (positions < len(base_ids)) & (base_ids[clipped] == changed_ids) if len(base_ids) else np.zeros(len(changed_ids), bool)
+
+    merged = {}
+    for name in base:
+        source = base_ids if name == 'customer_id' else base[name]
+        values = changed_ids if name == 'customer_id' else changed[name]
+        array = np.array(source)
+        array[positions[found]] = values[found]
+        merged[name] = np.insert(array, positions[~found], values[~found])
+    return merged
+
+
+def refresh(directory=None, rebuild=False):
+    """
+    Brings the cache up to date with customer_features and returns the new manifest.
+    Only rows updated since the watermark are read unless rebuild is set (or the
+    column set changed). Deleted customers are only dropped by a rebuild.
+    """
+    directory = directory or FEATURE_CACHE_DIR
+    current = read_manifest(directory)
+    manifest = None if rebuild else current
+    if manifest is not None and manifest['columns'] != CACHE_COLUMNS:
+        print("Feature columns changed; rebuilding the feature cache.", file=sys.stderr)
+        manifest = None
+
+    updated_after = None
+    if manifest is not None and manifest['watermark']:
+        updated_after = datetime.fromisoformat(manifest['watermark']) - timedelta(seconds=FEATURE_CACHE_OVERLAP_SECONDS)
+
+    changed, watermark = _read_changed_rows(updated_after)
+    if manifest is not None:
+        if not len(changed['customer_id']):
+            return manifest
+        columns = _merge(load_columns(directory=directory, manifest=manifest), changed)
+        previous = datetime.fromisoformat(manifest['watermark']) if manifest['watermark'] else None
+        if watermark is None or (previous is not None and previous > watermark):
+            watermark = previous
+    else:
+        order = np.argsort(changed['customer_id'], kind='stable')
+        columns = {name: array[order] for name, array in changed.items()}
+
+    generation = (current['generation'] + 1) if current else 1
+    generation_dir = f"gen-{generation:06d}"
+    # exist_ok: a refresh that crashed before swapping the manifest leaves a partial directory
+    os.makedirs(os.path.join(directory, generation_dir), exist_ok=True)
+    for name, array in columns.items():
+        np.save(os.path.join(directory, generation_dir, f"{name}.npy"), array)
+
+    new_manifest = {
+        'generation': generation,
+        'generation_dir': generation_dir,
+        'columns': CACHE_COLUMNS,
+        'rows': int(len(columns['customer_id'])),
+        'watermark': watermark.isoformat() if watermark is not None else None,
+        'refreshed_rows': int(len(changed['customer_id'])),
+        'created_at': datetime.now().astimezone().isoformat(),
+    }
+    temp_path = os.path.join(directory, f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+    with open(temp_path, 'w') as handle:
+        json.dump(new_manifest, handle, indent=2)
+    os.replace(temp_path, os.path.join(directory, MANIFEST_NAME))
+    _prune_generations(directory, generation)
+    print(f"Feature cache generation {generation}: {new_manifest['rows']} rows "
+          f"({new_manifest['refreshed_rows']} read from the database).", file=sys.stderr)
+    return new_manifest
+
+
+def _prune_generations(directory, current):
+    # Keep the previous generation for readers that memory-mapped it before the swap
+    for name in os.listdir(directory):
+        if name.startswith('gen-') and int(name[4:]) <= current - KEEP_GENERATIONS:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def score(model_path, out, batch_size=100000, directory=None):
+    """Writes customer_id,pltv for every cached customer with the model artifact at model_path."""
+    artifact = joblib.load(model_path)
+    model, features = artifact['model'], artifact['features']
+    writer = csv.writer(out)
+    writer.writerow(['customer_id', 'pltv'])
+    available = set(read_manifest(directory)['columns'])
+    missing = [column for column in features if column not in available and column not in READ_TIME_FEATURE_COLUMNS]
+    if missing:
+        raise ValueError(f"The model needs features the cache does not have: {', '.join(missing)}")
+    read_time = any(column in READ_TIME_FEATURE_COLUMNS for column in features)
+    count = 0
+    for batch in iter_feature_batches(batch_size, [column for column in features if column in available], directory):
+        if read_time:
+            batch = with_read_time_features(batch)
+        X = batch.reindex(columns=features)
+        if artifact.get('fill_missing', True):
+            X = X.fillna(0)
+        writer.writerows(zip(batch['customer_id'], model.predict(X)))
+        count += len(batch)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar customer_features cache.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refresh_parser = subparsers.add_parser('refresh', help="Incrementally refresh the cache.")
+    refresh_parser.add_argument('--rebuild', action='store_true', help="Rewrite the cache from scratch.")
+    score_parser = subparsers.add_parser('score', help="Score every cached customer.")
+    score_parser.add_argument('--model', default=os.path.join(os.path.dirname(__file__), 'pltv_model.pkl'))
+    score_parser.add_argument('--batch-size', type=int, default=100000)
+    score_parser.add_argument('-o', '--output', help="Output CSV (defaults to stdout).")
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        refresh(rebuild=args.rebuild)
+    else:
+        refresh()
+        out = open(args.output, 'w', newline='') if args.output else sys.stdout
+        try:
+            count = score(args.model, out, batch_size=args.batch_size)
+        finally:
+            if args.output:
+                out.close()
+        print(f"Scored {count} customers.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,95 @@
+import math
+from array import array
 
 import pandas as pd
 import numpy as np
-from functools import reduce
-
-def _purchase_value_from_row(row):
+from ingest import EVENT_TIME_COLUMNS, calculate_purchase_value, event_epoch_seconds, item_quantity
+from windows import WINDOW_DAYS, WINDOW_FEATURE_COLUMNS
+
+# Event name -> counter column of calculate_features
+EVENT_COUNT_COLUMNS = {
+    'page_view': 'number_of_page_views',
+    'add_to_cart': 'add_to_cart_count',
+    'begin_checkout': 'begin_checkout_count',
+}
+
+FEATURE_OUTPUT_COLUMNS = [
+    'customer_id', 'total_purchase_value', 'number_of_purchases', 'average_purchase_value',
+    'total_items_purchased', 'distinct_products_purchased', 'distinct_brands_purchased',
+    'distinct_products_viewed', 'distinct_brands_viewed', 'number_of_page_views',
+    'days_since_last_purchase', 'time_since_first_event', 'purchase_frequency', 'pltv',
+    'add_to_cart_count', 'begin_checkout_count', *WINDOW_FEATURE_COLUMNS, *EVENT_TIME_COLUMNS,
+]
+
+
+def build_event_frame(events):
     """
-    Determine purchase value from either the top-level value field or by summing
-    item price * quantity when value is missing.
+    Builds the typed frames calculate_features consumes from event dicts with customer_id
+    stamped (see ingest.normalize_stored_events), in one pass and without an object column:
+
+        events  one row per event: customer_id and event_name (lower-cased, falling back to
+                event_type) as categoricals, event_timestamp as datetime64[ns, UTC] resolved
+                per event like ingest.event_epoch_seconds (NaT without one), and value, the
+                float64 purchase value (0 for other events)
+        items   one row per item dict: the event's customer_id and event_name, item_id and
+                item_brand as categoricals and quantity as float64
+
+    Returns:
+        tuple: (events, items) DataFrames.
     """
-    val = pd.to_numeric(row.get('value'), errors='coerce')
-    if pd.notnull(val):
-        return float(val)
-
-    total = 0.0
-    items = row.get('items')
-    if isinstance(items, list):
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-            price = item.get('price')
-            if price is None:
-                price = item.get('item_price')
-            if price is None:
-                price = item.get('item_revenue')
-            qty = item.get('quantity', 1)
-            try:
-                price_num = float(price)
-            except Exception:
-                price_num = 0.0
-            try:
-                qty_num = float(qty)
-            except Exception:
-                qty_num = 1.0
-            total += price_num * qty_num
-    return total
-
-def calculate_features(events_df):
+    customer_ids, event_names = [], []
+    timestamps, values = array('d'), array('d')
+    item_events, item_ids, item_brands, quantities = array('q'), [], [], array('d')
+    for evt in events:
+        event_name = evt.get('event_name') or evt.get('event_type')
+        event_name = event_name.lower() if isinstance(event_name, str) else None
+        items = evt.get('items')
+        if isinstance(items, list):
+            for item in items:
+                if isinstance(item, dict):
+                    item_events.append(len(customer_ids))
+                    item_ids.append(item.get('item_id'))
+                    item_brands.append(item.get('item_brand'))
+                    quantities.append(item_quantity(item))
+        customer_ids.append(evt.get('customer_id'))
+        event_names.append(event_name)
+        timestamps.append(event_epoch_seconds(evt, math.nan))
+        values.append(calculate_purchase_value(evt) if event_name == 'purchase' else 0.0)
+
+    customer_cat = pd.Categorical(customer_ids)
+    name_cat = pd.Categorical(event_names)
+    events_df = pd.DataFrame({
+        'customer_id': customer_cat,
+        'event_name': name_cat,
+        'event_timestamp': pd.to_datetime(np.frombuffer(timestamps, dtype=np.float64), unit='s', utc=True),
+        'value': np.frombuffer(values, dtype=np.float64),
+    })
+    item_events = np.frombuffer(item_events, dtype=np.int64)
+    items_df = pd.DataFrame({
+        'customer_id': pd.Categorical.from_codes(customer_cat.codes[item_events], dtype=customer_cat.dtype),
+        'event_name': pd.Categorical.from_codes(name_cat.codes[item_events], dtype=name_cat.dtype),
+        'item_id': pd.Categorical(item_ids),
+        'item_brand': pd.Categorical(item_brands),
+        'quantity': np.frombuffer(quantities, dtype=np.float64),
+    })
+    return events_df, items_df
+
+
+def _per_customer(df, **aggregations):
+    """Groups df by customer and aggregates, with a plain (non-categorical) customer index."""
+    grouped = df.groupby('customer_id', observed=True, sort=False)
+    result = grouped.agg(**aggregations) if aggregations else grouped.size()
+    result.index = result.index.astype(object)
+    return result
+
+
+def calculate_features(events_df, items_df):
     """
-    Calculates features from a DataFrame of events in a more efficient and robust way.
+    Calculates features from the typed event frames of build_event_frame.
 
     Args:
-        events_df (pd.DataFrame): A DataFrame containing all events for one or more customers.
+        events_df (pd.DataFrame): Events of one or more customers.
+        items_df (pd.DataFrame): Their items.
 
     Returns:
         pd.DataFrame: A DataFrame with aggregated features per customer.
@@ -48,139 +97,97 @@ def calculate_features(events_df):
     if events_df.empty:
         return pd.DataFrame()
 
-    # --- Timestamp and Event Name Normalization ---
-    timestamp_sources = [
-        ('event_timestamp', 'ns'),
-        ('event_time_micros', 'us'),
-        ('event_time_ms', 'ms'),
-        ('timestamp_micros', 'us'),
-        ('api_timestamp_micros', 'us'),
-        ('request_start_time_ms', 'ms')
-    ]
-
-    events_df['event_timestamp'] = pd.NaT
-    for column, unit in timestamp_sources:
-        if column in events_df.columns:
-            events_df['event_timestamp'] = pd.to_datetime(events_df[column], unit=unit, errors='coerce')
-            break
-
-    if events_df['event_timestamp'].isna().all():
-        # Fallback: use current time when no recognizable timestamp is provided.
-        events_df['event_timestamp'] = pd.Timestamp.utcnow()
-    else:
-        events_df['event_timestamp'] = events_df['event_timestamp'].fillna(pd.Timestamp.utcnow())
-
-    events_df['event_timestamp'] = pd.to_datetime(events_df['event_timestamp'])
-    if events_df['event_timestamp'].dt.tz is None:
-        events_df['event_timestamp'] = events_df['event_timestamp'].dt.tz_localize('UTC')
-    else:
-        events_df['event_timestamp'] = events_df['event_timestamp'].dt.tz_convert('UTC')
-
-    event_name_col = 'event_name' if 'event_name' in events_df.columns else 'event_type'
-    if event_name_col not in events_df.columns:
+    # Events without a usable timestamp count as happening now
+    current_date = pd.Timestamp.now(tz='UTC')
+    events_df = events_df.assign(event_timestamp=events_df['event_timestamp'].fillna(current_date))
+    customer_index = pd.Index(events_df['customer_id'].dropna().unique().astype(object), name='customer_id')
+    if customer_index.empty:
         return pd.DataFrame()
-    if events_df[event_name_col].dtype == object:
-        events_df[event_name_col] = events_df[event_name_col].str.lower()
-
-    # --- Efficiently Process Nested Item Data ---
-    def extract_items(df, event_name):
-        filtered_df = df[df[event_name_col] == event_name].copy()
-        if 'items' not in filtered_df.columns:
-            return pd.DataFrame()
-        
-        filtered_df = filtered_df.dropna(subset=['items'])
-        exploded = filtered_df.explode('items')
-        items_df = pd.json_normalize(exploded['items']).add_prefix('item.')
-        return pd.concat([exploded.reset_index(drop=True), items_df], axis=1)
-
-    purchase_items_df = extract_items(events_df, 'purchase')
-    view_items_df = extract_items(events_df, 'view_item')
-    add_to_cart_items_df = extract_items(events_df, 'add_to_cart')
+    event_names = events_df['event_name']
+    purchases = events_df[event_names == 'purchase']
 
     # --- Feature Aggregation using GroupBy ---
-    all_customers = pd.DataFrame({'customer_id': events_df['customer_id'].unique()})
-
-    # Purchase-based features
-    purchases = events_df[events_df[event_name_col] == 'purchase'].copy()
-    purchases['value'] = purchases.apply(_purchase_value_from_row, axis=1).fillna(0)
-    purchase_features = purchases.groupby('customer_id').agg(
+    purchase_features = _per_customer(
+        purchases,
         total_purchase_value=('value', 'sum'),
-        number_of_purchases=(event_name_col, 'size'),
+        number_of_purchases=('value', 'size'),
         last_purchase_date=('event_timestamp', 'max'),
-        first_purchase_date=('event_timestamp', 'min')
-    ).reset_index()
-    purchase_features['average_purchase_value'] = (purchase_features['total_purchase_value'] / purchase_features['number_of_purchases']).fillna(0)
-
-    # Product-level features from purchases
-    if not purchase_items_df.empty:
-        purchase_items_df['item.quantity'] = pd.to_numeric(purchase_items_df['item.quantity'], errors='coerce').fillna(1)
-        product_purchase_features = purchase_items_df.groupby('customer_id').agg(
-            total_items_purchased=('item.quantity', 'sum'),
-            distinct_products_purchased=('item.item_id', 'nunique'),
-            distinct_brands_purchased=('item.item_brand', 'nunique')
-        ).reset_index()
-    else:
-        product_purchase_features = pd.DataFrame(columns=['customer_id', 'total_items_purchased', 'distinct_products_purchased', 'distinct_brands_purchased'])
-
-    # View-based features
-    if not view_items_df.empty:
-        view_features = view_items_df.groupby('customer_id').agg(
-            distinct_products_viewed=('item.item_id', 'nunique'),
-            distinct_brands_viewed=('item.item_brand', 'nunique')
-        ).reset_index()
-    else:
-        view_features = pd.DataFrame(columns=['customer_id', 'distinct_products_viewed', 'distinct_brands_viewed'])
-
-    # Other event counts
-    event_counts = events_df.groupby(['customer_id', event_name_col]).size().unstack(fill_value=0)
-    event_counts.columns = [f"{col}_count" for col in event_counts.columns]
-    event_counts.rename(columns={'page_view_count': 'number_of_page_views'}, inplace=True)
-    
-    # --- Consolidate All Features ---
-    dfs_to_merge = [
-        all_customers,
-        purchase_features,
-        product_purchase_features,
-        view_features,
-        event_counts.reset_index()
-    ]
-    
-    customer_features = reduce(lambda left, right: pd.merge(left, right, on='customer_id', how='left'), dfs_to_merge)
+    )
+    purchased_items = _per_customer(
+        items_df[items_df['event_name'] == 'purchase'],
+        total_items_purchased=('quantity', 'sum'),
+        distinct_products_purchased=('item_id', 'nunique'),
+        distinct_brands_purchased=('item_brand', 'nunique'),
+    )
+    viewed_items = _per_customer(
+        items_df[items_df['event_name'] == 'view_item'],
+        distinct_products_viewed=('item_id', 'nunique'),
+        distinct_brands_viewed=('item_brand', 'nunique'),
+    )
+    event_counts = pd.DataFrame({
+        column: _per_customer(events_df[event_names == event_name])
+        for event_name, column in EVENT_COUNT_COLUMNS.items()
+    })
+    first_event_dates = _per_customer(events_df, first_event_date=('event_timestamp', 'min'))
+
+    # Rolling windows (see windows.py): events on UTC days after today minus N days
+    event_days = events_df['event_timestamp'].dt.normalize()
+    today = current_date.normalize()
+    window_columns = {}
+    for days in WINDOW_DAYS:
+        recent = event_days > today - pd.Timedelta(days=days)
+        recent_purchases = events_df[recent & (event_names == 'purchase')]
+        window_columns[f'purchases_{days}d'] = _per_customer(recent_purchases)
+        window_columns[f'purchase_value_{days}d'] = _per_customer(recent_purchases, value=('value', 'sum'))['value']
+        window_columns[f'page_views_{days}d'] = _per_customer(events_df[recent & (event_names == 'page_view')])
+        window_columns[f'add_to_cart_{days}d'] = _per_customer(events_df[recent & (event_names == 'add_to_cart')])
+
+    customer_features = pd.concat(
+        [purchase_features, purchased_items, viewed_items, event_counts, first_event_dates,
+         pd.DataFrame(window_columns)],
+        axis=1,
+    ).reindex(customer_index)
 
     # --- Post-processing and Final Feature Calculation ---
-    current_date = pd.to_datetime('now', utc=True)
-    
+    customer_features['average_purchase_value'] = (
+        customer_features['total_purchase_value'] / customer_features['number_of_purchases']
+    )
     customer_features['days_since_last_purchase'] = (current_date - customer_features['last_purchase_date']).dt.days
-    
-    first_event_dates = events_df.groupby('customer_id')['event_timestamp'].min().reset_index(name='first_event_date')
-    customer_features = pd.merge(customer_features, first_event_dates, on='customer_id', how='left')
-    
-    customer_features['time_since_first_event'] = (current_date - customer_features['first_event_date']).dt.days.fillna(0).apply(lambda x: max(x, 1))
-    
-    customer_features['purchase_frequency'] = (customer_features['number_of_purchases'] / customer_features['time_since_first_event']).replace([np.inf, -np.inf], 0)
+    customer_features['time_since_first_event'] = (
+        (current_date - customer_features['first_event_date']).dt.days.fillna(0).clip(lower=1)
+    )
+    customer_features['purchase_frequency'] = (
+        customer_features['number_of_purchases'].fillna(0) / customer_features['time_since_first_event']
+    ).replace([np.inf, -np.inf], 0)
+
+    # Epoch seconds for customer_features (see ingest.EVENT_TIME_COLUMNS), NaN without a purchase
+    epoch = pd.Timestamp(0, tz='UTC')
+    customer_features['first_event_at'] = (customer_features['first_event_date'] - epoch) / pd.Timedelta(seconds=1)
+    customer_features['last_purchase_at'] = (customer_features['last_purchase_date'] - epoch) / pd.Timedelta(seconds=1)
 
     # Define pLTV and clean up
     customer_features['pltv'] = customer_features['total_purchase_value']
-    
-    final_cols = [
-        'customer_id', 'total_purchase_value', 'number_of_purchases', 'average_purchase_value',
-        'total_items_purchased', 'distinct_products_purchased', 'distinct_brands_purchased',
-        'distinct_products_viewed', 'distinct_brands_viewed', 'number_of_page_views',
-        'days_since_last_purchase', 'time_since_first_event', 'purchase_frequency', 'pltv'
-    ]
-    
-    # Add new event counts if they exist
-    if 'add_to_cart_count' in event_counts.columns:
-        final_cols.append('add_to_cart_count')
-    if 'begin_checkout_count' in event_counts.columns:
-        final_cols.append('begin_checkout_count')
-
-    # Ensure all expected columns exist, filling missing ones with 0
-    for col in final_cols:
-        if col not in customer_features.columns:
-            customer_features[col] = 0
-            
-    customer_features = customer_features[final_cols]
-    customer_features = customer_features.infer_objects(copy=False).fillna(0)
+    customer_features = customer_features.reset_index().reindex(columns=FEATURE_OUTPUT_COLUMNS)
+    feature_columns = [column for column in FEATURE_OUTPUT_COLUMNS if column not in EVENT_TIME_COLUMNS]
+    customer_features[feature_columns] = customer_features[feature_columns].infer_objects(copy=False).fillna(0)
 
     return customer_features
+
+
+def calculate_customer_features(customer_id, event_dicts):
+    """
+    Runs calculate_features over one customer's normalized event dicts.
+
+    Returns:
+        dict | None: The customer's feature row, or None when no features could be calculated.
+    """
+    if not event_dicts:
+        return None
+    features = calculate_features(*build_event_frame(event_dicts))
+    # calculate_features returns a DataFrame, extract the row for this customer
+    if features.empty:
+        return None
+    customer_rows = features[features['customer_id'] == customer_id]
+    if customer_rows.empty:
+        return None
+    return customer_rows.iloc[0].to_dict()
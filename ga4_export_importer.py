@@ -0,0 +1,187 @@
+"""
+Streaming importer for GA4 BigQuery export files.
+
+Seeds customers / customer_events_normalized with historical data from newline-delimited
+JSON exports of the GA4 `events_*` tables (optionally gzip-compressed):
+
+    python ga4_export_importer.py exports/events_2024*.json.gz --workers 4
+
+Files are read line by line in fixed-size chunks, chunks are parsed in a process pool
+with the same customer-ID resolution and projection as api.event, and each chunk is
+bulk-loaded with COPY in its own transaction together with its end offset. Memory stays
+bounded by (workers * 2) chunks, and a rerun resumes after the last committed chunk.
+Run backfill_features.py afterwards to build customer_features from the imported events.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from database import db
+from ingest import prepare_event
+
+
+def _param_value(value):
+    """Unwraps a BigQuery export {string_value, int_value, float_value, double_value} struct."""
+    if not isinstance(value, dict):
+        return value
+    for key in ('string_value', 'int_value', 'double_value', 'float_value'):
+        if value.get(key) is not None:
+            return value[key]
+    return None
+
+
+def convert_export_row(row):
+    """
+    Converts one GA4 BigQuery export row into the event shape received from sGTM:
+    event_params are flattened to top-level fields, event_timestamp (microseconds in the
+    export) becomes timestamp_micros, and ecommerce.purchase_revenue is used as value
+    when there is no value parameter.
+    """
+    event = {key: value for key, value in row.items() if key not in ('event_params', 'user_properties', 'event_timestamp')}
+
+    for param in row.get('event_params') or []:
+        if isinstance(param, dict) and param.get('key') and param['key'] not in event:
+            event[param['key']] = _param_value(param.get('value'))
+
+    user_properties = {}
+    for prop in row.get('user_properties') or []:
+        if isinstance(prop, dict) and prop.get('key'):
+            user_properties[prop['key']] = {'value': _param_value(prop.get('value'))}
+    if user_properties:
+        event['user_properties'] = user_properties
+
+    if row.get('event_timestamp') is not None:
+        # calculate_features reads event_timestamp as nanoseconds; the export uses microseconds
+        event['timestamp_micros'] = int(row['event_timestamp'])
+
+    ecommerce = row.get('ecommerce')
+    if event.get('value') is None and isinstance(ecommerce, dict) and ecommerce.get('purchase_revenue') is not None:
+        event['value'] = ecommerce['purchase_revenue']
+    return event
+
+
+def parse_chunk(lines):
+    """
+    Parses a chunk of NDJSON lines (bytes). Runs in a worker process.
+
+    Returns:
+        tuple: (rows, rejected) where rows are (customer_id, event_json_text, fingerprint)
+        tuples ready for COPY.
+    """
+    rows = []
+    rejected = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            export_row = json.loads(line)
+        except ValueError:
+            rejected += 1
+            continue
+        prepared = prepare_event(convert_export_row(export_row)) if isinstance(export_row, dict) else None
+        if prepared is None:
+            rejected += 1
+            continue
+        customer_id, event_record, _, fingerprint = prepared
+        rows.append((customer_id, json.dumps(event_record, separators=(',', ':'), default=str), fingerprint))
+    return rows, rejected
+
+
+def _open(path):
+    with open(path, 'rb') as probe:
+        is_gzip = probe.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if is_gzip else open(path, 'rb')
+
+
+def _read_chunks(handle, chunk_lines):
+    """Yields (lines, end_offset) chunks. For gzip files offsets are in the decompressed stream."""
+    while True:
+        lines = []
+        for _ in range(chunk_lines):
+            line = handle.readline()
+            if not line:
+                break
+            lines.append(line)
+        if not lines:
+            return
+        yield lines, handle.tell()
+
+
+def import_file(path, executor, workers, chunk_lines=5000):
+    """Imports one export file, resuming from its last committed offset. Returns stats."""
+    source = os.path.abspath(path)
+    progress = db.get_import_progress(source)
+    if progress and progress[2]:
+        print(f"{path}: already imported ({progress[1]} events), skipping.", file=sys.stderr)
+        return {'inserted': 0, 'rejected': 0, 'lines': 0}
+
+    start_offset = progress[0] if progress else 0
+    stats = {'inserted': 0, 'rejected': 0, 'lines': 0}
+    started = time.monotonic()
+
+    with _open(path) as handle:
+        if start_offset:
+            print(f"{path}: resuming from offset {start_offset}.", file=sys.stderr)
+            handle.seek(start_offset)
+
+        in_flight = deque()
+        chunks = _read_chunks(handle, chunk_lines)
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep a bounded window of chunks in flight so memory does not grow with file size
+            while not exhausted and len(in_flight) < workers * 2:
+                try:
+                    lines, end_offset = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.append((executor.submit(parse_chunk, lines), end_offset, len(lines)))
+            if not in_flight:
+                break
+
+            # Commit strictly in file order so the stored offset is always a safe resume point
+            future, end_offset, line_count = in_flight.popleft()
+            rows, rejected = future.result()
+            stats['inserted'] += db.copy_import_chunk(source, rows, end_offset)
+            stats['rejected'] += rejected
+            stats['lines'] += line_count
+
+            elapsed = time.monotonic() - started
+            rate = stats['lines'] / elapsed if elapsed else 0.0
+            print(f"{path}: {stats['lines']} lines, {stats['inserted']} inserted, "
+                  f"{stats['rejected']} rejected, {rate:,.0f} rows/sec", file=sys.stderr)
+
+        # Mark the source as done so a rerun over the same file list skips it
+        db.copy_import_chunk(source, [], handle.tell(), completed=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import GA4 BigQuery export files (NDJSON, optionally gzip).")
+    parser.add_argument('paths', nargs='+', help="Export files to import.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Parser processes.")
+    parser.add_argument('--chunk-lines', type=int, default=5000, help="Lines per parse/COPY chunk.")
+    args = parser.parse_args()
+
+    totals = {'inserted': 0, 'rejected': 0, 'lines': 0}
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for path in args.paths:
+            stats = import_file(path, executor, args.workers, chunk_lines=args.chunk_lines)
+            for key in totals:
+                totals[key] += stats[key]
+
+    elapsed = time.monotonic() - started
+    print(f"--- Import complete: {totals['lines']} lines, {totals['inserted']} events inserted, "
+          f"{totals['rejected']} rejected in {elapsed:.1f}s ---")
+    print("Run backfill_features.py to rebuild customer_features from the imported events.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,101 @@
-
+import argparse
+import gzip
 import json
 import os
 import sys
+import time
 from database import db
 from dotenv import load_dotenv
 
+
+class ProgressWriter:
+    """
+    Binary file wrapper that counts written rows (newlines) and reports rows/sec on stderr.
+    """
+
+    def __init__(self, out, header_lines=0, report_every=5.0):
+        self.out = out
+        self.rows = -header_lines
+        self.report_every = report_every
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.out.write(data)
+        self.rows += data.count(b"\n")
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every:
+            self.report()
+            self.last_report = now
+        return len(data)
+
+    def report(self, final=False):
+        elapsed = time.monotonic() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        label = "Exported" if final else "Exporting..."
+        print(f"{label} {max(self.rows, 0)} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)", file=sys.stderr)
+
+
+def export_events(out, fmt='ndjson', customer_id=None, event_name=None, since=None, until=None):
+    """
+    Streams the matching events to the binary file-like object out.
+
+    NDJSON rows are read through a server-side cursor; CSV rows are produced by
+    COPY ... TO STDOUT. Either way memory use is constant regardless of table size.
+    """
+    filters = dict(customer_id=customer_id, event_name=event_name, since=since, until=until)
+    if fmt == 'csv':
+        writer = ProgressWriter(out, header_lines=1)
+        db.copy_events_csv(writer, **filters)
+    else:
+        writer = ProgressWriter(out)
+        for event_id, row_customer_id, event_data, created_at in db.iter_events(**filters):
+            writer.write(json.dumps({
+                'id': event_id,
+                'customer_id': row_customer_id,
+                'created_at': created_at.isoformat() if created_at else None,
+                'event_data': event_data,
+            }, separators=(',', ':'), default=str) + "\n")
+    writer.report(final=True)
+    return max(writer.rows, 0)
+
+
 def main():
-    """Retrieves all customer events and prints them."""
-    print("--- Retrieving all customer events ---")
-    
+    """Exports customer events as NDJSON or CSV, optionally filtered and gzip-compressed."""
+    parser = argparse.ArgumentParser(description="Export customer events from the database.")
+    parser.add_argument('--customer-id', help="Only export events of this customer.")
+    parser.add_argument('--event-name', help="Only export events with this name (e.g. purchase).")
+    parser.add_argument('--since', help="Only events stored at or after this timestamp (ISO 8601).")
+    parser.add_argument('--until', help="Only events stored before this timestamp (ISO 8601).")
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help="Gzip-compress the output.")
+    parser.add_argument('-o', '--output', help="Output file (defaults to stdout).")
+    args = parser.parse_args()
+
     try:
         # Load environment variables to ensure database connection is available
         dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
         if os.path.exists(dotenv_path):
             load_dotenv(dotenv_path=dotenv_path)
-        
+
         if not os.environ.get("DATABASE_URL"):
             print("Error: DATABASE_URL not set. Please create a .env file or set the environment variable.", file=sys.stderr)
             sys.exit(1)
 
-        all_events = db.get_all_customer_events()
-
-        if not all_events:
-            print("No events found in the database.")
-            return
-
-        for customer_id, event_data, created_at in all_events:
-            print(f"\n{'='*20}")
-            print(f"Customer ID: {customer_id}")
-            print(f"Created At: {created_at}")
-            print("Event Data:")
-            # event_data is now a Python dictionary representing a single event
-            print(json.dumps(event_data, indent=2))
-            print(f"{'='*20}")
+        raw_out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        out = gzip.GzipFile(fileobj=raw_out, mode='wb') if args.gzip else raw_out
+        try:
+            export_events(out, fmt=args.format, customer_id=args.customer_id, event_name=args.event_name,
+                          since=args.since, until=args.until)
+        finally:
+            if out is not raw_out:
+                out.close()
+            if args.output:
+                raw_out.close()
+            else:
+                raw_out.flush()
 
     except Exception as e:
         print(f"An error occurred: {e}", file=sys.stderr)
@@ -40,4 +103,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,22 @@
+"""
+Gunicorn settings for the Flask API: gunicorn -c gunicorn.conf.py api:app
+
+With PLTV_PRELOAD enabled (default) the app is imported and the model artifact loaded
+once in the master; workers are forked from it and share the model pages copy-on-write.
+Nothing in the master touches the database, and each worker opens its own pool on first
+use. Apply the schema before starting the server with `python database.py`.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = os.environ.get("PLTV_PRELOAD", "1").lower() not in ("0", "false", "off")
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    if preload_app:
+        import api
+        api.preload()
+        server.log.info("Model artifact preloaded in the master process.")
@@ -0,0 +1,347 @@
+"""
+Shared helpers for turning incoming sGTM / GA4 payloads into normalized event records.
+
+These rules are used by every ingestion entry point (the Flask API, the async server,
+bulk importers) so that customer-ID resolution and event-name normalization stay identical.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+
+# GA4 / sGTM timestamp fields, in the order calculate_features looks for them
+TIMESTAMP_FIELDS = [
+    'event_timestamp', 'event_time_micros', 'event_time_ms',
+    'timestamp_micros', 'api_timestamp_micros', 'request_start_time_ms',
+]
+
+# Divisor converting each timestamp field to seconds (same units as calculate_features)
+TIMESTAMP_DIVISORS = {
+    'event_timestamp': 1e9,
+    'event_time_micros': 1e6,
+    'event_time_ms': 1e3,
+    'timestamp_micros': 1e6,
+    'api_timestamp_micros': 1e6,
+    'request_start_time_ms': 1e3,
+}
+
+
+def event_epoch_seconds(evt, now):
+    """Event time in epoch seconds from the first timestamp field present; now when there is none."""
+    for field in TIMESTAMP_FIELDS:
+        if evt.get(field) is None:
+            continue
+        try:
+            return float(evt[field]) / TIMESTAMP_DIVISORS[field]
+        except (TypeError, ValueError):
+            return now
+    # calculate_features also falls back to the current time
+    return now
+
+# --- Ingest-time payload projection ---
+# Only the fields read by calculate_features and the customer-ID resolution chain are kept
+# in customer_events_normalized. The untouched payload goes to the raw event archive.
+# EVENT_PROJECTION=off stores full payloads; EVENT_PROJECTION_EXTRA_FIELDS keeps additional
+# top-level fields (comma-separated).
+PROJECTION_ENABLED = os.environ.get("EVENT_PROJECTION", "on").lower() not in ("off", "false", "0", "full")
+PROJECTED_FIELDS = [
+    'customer_id', 'event_name', 'event_type', 'value', 'items',
+    'user_pseudo_id', 'client_id', '_ga',
+    *TIMESTAMP_FIELDS,
+] + [field.strip() for field in os.environ.get("EVENT_PROJECTION_EXTRA_FIELDS", "").split(",") if field.strip()]
+PROJECTED_ITEM_FIELDS = ['item_id', 'item_brand', 'quantity', 'price', 'item_price', 'item_revenue']
+
+
+def extract_events(payload):
+    """
+    Returns the list of raw events contained in a request payload.
+
+    Accepts a dict with an 'events' list (sGTM GA4 tag), a bare list of events,
+    or a single event object. Returns an empty list for anything else.
+    """
+    if isinstance(payload, dict) and 'events' in payload:
+        raw_events = payload['events']
+        if isinstance(raw_events, list):
+            return raw_events
+        return [raw_events]
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        return [payload]
+    return []
+
+
+def resolve_customer_id(event_record):
+    """
+    Resolves the customer_id for a single event using the GA4 identifier chain:
+    user_pseudo_id, client_id, user_properties.user_pseudo_id.value,
+    client_info.client_id and finally the _ga cookie value.
+    """
+    customer_id = event_record.get('user_pseudo_id') or event_record.get('client_id')
+    if customer_id:
+        return customer_id
+
+    user_properties = event_record.get('user_properties')
+    if user_properties and isinstance(user_properties, dict):
+        user_pseudo_id_obj = user_properties.get('user_pseudo_id')
+        if user_pseudo_id_obj and isinstance(user_pseudo_id_obj, dict):
+            customer_id = user_pseudo_id_obj.get('value')
+
+    if not customer_id:
+        client_info = event_record.get('client_info')
+        if client_info and isinstance(client_info, dict):
+            customer_id = client_info.get('client_id')
+    if not customer_id:
+        customer_id = event_record.get('_ga')
+    return customer_id
+
+
+def normalize_event_name(event_record):
+    """
+    Lower-cases the event name (falling back to event_type) and writes it back to
+    event_record['event_name']. Returns the normalized name or None.
+    """
+    event_name_raw = event_record.get('event_name') or event_record.get('event_type')
+    normalized_event_name = event_name_raw.lower() if isinstance(event_name_raw, str) else None
+    if normalized_event_name:
+        event_record['event_name'] = normalized_event_name
+    return normalized_event_name
+
+
+def event_fingerprint(customer_id, event_name, event_record):
+    """
+    Stable fingerprint of an event: sha256 over customer_id, event name, the GA4
+    timestamp and a hash of the canonical (key-sorted) JSON payload. Retries of the
+    same payload always produce the same fingerprint.
+    """
+    timestamp = next((event_record[field] for field in TIMESTAMP_FIELDS if event_record.get(field) is not None), '')
+    payload = json.dumps(event_record, sort_keys=True, separators=(',', ':'), default=str)
+    payload_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    key = "\x1f".join([str(customer_id), event_name or '', str(timestamp), payload_hash])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def project_event(event_record):
+    """
+    Returns the compact form of an event stored in the hot table: the projected top-level
+    fields, projected item fields, and the nested identifiers used by resolve_customer_id.
+    """
+    if not PROJECTION_ENABLED:
+        return event_record
+    projected = {field: event_record[field] for field in PROJECTED_FIELDS if field in event_record}
+
+    items = projected.get('items')
+    if isinstance(items, list):
+        projected['items'] = [
+            {field: item[field] for field in PROJECTED_ITEM_FIELDS if field in item} if isinstance(item, dict) else item
+            for item in items
+        ]
+
+    user_properties = event_record.get('user_properties')
+    if isinstance(user_properties, dict) and 'user_pseudo_id' in user_properties:
+        projected['user_properties'] = {'user_pseudo_id': user_properties['user_pseudo_id']}
+    client_info = event_record.get('client_info')
+    if isinstance(client_info, dict) and 'client_id' in client_info:
+        projected['client_info'] = {'client_id': client_info['client_id']}
+    return projected
+
+
+def prepare_event(single_event):
+    """
+    Normalizes one raw event.
+
+    Returns a (customer_id, event_record, event_name, fingerprint) tuple, or None when the
+    event is not an object or has no customer_id. The fingerprint is computed over the full
+    normalized payload; event_record is its projection (see project_event).
+    """
+    if not isinstance(single_event, dict):
+        return None
+    # Work on a copy so we can normalize fields without mutating the input
+    event_record = dict(single_event)
+    customer_id = resolve_customer_id(event_record)
+    if not customer_id:
+        return None
+    event_name = normalize_event_name(event_record)
+    fingerprint = event_fingerprint(customer_id, event_name, event_record)
+    return customer_id, project_event(event_record), event_name, fingerprint
+
+
+def calculate_purchase_value(evt):
+    """
+    Determines the value of a purchase event: the top-level value field if numeric,
+    otherwise the sum of item price * quantity.
+    """
+    # Prefer top-level value; otherwise derive from items
+    try:
+        direct_val = float(evt.get('value'))
+        return direct_val
+    except Exception:
+        pass
+
+    total = 0.0
+    items = evt.get('items')
+    if isinstance(items, list):
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            price = item.get('price')
+            if price is None:
+                price = item.get('item_price')
+            if price is None:
+                price = item.get('item_revenue')
+            qty = item.get('quantity', 1)
+            try:
+                price_num = float(price)
+            except Exception:
+                price_num = 0.0
+            try:
+                qty_num = float(qty)
+            except Exception:
+                qty_num = 1.0
+            total += price_num * qty_num
+    return total
+
+
+def item_quantity(item):
+    """Quantity of an item dict; 1 when missing or not numeric."""
+    try:
+        qty = float(item.get('quantity'))
+    except (TypeError, ValueError):
+        return 1.0
+    return 1.0 if math.isnan(qty) else qty
+
+
+def normalize_stored_events(customer_id, stored_events):
+    """
+    Converts stored event payloads (as returned by Database.get_customer_events) into
+    event dicts ready for calculate_features: decodes legacy string storage, stamps
+    customer_id and lower-cases event_name.
+    """
+    all_customer_event_dicts = []
+    for evt in stored_events:
+        # Defensive: handle legacy string storage
+        if isinstance(evt, str):
+            try:
+                evt = json.loads(evt)
+            except Exception:
+                continue
+        if not isinstance(evt, dict):
+            continue
+        # Normalize and stamp customer_id
+        evt = dict(evt)
+        evt.setdefault('customer_id', customer_id)
+        # Normalize event_name casing
+        if 'event_name' in evt and isinstance(evt['event_name'], str):
+            evt['event_name'] = evt['event_name'].lower()
+        all_customer_event_dicts.append(evt)
+    return all_customer_event_dicts
+
+
+# Event name -> customer_features counter column bumped by one per event
+COUNTER_COLUMNS = {
+    'page_view': 'number_of_page_views',
+    'add_to_cart': 'add_to_cart_count',
+    'begin_checkout': 'begin_checkout_count',
+}
+
+# Order of the delta columns used by the multi-row feature upserts
+DELTA_COLUMNS = [
+    'number_of_page_views', 'add_to_cart_count', 'begin_checkout_count',
+    'number_of_purchases', 'total_purchase_value',
+]
+
+# Epoch seconds of a customer's first event and last purchase (None without one). Feature
+# rows carry them next to the feature columns so customer_features can derive the
+# time-relative features at read time; they are not model features.
+EVENT_TIME_COLUMNS = ['first_event_at', 'last_purchase_at']
+
+
+def aggregate_feature_deltas(records):
+    """
+    Folds a batch of (customer_id, event_record, ...) tuples into one counter delta per customer.
+
+    Returns:
+        dict: customer_id -> {delta column: increment}, only for customers with at least one
+        counted event. Thirty page views for one user become a single +30 delta. Each delta
+        also carries the batch's first_event_at and last_purchase_at (see EVENT_TIME_COLUMNS).
+    """
+    now = time.time()
+    deltas = {}
+    first_event_at = {}
+    for record in records:
+        customer_id, event_record = record[0], record[1]
+        ts = event_epoch_seconds(event_record, now)
+        first_event_at[customer_id] = min(first_event_at.get(customer_id, ts), ts)
+        event_name = event_record.get('event_name') or event_record.get('event_type')
+        if event_name in COUNTER_COLUMNS:
+            delta = deltas.setdefault(customer_id, _new_delta())
+            delta[COUNTER_COLUMNS[event_name]] += 1
+        elif event_name == 'purchase':
+            delta = deltas.setdefault(customer_id, _new_delta())
+            delta['number_of_purchases'] += 1
+            delta['total_purchase_value'] += calculate_purchase_value(event_record)
+            delta['last_purchase_at'] = max(delta['last_purchase_at'] or ts, ts)
+    for customer_id, delta in deltas.items():
+        delta['first_event_at'] = first_event_at[customer_id]
+    return deltas
+
+
+def _new_delta():
+    delta = dict.fromkeys(DELTA_COLUMNS, 0)
+    delta.update(dict.fromkeys(EVENT_TIME_COLUMNS))
+    return delta
+
+
+class BulkEventBatcher:
+    """
+    Accumulates prepared events from parsed NDJSON lines (see ndjson_stream.NDJSONDecoder)
+    into write batches, keeping per-line accept/reject counts for bulk ingestion endpoints.
+    """
+
+    def __init__(self, batch_size, max_errors=100):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.stats = {"lines": 0, "accepted_lines": 0, "rejected_lines": 0, "events": 0, "accepted": 0, "duplicates": 0}
+        self.errors = []
+        self.batch = []
+        self.raw_events_by_fingerprint = {}
+
+    def add_line(self, line_number, payload, error):
+        """Adds one parsed line. Returns True when a full batch is ready to be taken."""
+        self.stats["lines"] += 1
+        if error is not None:
+            self._reject(line_number, error)
+            return False
+        line_events = 0
+        for single_event in extract_events(payload):
+            prepared = prepare_event(single_event)
+            if prepared is None:
+                continue
+            self.batch.append(prepared)
+            self.raw_events_by_fingerprint[prepared[3]] = single_event
+            line_events += 1
+        if not line_events:
+            self._reject(line_number, "no event with a customer_id ('user_pseudo_id' or 'client_id')")
+            return False
+        self.stats["accepted_lines"] += 1
+        self.stats["events"] += line_events
+        return len(self.batch) >= self.batch_size
+
+    def take_batch(self):
+        """Returns (prepared events, raw events by fingerprint) and starts a new batch."""
+        batch, raw_events_by_fingerprint = self.batch, self.raw_events_by_fingerprint
+        self.batch, self.raw_events_by_fingerprint = [], {}
+        return batch, raw_events_by_fingerprint
+
+    def record_written(self, batch_size, inserted_count):
+        self.stats["accepted"] += inserted_count
+        self.stats["duplicates"] += batch_size - inserted_count
+
+    def result(self):
+        return {**self.stats, "errors": self.errors}
+
+    def _reject(self, line_number, reason):
+        self.stats["rejected_lines"] += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_number, "error": reason})
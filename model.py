@@ -3,13 +3,45 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.ensemble import RandomForestRegressor
+from model_backends import get_backend
 import joblib
+import copy
+import io
+from sklearn.base import clone
 from database import db
-from features import calculate_features
+from features import build_event_frame, calculate_features
+from ingest import EVENT_TIME_COLUMNS, normalize_stored_events
+from snapshots import SNAPSHOT_SAFETY_LAG, compute_all_customer_features, iter_customer_features
+from sampling import TRAINING_SAMPLE_SIZE, sample_training_rows
+import feature_cache
+import analytics
+from profiling import PipelineProfiler
+from retrain_scheduler import training_snapshot
+from datetime import datetime, timezone
+import json
 import time
 
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'pltv_model.pkl')
 
+# How the training feature matrix is built:
+#   'snapshot' - per-customer snapshots plus the events after their watermark (default)
+#   'pandas'   - full replay of every event through calculate_features
+#   'cache'    - the memory-mapped columnar copy of customer_features (see feature_cache.py)
+#   'duckdb'   - vectorized SQL over Parquet event segments (see analytics.py; needs duckdb)
+TRAINING_FEATURE_ENGINE = os.environ.get("TRAINING_FEATURE_ENGINE", "snapshot")
+
+# --- Serving constraints for model selection ---
+# Hard budgets (0 disables): candidates over budget are rejected if any candidate fits.
+MODEL_MAX_PREDICT_LATENCY_MS = float(os.environ.get("MODEL_MAX_PREDICT_LATENCY_MS", "0"))
+MODEL_MAX_ARTIFACT_MB = float(os.environ.get("MODEL_MAX_ARTIFACT_MB", "0"))
+# Weighted objective: mae + latency_weight * single-row ms + size_weight * artifact MB
+MODEL_LATENCY_WEIGHT = float(os.environ.get("MODEL_LATENCY_WEIGHT", "0"))
+MODEL_SIZE_WEIGHT = float(os.environ.get("MODEL_SIZE_WEIGHT", "0"))
+# Number of top GridSearchCV candidates re-evaluated for serving cost
+MODEL_SELECTION_CANDIDATES = int(os.environ.get("MODEL_SELECTION_CANDIDATES", "5"))
+# Post-pruning accepts a smaller/shallower forest if validation MAE grows by at most this fraction (0 disables)
+MODEL_PRUNE_TOLERANCE = float(os.environ.get("MODEL_PRUNE_TOLERANCE", "0.02"))
+
 def load_data():
     """Loads raw event data from the database."""
     events = db.get_all_customer_events()
@@ -19,113 +51,251 @@ def load_data():
 
 def preprocess_data_for_training(raw_events):
     """
-    Preprocesses the raw event data for model training in a memory-efficient way.
-    It processes events per customer to avoid creating one massive DataFrame.
+    Calculates the training features of every customer with one calculate_features call.
+    The events go into a typed frame (see features.build_event_frame): categorical ids and
+    names instead of Python strings keep the whole history compact enough to hold at once,
+    and the groupbys run on category codes.
     """
     if not raw_events:
         return pd.DataFrame()
 
-    # Group events by customer_id
-    customer_events_map = {}
-    for customer_id, event_data_dict, _ in raw_events:
-        if customer_id not in customer_events_map:
-            customer_events_map[customer_id] = []
-        
-        # event_data_dict is already a Python dictionary representing a single event
-        event_with_id = event_data_dict.copy()
-        if 'customer_id' not in event_with_id:
-            event_with_id['customer_id'] = customer_id
-        customer_events_map[customer_id].append(event_with_id)
+    events_df, items_df = build_event_frame(
+        evt for customer_id, event_data, _ in raw_events
+        for evt in normalize_stored_events(customer_id, [event_data])
+    )
+    final_features_df = calculate_features(events_df, items_df)
+    
+    print(f"Calculated training features for {len(final_features_df)} customers.")
 
-    if not customer_events_map:
-        return pd.DataFrame()
+    return final_features_df
 
-    # Calculate features for each customer individually and collect them
-    all_customer_features = []
-    for customer_id, events in customer_events_map.items():
-        if not events:
-            continue
-        
-        events_df = pd.DataFrame(events)
-        customer_features_df = calculate_features(events_df)
-        
-        if not customer_features_df.empty:
-            all_customer_features.append(customer_features_df)
+def measure_serving_cost(model, X_sample, repeats=20):
+    """
+    Measures what a model costs to serve: median single-row predict latency (the /predict
+    path), batch predict latency per 1,000 rows, and pickled artifact size.
+    """
+    single_row = X_sample.iloc[[0]]
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(single_row)
+        timings.append(time.perf_counter() - start)
 
-    if not all_customer_features:
-        return pd.DataFrame()
+    batch = X_sample.sample(n=1000, replace=True, random_state=42) if len(X_sample) < 1000 else X_sample.iloc[:1000]
+    start = time.perf_counter()
+    model.predict(batch)
+    batch_seconds = time.perf_counter() - start
 
-    # Concatenate all feature DataFrames into one
-    final_features_df = pd.concat(all_customer_features, ignore_index=True)
-    
-    print("Customer Features DataFrame for Training (Memory-Efficient):")
-    print(final_features_df)
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return {
+        'single_row_latency_ms': float(np.median(timings) * 1000),
+        'batch_latency_ms_per_1k': float(batch_seconds * 1000),
+        'artifact_size_mb': buffer.tell() / (1024 * 1024),
+    }
 
-    return final_features_df
+def _validation_errors(model, X_val, y_val, w_val=None):
+    y_pred = model.predict(X_val)
+    mae = float(np.average(np.abs(y_val - y_pred), weights=w_val))
+    rmse = float(np.sqrt(np.average((y_val - y_pred)**2, weights=w_val)))
+    return mae, rmse
+
+def _within_budget(cost, max_latency_ms, max_size_mb):
+    if max_latency_ms and cost['single_row_latency_ms'] > max_latency_ms:
+        return False
+    if max_size_mb and cost['artifact_size_mb'] > max_size_mb:
+        return False
+    return True
+
+def _objective(candidate, latency_weight, size_weight):
+    return (candidate['mae']
+            + latency_weight * candidate['single_row_latency_ms']
+            + size_weight * candidate['artifact_size_mb'])
+
+def select_serving_candidate(grid_search, X_train, y_train, X_val, y_val,
+                             max_latency_ms=None, max_size_mb=None,
+                             latency_weight=None, size_weight=None, top_k=None, w_train=None, w_val=None):
+    """
+    Re-evaluates the top_k GridSearchCV candidates on validation MAE and serving cost, then
+    picks the best one under the latency/size budgets by the weighted objective.
+
+    Returns:
+        tuple: (model, candidates) where candidates is the list of evaluated parameter
+        sets with their measurements and a 'selected' flag.
+    """
+    max_latency_ms = MODEL_MAX_PREDICT_LATENCY_MS if max_latency_ms is None else max_latency_ms
+    max_size_mb = MODEL_MAX_ARTIFACT_MB if max_size_mb is None else max_size_mb
+    latency_weight = MODEL_LATENCY_WEIGHT if latency_weight is None else latency_weight
+    size_weight = MODEL_SIZE_WEIGHT if size_weight is None else size_weight
+    top_k = MODEL_SELECTION_CANDIDATES if top_k is None else top_k
+
+    results = grid_search.cv_results_
+    ranked = sorted(range(len(results['params'])), key=lambda i: results['rank_test_score'][i])[:max(top_k, 1)]
+
+    candidates = []
+    for i in ranked:
+        params = results['params'][i]
+        if params == grid_search.best_params_:
+            model = grid_search.best_estimator_
+        else:
+            model = clone(grid_search.estimator).set_params(**params)
+            model.fit(X_train, y_train, sample_weight=w_train)
+        mae, rmse = _validation_errors(model, X_val, y_val, w_val)
+        candidate = {'params': params, 'cv_mae': float(-results['mean_test_score'][i]), 'mae': mae, 'rmse': rmse,
+                     **measure_serving_cost(model, X_val if len(X_val) else X_train)}
+        candidate['within_budget'] = _within_budget(candidate, max_latency_ms, max_size_mb)
+        candidates.append((candidate, model))
+
+    feasible = [c for c in candidates if c[0]['within_budget']]
+    if feasible:
+        selected = min(feasible, key=lambda c: _objective(c[0], latency_weight, size_weight))
+    else:
+        print("WARNING: No candidate meets the serving budget; selecting the fastest one.")
+        selected = min(candidates, key=lambda c: c[0]['single_row_latency_ms'])
+
+    for candidate, _ in candidates:
+        candidate['selected'] = candidate is selected[0]
+    return selected[1], [candidate for candidate, _ in candidates]
+
+def prune_forest(model, X_train, y_train, X_val, y_val, tolerance=None, w_train=None, w_val=None):
+    """
+    Post-prunes a fitted RandomForestRegressor: keeps the fewest trees, then the smallest
+    max_depth, whose validation MAE stays within (1 + tolerance) of the unpruned forest.
 
-def train_model(df):
+    Returns:
+        tuple: (model, report) where report records the tree count and depth before and after.
+    """
+    tolerance = MODEL_PRUNE_TOLERANCE if tolerance is None else tolerance
+    if tolerance <= 0 or not isinstance(model, RandomForestRegressor):
+        return model, {'tolerance': tolerance, 'applied': False}
+    base_mae, _ = _validation_errors(model, X_val, y_val, w_val)
+    report = {'tolerance': tolerance, 'base_mae': base_mae,
+              'n_estimators_before': len(model.estimators_), 'max_depth_before': model.max_depth}
+    limit = base_mae * (1 + tolerance)
+
+    # Fewer trees: a fitted forest's first n trees are a valid, smaller forest
+    pruned = model
+    n_trees = len(model.estimators_)
+    while n_trees // 2 >= 10:
+        candidate = copy.copy(pruned)
+        candidate.estimators_ = model.estimators_[:n_trees // 2]
+        candidate.n_estimators = n_trees // 2
+        if _validation_errors(candidate, X_val, y_val, w_val)[0] > limit:
+            break
+        pruned, n_trees = candidate, n_trees // 2
+
+    # Capped depth requires a refit with the reduced tree count
+    fitted_depth = max(tree.get_depth() for tree in pruned.estimators_)
+    for depth in (16, 12, 8, 6):
+        if depth >= fitted_depth:
+            continue
+        candidate = clone(pruned).set_params(n_estimators=n_trees, max_depth=depth)
+        candidate.fit(X_train, y_train, sample_weight=w_train)
+        if _validation_errors(candidate, X_val, y_val, w_val)[0] > limit:
+            break
+        pruned = candidate
+
+    report.update({'applied': True, 'n_estimators_after': len(pruned.estimators_),
+                   'max_depth_after': pruned.max_depth, 'mae_after': _validation_errors(pruned, X_val, y_val, w_val)[0]})
+    return pruned, report
+
+def train_model(df, backend=None, profiler=None):
     """
-    Trains the RandomForestRegressor model, including hyperparameter tuning and validation.
+    Trains the model of the selected backend (see model_backends.MODEL_BACKEND),
+    including hyperparameter tuning and validation.
+
+    Candidates are chosen on validation MAE under the serving constraints (predict latency
+    and artifact size budgets, or a weighted objective), and the chosen forest is post-pruned
+    within MODEL_PRUNE_TOLERANCE (random forest only).
     
     Returns:
         A dictionary containing the trained model, feature list, and performance metrics.
     """
     if df.empty or 'pltv' not in df.columns:
         return None
+    backend = get_backend(backend) if backend is None or isinstance(backend, str) else backend
+    profiler = profiler or PipelineProfiler()
 
     # Dynamically determine feature columns, excluding identifiers and the target variable
-    feature_columns = [col for col in df.columns if col not in ['customer_id', 'pltv']]
+    feature_columns = [col for col in df.columns if col not in ['customer_id', 'pltv', 'sample_weight']]
     
     X = df[feature_columns]
+    if backend.fill_missing:
+        X = X.fillna(0)
     y = df['pltv']
 
     # Split data into training and validation sets
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+    # Rows from the training-set sampler carry weights so the sample still represents every customer
+    w = df['sample_weight'] if 'sample_weight' in df.columns else None
+    if w is None:
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+        w_train = w_val = None
+    else:
+        X_train, X_val, y_train, y_val, w_train, w_val = train_test_split(X, y, w, test_size=0.2, random_state=42)
 
     # --- Hyperparameter Tuning with GridSearchCV ---
-    param_grid = {
-        'n_estimators': [50, 100, 200],
-        'max_depth': [None, 10, 20],
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2]
-    }
-    
-    rf = RandomForestRegressor(random_state=42)
-    grid_search = GridSearchCV(estimator=rf, param_grid=param_grid, cv=3, 
+    grid_search = GridSearchCV(estimator=backend.build_estimator(), param_grid=backend.param_grid(), cv=3,
                                n_jobs=-1, verbose=2, scoring='neg_mean_absolute_error')
     
-    print("Starting GridSearchCV for hyperparameter tuning...")
-    grid_search.fit(X_train, y_train)
-    
-    best_model = grid_search.best_estimator_
-    print(f"Best Hyperparameters: {grid_search.best_params_}")
+    print(f"Starting GridSearchCV for hyperparameter tuning ({backend.name} backend)...")
+    training_started = time.perf_counter()
+    with profiler.stage('grid_search', rows_in=len(X_train)) as stage:
+        grid_search.fit(X_train, y_train, sample_weight=w_train)
+        stage['fits'] = len(grid_search.cv_results_['params']) * grid_search.n_splits_
+    print(f"Best Hyperparameters (CV MAE only): {grid_search.best_params_}")
+
+    # --- Serving-aware selection and post-pruning ---
+    with profiler.stage('select_candidate', rows_in=len(X_train) + len(X_val)) as stage:
+        best_model, candidates = select_serving_candidate(grid_search, X_train, y_train, X_val, y_val,
+                                                          w_train=w_train, w_val=w_val)
+        stage['candidates'] = len(candidates)
+    if backend.prunable:
+        with profiler.stage('prune', rows_in=len(X_train) + len(X_val)):
+            best_model, pruning = prune_forest(best_model, X_train, y_train, X_val, y_val, w_train=w_train, w_val=w_val)
+    else:
+        pruning = {'applied': False}
+    training_seconds = time.perf_counter() - training_started
 
     # --- Evaluate the Best Model ---
-    y_pred = best_model.predict(X_val)
-    mae = np.mean(np.abs(y_val - y_pred))
-    rmse = np.sqrt(np.mean((y_val - y_pred)**2))
+    with profiler.stage('evaluate', rows_in=len(X_val)) as stage:
+        serving = measure_serving_cost(best_model, X_val if len(X_val) else X_train)
+        mae, rmse = _validation_errors(best_model, X_val, y_val, w_val)
+        stage['rows_out'] = len(X_val)
+    print(f"Selected Hyperparameters: {best_model.get_params()}")
+    print(f"Serving cost: {serving}")
     
     print("\n--- Model Performance on Validation Set ---")
     print(f"Mean Absolute Error (MAE): {mae:.2f}")
     print(f"Root Mean Squared Error (RMSE): {rmse:.2f}")
     print("-----------------------------------------\n")
 
-    # --- Feature Importances ---
-    importances = pd.DataFrame({
-        'feature': feature_columns,
-        'importance': best_model.feature_importances_
-    }).sort_values('importance', ascending=False)
-    
-    print("Model Feature Importances:")
-    print(importances)
+    # --- Feature Importances (not every backend exposes them) ---
+    if hasattr(best_model, 'feature_importances_'):
+        importances = pd.DataFrame({
+            'feature': feature_columns,
+            'importance': best_model.feature_importances_
+        }).sort_values('importance', ascending=False)
+        
+        print("Model Feature Importances:")
+        print(importances)
 
     return {
         'model': best_model,
         'features': feature_columns,
+        # Serving fills NaN features with 0 only when training did
+        'fill_missing': backend.fill_missing,
         'metrics': {
             'mae': mae,
-            'rmse': rmse
-        }
+            'rmse': rmse,
+            'backend': backend.name,
+            'training_seconds': training_seconds,
+            'n_training_rows': len(X_train),
+            'sampling': df.attrs.get('sampling'),
+            'serving': serving,
+            'candidates': candidates,
+            'pruning': pruning
+        },
+        'profile': profiler.report()
     }
 
 def save_model(model_artifact):
@@ -135,24 +305,103 @@ def save_model(model_artifact):
         print("Model artifact saved successfully.")
         time.sleep(1) # Add a small delay to ensure the file is fully written
 
-def retrain_and_save_model():
-    """Loads data, trains the model, and saves the resulting artifact."""
-    print("Loading raw event data...")
-    raw_events = load_data()
-    
-    if not raw_events:
-        return "No raw events found to train the model."
-        
+def build_training_features(engine=None, sample_size=None, profiler=None):
+    """
+    Builds the training feature DataFrame with the selected engine (see TRAINING_FEATURE_ENGINE).
+    With a sample size (TRAINING_SAMPLE_SIZE by default, 0 disables) the customers are
+    stratified-sampled and the DataFrame gets a sample_weight column. The event timestamps
+    stored next to the features (EVENT_TIME_COLUMNS) are dropped; they are not model features.
+    Returns None when there are no events at all.
+    """
+    engine = engine or TRAINING_FEATURE_ENGINE
+    sample_size = TRAINING_SAMPLE_SIZE if sample_size is None else sample_size
+    profiler = profiler or PipelineProfiler()
+    if engine == 'pandas':
+        # Loading and the calculate_features pass over the typed event frame are profiled separately
+        print("Loading raw event data...")
+        with profiler.stage('load_data') as stage:
+            raw_events = load_data()
+            stage['rows_out'] = len(raw_events)
+        if not raw_events:
+            return None
+        with profiler.stage('calculate_features', rows_in=len(raw_events)) as stage:
+            features_df = _build_pandas_features(raw_events, sample_size)
+            stage['rows_out'] = len(features_df)
+        return features_df.drop(columns=EVENT_TIME_COLUMNS, errors='ignore')
+    with profiler.stage(f'build_features.{engine}') as stage:
+        features_df = _build_engine_features(engine, sample_size)
+        stage['rows_out'] = None if features_df is None else len(features_df)
+        if features_df is not None and features_df.attrs.get('sampling'):
+            stage['rows_in'] = features_df.attrs['sampling']['population']
+    return None if features_df is None else features_df.drop(columns=EVENT_TIME_COLUMNS, errors='ignore')
+
+def _build_pandas_features(raw_events, sample_size):
     print("Preprocessing data and calculating features for training...")
     features_df = preprocess_data_for_training(raw_events)
+    if not sample_size or features_df.empty:
+        return features_df
+    return _sampled_frame(features_df.to_dict('records'), sample_size)
+
+def _build_engine_features(engine, sample_size):
+    if engine == 'snapshot':
+        print("Calculating training features from snapshots plus event tails...")
+        if not sample_size:
+            return compute_all_customer_features(compact=True)
+        # Stream rows straight into the sampler so the full feature set is never held in memory
+        return _sampled_frame(iter_customer_features(compact=True), sample_size)
+    if engine == 'cache':
+        print("Refreshing the columnar feature cache...")
+        feature_cache.refresh()
+        # Same feature set as the other engines: the cached columns plus the read-time features
+        batches = (feature_cache.with_read_time_features(batch) for batch in feature_cache.iter_feature_batches())
+        if not sample_size:
+            frames = list(batches)
+            return pd.concat(frames, ignore_index=True) if frames else feature_cache.load_feature_frame()
+        rows = (row for batch in batches for row in batch.to_dict('records'))
+        return _sampled_frame(rows, sample_size)
+    if engine == 'duckdb':
+        print("Computing training features with DuckDB over exported event segments...")
+        features_df = analytics.compute_features_frame()
+        if features_df.empty:
+            return None
+        if not sample_size:
+            return features_df
+        return _sampled_frame(features_df.to_dict('records'), sample_size)
+    raise ValueError(f"Unknown training feature engine: {engine}")
+
+def _sampled_frame(rows, sample_size):
+    sampled_rows, sampling = sample_training_rows(rows, sample_size)
+    print(f"Sampled {sampling['sampled']} of {sampling['population']} customers for training.")
+    features_df = pd.DataFrame(sampled_rows)
+    features_df.attrs['sampling'] = sampling
+    return features_df
+
+def retrain_and_save_model(engine=None, backend=None, profiler=None):
+    """
+    Loads data, trains the model, and saves the resulting artifact.
+
+    Every stage is recorded by profiler (see profiling.py); the artifact's 'profile' covers
+    all stages up to saving, and the complete profile is printed as JSON at the end.
+    """
+    profiler = profiler or PipelineProfiler()
+    # Events after this watermark count as new for the retrain scheduler
+    trained_at = datetime.now(timezone.utc)
+    event_watermark = db.get_safe_event_watermark(0, SNAPSHOT_SAFETY_LAG.total_seconds())
+    features_df = build_training_features(engine, profiler=profiler)
+    
+    if features_df is None:
+        return "No raw events found to train the model."
     
     if not features_df.empty and 'pltv' in features_df.columns and not features_df['pltv'].isnull().all():
         print("Training model with hyperparameter tuning...")
-        model_artifact = train_model(features_df)
+        model_artifact = train_model(features_df, backend=backend, profiler=profiler)
         
         if model_artifact:
+            model_artifact['training_snapshot'] = training_snapshot(features_df, event_watermark, trained_at)
             print("Saving model artifact...")
-            save_model(model_artifact)
+            with profiler.stage('save_model', rows_in=len(features_df)):
+                save_model(model_artifact)
+            print(f"Retrain profile: {json.dumps(profiler.report(), default=str)}")
             return "Model training, validation, and saving process completed successfully."
         else:
             return "Model training failed."
@@ -0,0 +1,87 @@
+"""
+Model backends for model.train_model, selected with MODEL_BACKEND.
+
+A backend supplies the estimator and hyperparameter grid; train_model does the tuning,
+serving-aware selection and evaluation the same way for every backend, and always
+returns the {'model', 'features', 'fill_missing', 'metrics'} artifact that api.load_model_artifact
+reads.
+
+    random_forest           - RandomForestRegressor (default)
+    hist_gradient_boosting  - HistGradientBoostingRegressor: binned features, early
+                              stopping and native missing-value handling; much faster
+                              to train and serve on millions of customers
+"""
+import os
+from abc import ABC, abstractmethod
+
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "random_forest")
+
+
+class ModelBackend(ABC):
+    """Estimator factory plus the settings train_model needs for one model family."""
+
+    name = None
+    # Whether NaN features must be filled before fit/predict
+    fill_missing = True
+    # Whether model.prune_forest applies to the fitted estimator
+    prunable = False
+
+    @abstractmethod
+    def build_estimator(self):
+        """Returns a new, unfitted estimator."""
+
+    @abstractmethod
+    def param_grid(self):
+        """Returns the GridSearchCV parameter grid for build_estimator()."""
+
+
+class RandomForestBackend(ModelBackend):
+    name = 'random_forest'
+    prunable = True
+
+    def build_estimator(self):
+        return RandomForestRegressor(random_state=42)
+
+    def param_grid(self):
+        return {
+            'n_estimators': [50, 100, 200],
+            'max_depth': [None, 10, 20],
+            'min_samples_split': [2, 5],
+            'min_samples_leaf': [1, 2]
+        }
+
+
+class HistGradientBoostingBackend(ModelBackend):
+    name = 'hist_gradient_boosting'
+    fill_missing = False
+
+    def build_estimator(self):
+        return HistGradientBoostingRegressor(
+            max_iter=500,
+            max_bins=255,
+            early_stopping=True,
+            validation_fraction=0.1,
+            n_iter_no_change=20,
+            random_state=42,
+        )
+
+    def param_grid(self):
+        return {
+            'learning_rate': [0.05, 0.1],
+            'max_leaf_nodes': [15, 31, 63],
+            'min_samples_leaf': [20, 100],
+            'l2_regularization': [0.0, 1.0]
+        }
+
+
+BACKENDS = {backend.name: backend for backend in (RandomForestBackend, HistGradientBoostingBackend)}
+
+
+def get_backend(name=None):
+    """Returns the backend instance for name (defaults to MODEL_BACKEND)."""
+    name = name or MODEL_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}. Available: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name]()
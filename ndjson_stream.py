@@ -0,0 +1,102 @@
+"""
+Incremental NDJSON decoding for streamed request bodies.
+
+Bytes are fed in chunks as they arrive (optionally gzip-compressed); complete lines are
+parsed as soon as they are available, so a request body is never held in memory or parsed
+as one document. orjson is used when installed, with the standard json module as fallback.
+"""
+import json
+import os
+import zlib
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+    loads = json.loads
+
+# A line longer than this (after decompression) is rejected instead of buffered
+NDJSON_MAX_LINE_BYTES = int(os.environ.get("NDJSON_MAX_LINE_BYTES", str(1024 * 1024)))
+
+
+class NDJSONDecoder:
+    """
+    Feed body chunks with feed() and call close() at the end. Both return a list of
+    (line_number, value, error) tuples, one per non-blank line: value is the parsed JSON
+    and error None, or value None and error a short reason. Blank lines are skipped but
+    still counted in line numbers.
+
+    Raises zlib.error for a corrupt or truncated gzip stream.
+    """
+
+    def __init__(self, gzip=False, max_line_bytes=NDJSON_MAX_LINE_BYTES):
+        self.gzip = gzip
+        self.max_line_bytes = max_line_bytes
+        self.line_number = 0
+        self._decompressor = self._new_decompressor() if gzip else None
+        self._buffer = b''
+        self._skipping = False  # inside an oversized line, discarding until its newline
+
+    @staticmethod
+    def _new_decompressor():
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, chunk):
+        if self._decompressor is not None:
+            chunk = self._decompress(chunk)
+        if not chunk:
+            return []
+        results = []
+        lines = (self._buffer + chunk).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            if self._skipping:
+                # Rest of an oversized line, already reported
+                self._skipping = False
+                continue
+            results.extend(self._parse(line))
+        if len(self._buffer) > self.max_line_bytes:
+            if not self._skipping:
+                results.append(self._too_long())
+            self._buffer = b''
+            self._skipping = True
+        return results
+
+    def close(self):
+        results = []
+        if self._decompressor is not None:
+            tail = self._decompressor.flush()
+            if not self._decompressor.eof:
+                raise zlib.error("truncated gzip stream")
+            if tail:
+                results.extend(self.feed(tail))
+        if self._buffer and not self._skipping:
+            results.extend(self._parse(self._buffer))
+        self._buffer = b''
+        return results
+
+    def _decompress(self, chunk):
+        output = [self._decompressor.decompress(chunk)]
+        # Concatenated gzip members (e.g. appended segments) form one stream
+        while self._decompressor.eof and self._decompressor.unused_data:
+            rest = self._decompressor.unused_data
+            self._decompressor = self._new_decompressor()
+            output.append(self._decompressor.decompress(rest))
+        return b''.join(output)
+
+    def _too_long(self):
+        self.line_number += 1
+        return (self.line_number, None, f"line exceeds {self.max_line_bytes} bytes")
+
+    def _parse(self, line):
+        self.line_number += 1
+        line = line.strip()
+        if not line:
+            return []
+        if len(line) > self.max_line_bytes:
+            return [(self.line_number, None, f"line exceeds {self.max_line_bytes} bytes")]
+        try:
+            return [(self.line_number, loads(line), None)]
+        except ValueError:
+            return [(self.line_number, None, "invalid JSON")]
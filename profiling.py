@@ -0,0 +1,99 @@
+"""
+Per-stage profiling for the retrain pipeline.
+
+Each stage records wall time, CPU time of this process, memory and the rows going in and
+out. The report is plain JSON-serializable data: it is stored in the model artifact next to
+'metrics', printed at the end of a retrain and served by GET /retrain/status.
+
+    RETRAIN_PROFILE_TRACEMALLOC=1     also record the peak Python heap per stage (slows the
+                                      pipeline down noticeably)
+    RETRAIN_PROFILE_DIR=<directory>   dump a cProfile file per stage (<nn>-<stage>.prof,
+                                      readable with python -m pstats or snakeviz)
+
+Memory is always reported as RSS: current and process peak after each stage. CPU time
+excludes worker processes, so GridSearchCV with n_jobs=-1 shows wall >> CPU.
+"""
+import cProfile
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+RETRAIN_PROFILE_TRACEMALLOC = os.environ.get("RETRAIN_PROFILE_TRACEMALLOC", "off").lower() in ("1", "on", "true")
+RETRAIN_PROFILE_DIR = os.environ.get("RETRAIN_PROFILE_DIR")
+
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class PipelineProfiler:
+    """Collects one record per pipeline stage. Stages run one after another, never nested."""
+
+    def __init__(self, trace_memory=RETRAIN_PROFILE_TRACEMALLOC, cprofile_dir=RETRAIN_PROFILE_DIR):
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Profiles the body of the with block as stage name. Yields the stage record; set
+        record['rows_out'] (and any other JSON-serializable detail) inside the block.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.cprofile_dir else None
+
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        except BaseException as exc:
+            record['error'] = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall_seconds'] = time.perf_counter() - wall_started
+            record['cpu_seconds'] = time.process_time() - cpu_started
+            record['rss_mb'] = _current_rss_mb()
+            record['peak_rss_mb'] = _peak_rss_mb()
+            if self.trace_memory:
+                record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                if started_tracing:
+                    tracemalloc.stop()
+            if profile is not None:
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                path = os.path.join(self.cprofile_dir, f"{len(self.stages):02d}-{name}.prof")
+                profile.dump_stats(path)
+                record['cprofile'] = path
+            self.stages.append(record)
+
+    def report(self):
+        return {
+            'started_at': self.started_at,
+            'total_wall_seconds': sum(stage['wall_seconds'] for stage in self.stages),
+            'total_cpu_seconds': sum(stage['cpu_seconds'] for stage in self.stages),
+            'peak_rss_mb': max((stage['peak_rss_mb'] for stage in self.stages), default=None),
+            'stages': [dict(stage) for stage in self.stages],
+        }
@@ -0,0 +1,168 @@
+"""
+Debounced, per-customer full feature recomputation off the request path.
+
+A purchase only schedules a recompute. Requests for the same customer_id that arrive
+within the debounce window are coalesced into one job, and jobs run in a separate
+process pool so the pandas work never contends for the API process's GIL.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from database import db
+from snapshots import recompute_customer_from_snapshot
+
+logger = logging.getLogger("pltv.recompute")
+
+RECOMPUTE_DEBOUNCE_SECONDS = float(os.environ.get("RECOMPUTE_DEBOUNCE_SECONDS", "2.0"))
+# 0 disables the process pool and recomputes inline on the scheduler thread
+RECOMPUTE_WORKERS = int(os.environ.get("RECOMPUTE_WORKERS", "2"))
+
+
+def recompute_customer_features(customer_id):
+    """
+    Rebuilds one customer's features from their snapshot plus the events after its
+    watermark, and upserts them. Runs inside a worker process. Returns True when
+    features were written.
+    """
+    # Runs right after the triggering insert: read the primary, not a possibly lagging replica
+    with db.primary_reads():
+        customer_features_dict = recompute_customer_from_snapshot(customer_id)
+    if not customer_features_dict:
+        return False
+    db.upsert_customer_features(customer_features_dict)
+    return True
+
+
+class RecomputeScheduler:
+    """
+    Coalesces recompute requests per customer_id and dispatches them to a process pool.
+
+    A customer's job runs once the debounce window has elapsed since its first pending
+    request, so a burst of purchase events triggers a single recompute. A request that
+    arrives while that customer's job is already running schedules exactly one follow-up.
+    """
+
+    def __init__(self, debounce_seconds=RECOMPUTE_DEBOUNCE_SECONDS, max_workers=RECOMPUTE_WORKERS):
+        self.debounce_seconds = debounce_seconds
+        self.max_workers = max_workers
+        self._condition = threading.Condition()
+        self._pending = {}        # customer_id -> monotonic time the job becomes due
+        self._in_flight = set()
+        self._rerun = set()       # customers requested again while in flight
+        self._executor = None
+        self._thread = None
+        self._stats = {
+            'requested': 0,
+            'coalesced': 0,
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+        }
+
+    def schedule(self, customer_id):
+        """Requests a full recompute for customer_id. Never blocks on the recompute itself."""
+        with self._condition:
+            self._stats['requested'] += 1
+            if customer_id in self._pending or customer_id in self._rerun:
+                self._stats['coalesced'] += 1
+            elif customer_id in self._in_flight:
+                self._rerun.add(customer_id)
+            else:
+                self._pending[customer_id] = time.monotonic() + self.debounce_seconds
+            self._ensure_started()
+            self._condition.notify()
+
+    def stats(self):
+        """Returns queue depth and coalescing counters."""
+        with self._condition:
+            return {
+                'queue_depth': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'awaiting_rerun': len(self._rerun),
+                'debounce_seconds': self.debounce_seconds,
+                'workers': self.max_workers,
+                **self._stats,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _ensure_started(self):
+        # Called with the lock held. Started lazily so gunicorn workers each get their own thread/pool after fork.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self.max_workers > 0 and self._executor is None:
+            self._executor = self._new_executor()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="recompute-dispatcher", daemon=True)
+        self._thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    due = [cid for cid, due_at in self._pending.items() if due_at <= now]
+                    if due:
+                        break
+                    timeout = min(self._pending.values()) - now if self._pending else None
+                    self._condition.wait(timeout)
+                for customer_id in due:
+                    del self._pending[customer_id]
+                    self._in_flight.add(customer_id)
+                    self._stats['submitted'] += 1
+
+            for customer_id in due:
+                self._submit(customer_id)
+
+    def _new_executor(self):
+        # spawn: workers build their own DB pool instead of inheriting the parent's sockets
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _submit(self, customer_id):
+        if self._executor is not None:
+            try:
+                future = self._executor.submit(recompute_customer_features, customer_id)
+            except BrokenProcessPool as exc:
+                # A worker died (e.g. OOM-killed) and the pool accepts no more jobs: replace it
+                # for the next ones and run this job inline so the customer is not stranded
+                logger.error(f"Recompute process pool is broken, replacing it: {exc}")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            else:
+                future.add_done_callback(lambda f, cid=customer_id: self._on_done(cid, f.exception()))
+                return
+        self._run_inline(customer_id)
+
+    def _run_inline(self, customer_id):
+        try:
+            recompute_customer_features(customer_id)
+            error = None
+        except Exception as exc:
+            error = exc
+        self._on_done(customer_id, error)
+
+    def _on_done(self, customer_id, error):
+        with self._condition:
+            self._in_flight.discard(customer_id)
+            if error is None:
+                self._stats['completed'] += 1
+            else:
+                self._stats['failed'] += 1
+            if customer_id in self._rerun:
+                self._rerun.discard(customer_id)
+                self._pending[customer_id] = time.monotonic() + self.debounce_seconds
+                self._condition.notify()
+        if error is not None:
+            logger.error(f"Error during full feature recalculation for customer {customer_id}: {error}")
+
+
+# --- Global Scheduler Instance ---
+recompute_scheduler = RecomputeScheduler()
+atexit.register(recompute_scheduler.shutdown)
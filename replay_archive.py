@@ -0,0 +1,52 @@
+import argparse
+import sys
+
+from database import db
+from event_archive import EVENT_ARCHIVE_DIR, iter_archive
+from ingest import prepare_event
+
+
+def replay(directory, batch_size=1000, insert_missing=False):
+    """
+    Re-projects archived raw events with the current projection (ingest.project_event)
+    and rewrites their stored event_data, matched by fingerprint.
+
+    With insert_missing, events that are absent from customer_events_normalized are
+    ingested as new events (duplicates are ignored by fingerprint as usual).
+    Run backfill_features.py afterwards to rebuild features from the updated payloads.
+    """
+    stats = {'read': 0, 'updated': 0, 'inserted': 0, 'skipped': 0}
+    batch = []
+
+    def flush():
+        if insert_missing:
+            stats['inserted'] += len(db.ingest_events(batch))
+        stats['updated'] += db.update_event_payloads([(record[3], record[1]) for record in batch])
+        batch.clear()
+
+    for archived in iter_archive(directory):
+        stats['read'] += 1
+        prepared = prepare_event(archived.get('event'))
+        if prepared is None:
+            stats['skipped'] += 1
+            continue
+        batch.append(prepared)
+        if len(batch) >= batch_size:
+            flush()
+            print(f"Replayed {stats['read']} archived events...", file=sys.stderr)
+    if batch:
+        flush()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the raw event archive with the current ingest projection.")
+    parser.add_argument('--archive-dir', default=EVENT_ARCHIVE_DIR, help="Archive directory (defaults to EVENT_ARCHIVE_DIR).")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--insert-missing', action='store_true', help="Also ingest archived events missing from the database.")
+    args = parser.parse_args()
+
+    if not args.archive_dir:
+        print("Error: no archive directory given and EVENT_ARCHIVE_DIR is not set.", file=sys.stderr)
+        sys.exit(1)
+    print(replay(args.archive_dir, batch_size=args.batch_size, insert_missing=args.insert_missing))
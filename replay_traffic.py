@@ -0,0 +1,185 @@
+"""
+Replays captured /event traffic (see traffic_capture.py) against a pLTV API.
+
+Requests are sent in capture order, spaced like they arrived divided by --speed (1 for
+real time, 10 for ten times faster, 0 for as fast as --concurrency allows). When the
+server cannot keep up, requests queue behind the concurrency limit and the report shows
+how far sending fell behind schedule. Reported: achieved throughput, latency percentiles,
+status codes and error rate, overall and per path.
+
+Example:
+    python replay_traffic.py captures/ --base-url http://127.0.0.1:5000 --speed 5 --concurrency 200
+
+Captured payloads keep their original timestamps, so replaying into a database that has
+already seen them only exercises the duplicate path. --shift-timestamps moves every event
+timestamp forward by the time since capture, which makes the events new (and the rolling
+windows see them as recent).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench_servers import percentile
+from ingest import TIMESTAMP_DIVISORS, extract_events
+from traffic_capture import TRAFFIC_CAPTURE_DIR, iter_capture
+
+
+def _shifted(value, delta):
+    """value + delta in value's own type; numeric strings (GA4 sends some) stay strings. None if not a number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        # Integer arithmetic: nanosecond timestamps are beyond float precision
+        return value + round(delta)
+    if isinstance(value, float):
+        return value + delta
+    if isinstance(value, str):
+        try:
+            return str(int(value) + round(delta))
+        except ValueError:
+            pass
+        try:
+            return str(float(value) + delta)
+        except ValueError:
+            return None
+    return None
+
+
+def shift_timestamps(body, offset_seconds):
+    """Returns body with every event timestamp moved forward by offset_seconds (unparsable bodies unchanged)."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body
+    for evt in extract_events(payload):
+        if not isinstance(evt, dict):
+            continue
+        for field, divisor in TIMESTAMP_DIVISORS.items():
+            shifted = _shifted(evt.get(field), offset_seconds * divisor)
+            if shifted is not None:
+                evt[field] = shifted
+    return json.dumps(payload)
+
+
+def _summary(latencies, status_counts, errors, elapsed=None):
+    latencies = sorted(latencies)
+    sent = len(latencies)
+    failed = errors + sum(count for status, count in status_counts.items() if status >= 400)
+    summary = {'requests': sent}
+    if elapsed is not None:
+        summary['elapsed_s'] = round(elapsed, 3)
+        summary['throughput_rps'] = round(sent / elapsed, 1) if elapsed else 0.0
+    summary.update({
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'status_counts': dict(sorted(status_counts.items())),
+        'transport_errors': errors,
+        'error_rate': round(failed / sent, 4) if sent else 0.0,
+    })
+    return summary
+
+
+async def replay(records, base_url, speed=1.0, concurrency=100, shift=False, limit=None, timeout=60.0):
+    """Sends captured records to base_url and returns the report dict."""
+    semaphore = asyncio.Semaphore(concurrency)
+    by_path = {}
+    lags = []
+    payload_bytes = 0
+    tasks = set()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+
+        async def send(record, body):
+            stats = by_path.setdefault(record['path'], {'latencies': [], 'status_counts': {}, 'errors': 0})
+            headers = {'Content-Type': record.get('content_type') or 'application/json'}
+            start = time.perf_counter()
+            try:
+                response = await client.post(record['path'], content=body, headers=headers)
+                stats['status_counts'][response.status_code] = stats['status_counts'].get(response.status_code, 0) + 1
+            except httpx.HTTPError:
+                stats['errors'] += 1
+            finally:
+                stats['latencies'].append(time.perf_counter() - start)
+                semaphore.release()
+
+        started = time.perf_counter()
+        first_t = None
+        offset = 0.0
+        for i, record in enumerate(records):
+            if limit is not None and i >= limit:
+                break
+            if first_t is None:
+                first_t = record['t']
+                offset = time.time() - first_t
+            body = shift_timestamps(record['body'], offset) if shift else record['body']
+            payload_bytes += len(body.encode('utf-8'))
+            due = (record['t'] - first_t) / speed if speed else 0.0
+            if speed:
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            if speed:
+                lags.append(max(0.0, time.perf_counter() - started - due))
+            task = asyncio.create_task(send(record, body))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for stats in by_path.values() for latency in stats['latencies']]
+    status_counts = {}
+    for stats in by_path.values():
+        for status, count in stats['status_counts'].items():
+            status_counts[status] = status_counts.get(status, 0) + count
+    report = _summary(latencies, status_counts, sum(stats['errors'] for stats in by_path.values()), elapsed)
+    report.update({
+        'base_url': base_url,
+        'speed': speed or 'max',
+        'concurrency': concurrency,
+        'mean_payload_bytes': round(payload_bytes / len(latencies), 1) if latencies else 0.0,
+        'by_path': {path: _summary(stats['latencies'], stats['status_counts'], stats['errors'])
+                    for path, stats in sorted(by_path.items())},
+    })
+    if lags:
+        lags.sort()
+        report['schedule_lag_p99_ms'] = round(percentile(lags, 99) * 1000, 2)
+        report['schedule_lag_max_ms'] = round(lags[-1] * 1000, 2)
+    return report
+
+
+def parse_speed(value):
+    if value == 'max':
+        return 0.0
+    speed = float(value)
+    if speed < 0:
+        raise argparse.ArgumentTypeError("speed must be positive, 0 or 'max'")
+    return speed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured /event traffic against a pLTV API.")
+    parser.add_argument('captures', nargs='*', help="Capture files or directories (defaults to TRAFFIC_CAPTURE_DIR).")
+    parser.add_argument('--base-url', default="http://127.0.0.1:5000")
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="Time scale: 1 replays in real time, N is N times faster, 0 or 'max' sends without pauses.")
+    parser.add_argument('--concurrency', type=int, default=100, help="Maximum in-flight requests.")
+    parser.add_argument('--limit', type=int, help="Stop after this many requests.")
+    parser.add_argument('--shift-timestamps', action='store_true',
+                        help="Move event timestamps forward to the replay time so events are not duplicates.")
+    args = parser.parse_args()
+
+    captures = args.captures or ([TRAFFIC_CAPTURE_DIR] if TRAFFIC_CAPTURE_DIR else [])
+    if not captures:
+        parser.error("no capture files given and TRAFFIC_CAPTURE_DIR is not set")
+    result = asyncio.run(replay(iter_capture(captures), args.base_url, args.speed, args.concurrency,
+                                args.shift_timestamps, args.limit))
+    print(f"--- Replay against {args.base_url} ---")
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,213 @@
+"""
+Retrains the model when the data has moved enough, instead of only on POST /retrain.
+
+Every RETRAIN_CHECK_INTERVAL_SECONDS the scheduler compares the database with the
+training snapshot stored in the model artifact (see training_snapshot):
+
+    new events               events after the artifact's event watermark
+    changed customers        customers with such events, as a fraction of trained customers
+    new customers            customers created since training, same fraction
+    feature drift            population stability index (PSI) of each customer_features
+                             column against its training-time decile histogram
+
+A retrain starts when any threshold is crossed (0 disables a threshold), but never within
+RETRAIN_MIN_INTERVAL_SECONDS of the last one. The spacing is claimed in pipeline_watermarks,
+so with several gunicorn workers checking, only one of them starts a given retrain. Every
+check is appended to an in-memory decision log (per process), served by GET /retrain/decisions.
+
+Disabled unless RETRAIN_SCHEDULER=on.
+"""
+import logging
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from database import db
+
+logger = logging.getLogger("pltv.retrain_scheduler")
+
+RETRAIN_SCHEDULER = os.environ.get("RETRAIN_SCHEDULER", "off").lower() in ("1", "on", "true")
+RETRAIN_CHECK_INTERVAL_SECONDS = float(os.environ.get("RETRAIN_CHECK_INTERVAL_SECONDS", "900"))
+RETRAIN_MIN_INTERVAL_SECONDS = float(os.environ.get("RETRAIN_MIN_INTERVAL_SECONDS", str(6 * 3600)))
+RETRAIN_MIN_NEW_EVENTS = int(os.environ.get("RETRAIN_MIN_NEW_EVENTS", "10000"))
+RETRAIN_MIN_CHANGED_CUSTOMERS = float(os.environ.get("RETRAIN_MIN_CHANGED_CUSTOMERS", "0.10"))
+RETRAIN_MIN_NEW_CUSTOMERS = float(os.environ.get("RETRAIN_MIN_NEW_CUSTOMERS", "0.05"))
+RETRAIN_MAX_FEATURE_PSI = float(os.environ.get("RETRAIN_MAX_FEATURE_PSI", "0.2"))
+RETRAIN_DECISION_LOG_SIZE = int(os.environ.get("RETRAIN_DECISION_LOG_SIZE", "200"))
+
+# pipeline_watermarks row claimed by the worker that starts a scheduled retrain
+RETRAIN_PIPELINE = 'retrain_scheduler'
+DRIFT_BUCKETS = 10
+# Floor for empty buckets so PSI stays finite
+_PSI_EPSILON = 1e-4
+
+
+def training_snapshot(features_df, event_watermark, trained_at=None):
+    """
+    Summarizes what a model was trained on, for storing in the artifact: the event
+    watermark, the customer count and a decile histogram (bucket edges and the fraction of
+    customers per bucket) of every feature column. Sample weights are honoured, so a
+    sampled training set still describes the whole population.
+    """
+    import numpy as np
+
+    weights = features_df['sample_weight'].to_numpy() if 'sample_weight' in features_df.columns else None
+    sampling = features_df.attrs.get('sampling')
+    bins = {}
+    for column in features_df.columns:
+        if column in ('customer_id', 'sample_weight'):
+            continue
+        values = features_df[column].fillna(0).to_numpy(dtype=float)
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, DRIFT_BUCKETS + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), weights=weights, minlength=len(edges) + 1)
+        bins[column] = {'edges': edges.tolist(), 'fractions': (counts / counts.sum()).tolist()}
+    return {
+        'trained_at': (trained_at or datetime.now(timezone.utc)).isoformat(),
+        'event_watermark': event_watermark,
+        'n_customers': sampling['population'] if sampling else len(features_df),
+        'feature_bins': bins,
+    }
+
+
+def population_stability_index(expected, actual):
+    """PSI between two lists of bucket fractions (0.1 small shift, 0.25 large)."""
+    psi = 0.0
+    for e, a in zip(expected, actual):
+        e, a = max(e, _PSI_EPSILON), max(a, _PSI_EPSILON)
+        psi += (a - e) * math.log(a / e)
+    return psi
+
+
+class RetrainScheduler:
+    """
+    Periodically decides whether to retrain. get_snapshot returns the loaded artifact's
+    training snapshot (None without a model), start_retrain starts a background retrain
+    and is_retraining tells whether one is already running in this process.
+    """
+
+    def __init__(self, get_snapshot, start_retrain, is_retraining, enabled=RETRAIN_SCHEDULER,
+                 check_interval=RETRAIN_CHECK_INTERVAL_SECONDS, min_interval=RETRAIN_MIN_INTERVAL_SECONDS,
+                 min_new_events=RETRAIN_MIN_NEW_EVENTS, min_changed_customers=RETRAIN_MIN_CHANGED_CUSTOMERS,
+                 min_new_customers=RETRAIN_MIN_NEW_CUSTOMERS, max_feature_psi=RETRAIN_MAX_FEATURE_PSI,
+                 log_size=RETRAIN_DECISION_LOG_SIZE):
+        self.get_snapshot = get_snapshot
+        self.start_retrain = start_retrain
+        self.is_retraining = is_retraining
+        self.enabled = enabled
+        self.check_interval = check_interval
+        self.thresholds = {
+            'min_interval_seconds': min_interval,
+            'min_new_events': min_new_events,
+            'min_changed_customers': min_changed_customers,
+            'min_new_customers': min_new_customers,
+            'max_feature_psi': max_feature_psi,
+        }
+        self._decisions = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        """Starts the check loop once per process (so each forked worker runs its own)."""
+        if not self.enabled or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="retrain-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def decisions(self, limit=None):
+        """Most recent decisions first."""
+        with self._lock:
+            decisions = list(reversed(self._decisions))
+        return decisions[:limit] if limit else decisions
+
+    def _loop(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        """Evaluates the thresholds once, starts a retrain if they call for one, and logs the decision."""
+        try:
+            decision = self.evaluate()
+            if decision['action'] == 'retrain':
+                if self.is_retraining():
+                    decision['action'] = 'skip'
+                    decision['reasons'].append("a retrain is already running in this process")
+                elif not db.claim_pipeline_run(RETRAIN_PIPELINE, decision['stats'].get('event_watermark') or 0,
+                                               self.thresholds['min_interval_seconds']):
+                    decision['action'] = 'skip'
+                    decision['reasons'].append("another worker started a retrain within the minimum interval")
+                else:
+                    self.start_retrain()
+        except Exception as exc:
+            logger.exception("Retrain scheduler check failed")
+            decision = {'action': 'error', 'reasons': [str(exc)], 'stats': {}}
+        decision['checked_at'] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._decisions.append(decision)
+        if decision['action'] == 'retrain':
+            logger.info(f"Scheduled retrain started: {'; '.join(decision['reasons'])}")
+        return decision
+
+    def evaluate(self):
+        """Returns {'action': 'retrain' | 'wait', 'reasons': [...], 'stats': {...}} without side effects."""
+        thresholds = self.thresholds
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            events, _, _ = db.get_activity_since(0, datetime.fromtimestamp(0, timezone.utc))
+            if events:
+                return {'action': 'retrain', 'reasons': ["no trained model with a training snapshot"],
+                        'stats': {'new_events': events}}
+            return {'action': 'wait', 'reasons': ["no events to train on"], 'stats': {}}
+
+        trained_at = datetime.fromisoformat(snapshot['trained_at'])
+        age_seconds = (datetime.now(timezone.utc) - trained_at).total_seconds()
+        new_events, changed, created = db.get_activity_since(snapshot['event_watermark'], trained_at)
+        n_customers = max(snapshot['n_customers'], 1)
+        stats = {
+            'event_watermark': snapshot['event_watermark'],
+            'model_age_seconds': age_seconds,
+            'new_events': new_events,
+            'changed_customers': changed / n_customers,
+            'new_customers': created / n_customers,
+        }
+        reasons = []
+        if thresholds['min_new_events'] and new_events >= thresholds['min_new_events']:
+            reasons.append(f"{new_events} new events >= {thresholds['min_new_events']}")
+        if thresholds['min_changed_customers'] and stats['changed_customers'] >= thresholds['min_changed_customers']:
+            reasons.append(f"{stats['changed_customers']:.1%} of customers changed >= {thresholds['min_changed_customers']:.1%}")
+        if thresholds['min_new_customers'] and stats['new_customers'] >= thresholds['min_new_customers']:
+            reasons.append(f"{stats['new_customers']:.1%} new customers >= {thresholds['min_new_customers']:.1%}")
+
+        if thresholds['max_feature_psi']:
+            bins = snapshot['feature_bins']
+            counts = db.get_feature_bucket_counts({column: spec['edges'] for column, spec in bins.items()})
+            psi = {}
+            for column, column_counts in counts.items():
+                total = sum(column_counts)
+                if total:
+                    psi[column] = population_stability_index(bins[column]['fractions'], [c / total for c in column_counts])
+            stats['feature_psi'] = psi
+            drifted = sorted((column for column, value in psi.items() if value >= thresholds['max_feature_psi']),
+                             key=lambda column: -psi[column])
+            if drifted:
+                reasons.append(f"feature drift (PSI >= {thresholds['max_feature_psi']}): "
+                               + ", ".join(f"{column}={psi[column]:.3f}" for column in drifted))
+
+        if not reasons:
+            return {'action': 'wait', 'reasons': ["no threshold crossed"], 'stats': stats}
+        if age_seconds < thresholds['min_interval_seconds']:
+            next_at = trained_at + timedelta(seconds=thresholds['min_interval_seconds'])
+            reasons.append(f"model is younger than the minimum interval; next retrain possible at {next_at.isoformat()}")
+            return {'action': 'wait', 'reasons': reasons, 'stats': stats}
+        return {'action': 'retrain', 'reasons': reasons, 'stats': stats}
@@ -0,0 +1,99 @@
+"""
+Bounded-memory, stratified sampling of the training set.
+
+Customers are streamed through one reservoir per stratum (purchase-count bucket x
+purchase-value bucket), so memory depends on the target size and not on the number of
+customers. At the end each stratum gets a share proportional to its size, but never less
+than TRAINING_SAMPLE_MIN_PER_STRATUM rows, which keeps the rare high-value customers
+represented. Every sampled row carries sample_weight = stratum size / stratum sample
+size so the weighted training set still matches the population.
+"""
+import os
+import random
+from bisect import bisect_right
+
+# 0 disables sampling and trains on every customer
+TRAINING_SAMPLE_SIZE = int(os.environ.get("TRAINING_SAMPLE_SIZE", "0"))
+TRAINING_SAMPLE_MIN_PER_STRATUM = int(os.environ.get("TRAINING_SAMPLE_MIN_PER_STRATUM", "500"))
+
+# Lower bucket edges
+PURCHASE_COUNT_BUCKETS = (0, 1, 2, 5, 10)
+PURCHASE_VALUE_BUCKETS = (0.0, 50.0, 200.0, 1000.0, 5000.0)
+
+
+def stratum_of(row):
+    """Returns the (purchase count bucket, purchase value bucket) of a feature row."""
+    purchases = row.get('number_of_purchases') or 0
+    value = row.get('total_purchase_value') or 0.0
+    return (
+        max(bisect_right(PURCHASE_COUNT_BUCKETS, purchases) - 1, 0),
+        max(bisect_right(PURCHASE_VALUE_BUCKETS, value) - 1, 0),
+    )
+
+
+class StratifiedReservoirSampler:
+    """Keeps a uniform reservoir of at most target_size rows for every stratum."""
+
+    def __init__(self, target_size, min_per_stratum=TRAINING_SAMPLE_MIN_PER_STRATUM, seed=42):
+        self.target_size = target_size
+        self.min_per_stratum = min_per_stratum
+        self._random = random.Random(seed)
+        self._reservoirs = {}
+        self._counts = {}
+
+    def add(self, row):
+        key = stratum_of(row)
+        seen = self._counts.get(key, 0) + 1
+        self._counts[key] = seen
+        reservoir = self._reservoirs.setdefault(key, [])
+        if len(reservoir) < self.target_size:
+            reservoir.append(row)
+        else:
+            slot = self._random.randrange(seen)
+            if slot < self.target_size:
+                reservoir[slot] = row
+
+    def allocation(self):
+        """Returns stratum -> number of rows to keep."""
+        total = sum(self._counts.values())
+        if total <= self.target_size:
+            return dict(self._counts)
+        return {
+            key: min(count, max(self.min_per_stratum, round(self.target_size * count / total)))
+            for key, count in self._counts.items()
+        }
+
+    def sample(self):
+        """Returns the sampled rows, each with a sample_weight."""
+        rows = []
+        for key, size in self.allocation().items():
+            reservoir = self._reservoirs[key]
+            chosen = reservoir if size >= len(reservoir) else self._random.sample(reservoir, size)
+            weight = self._counts[key] / len(chosen)
+            for row in chosen:
+                rows.append({**row, 'sample_weight': weight})
+        return rows
+
+    def stats(self):
+        allocation = self.allocation()
+        return {
+            'population': sum(self._counts.values()),
+            'sampled': sum(allocation.values()),
+            'strata': {f"{key[0]}:{key[1]}": {'population': self._counts[key], 'sampled': allocation[key]}
+                       for key in sorted(self._counts)},
+        }
+
+
+def sample_training_rows(rows, target_size=None, min_per_stratum=None):
+    """
+    Streams feature rows through a StratifiedReservoirSampler.
+
+    Returns:
+        tuple: (sampled rows with sample_weight, sampling stats).
+    """
+    target_size = TRAINING_SAMPLE_SIZE if target_size is None else target_size
+    min_per_stratum = TRAINING_SAMPLE_MIN_PER_STRATUM if min_per_stratum is None else min_per_stratum
+    sampler = StratifiedReservoirSampler(target_size, min_per_stratum)
+    for row in rows:
+        sampler.add(row)
+    return sampler.sample(), sampler.stats()
@@ -0,0 +1,120 @@
+"""
+Segment scoring: the pLTV of every customer matching filters on customer_features.
+
+Filters are strings like "number_of_purchases>=2" (operators =, !=, >, >=, <, <=), ANDed
+together. Matching rows are read through a server-side cursor in chunks, every chunk is
+scored with one vectorized model.predict, and the output is produced chunk by chunk as
+NDJSON or CSV, so memory stays flat however large the segment is. Served by
+GET/POST /predict/segment, and available offline:
+
+    python segments.py --where "number_of_purchases>=2" --column total_purchase_value --format csv > segment.csv
+"""
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+
+from database import READABLE_FEATURE_COLUMNS, db
+
+SEGMENT_CHUNK_SIZE = 10000
+SEGMENT_FORMATS = ('ndjson', 'csv')
+
+_FILTER_PATTERN = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|=|>|<)\s*(\S.*?)\s*$')
+
+
+def parse_filter(expression):
+    """Parses "column<op>value" into (column, op, float value). Raises ValueError."""
+    match = _FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid segment filter {expression!r}; expected e.g. number_of_purchases>=2")
+    column, operator, value = match.groups()
+    if column not in READABLE_FEATURE_COLUMNS or column == 'customer_id':
+        raise ValueError(f"Unknown feature column in segment filter: {column}")
+    try:
+        return column, operator, float(value)
+    except ValueError:
+        raise ValueError(f"Segment filter value must be numeric: {expression!r}") from None
+
+
+def parse_columns(columns):
+    """Validates the extra feature columns to include next to customer_id and pltv."""
+    unknown = [column for column in columns if column not in READABLE_FEATURE_COLUMNS or column == 'customer_id']
+    if unknown:
+        raise ValueError(f"Unknown feature columns: {', '.join(unknown)}")
+    return list(columns)
+
+
+def iter_scored_chunks(model, model_features, filters=(), columns=(), chunk_size=SEGMENT_CHUNK_SIZE, fill_missing=True):
+    """
+    Yields one DataFrame (customer_id, pltv, *columns) per chunk of matching customers.
+    Missing features are filled with 0 only if fill_missing (the artifact's setting) is set.
+    """
+    import pandas as pd
+
+    for column_names, rows in db.iter_customer_feature_chunks(filters, chunk_size):
+        features_df = pd.DataFrame(rows, columns=column_names)
+        scored = features_df[['customer_id']].copy()
+        X = features_df.reindex(columns=model_features)
+        scored['pltv'] = model.predict(X.fillna(0) if fill_missing else X)
+        for column in columns:
+            scored[column] = features_df[column]
+        yield scored
+
+
+def format_chunk(scored, fmt, header=False):
+    """Renders a scored chunk as NDJSON lines or CSV rows (with the header row if asked)."""
+    if fmt == 'ndjson':
+        return "".join(json.dumps(record, default=float) + "\n" for record in scored.to_dict('records'))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(scored.columns)
+    writer.writerows(scored.itertuples(index=False))
+    return buffer.getvalue()
+
+
+def iter_segment_output(model, model_features, filters=(), columns=(), fmt='ndjson', chunk_size=SEGMENT_CHUNK_SIZE,
+                        fill_missing=True):
+    """Yields the formatted segment export chunk by chunk (CSV always starts with its header)."""
+    first = True
+    for scored in iter_scored_chunks(model, model_features, filters, columns, chunk_size, fill_missing):
+        yield format_chunk(scored, fmt, header=first)
+        first = False
+    if first and fmt == 'csv':
+        yield ",".join(['customer_id', 'pltv', *columns]) + "\r\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every customer matching feature filters.")
+    parser.add_argument('--where', action='append', default=[], metavar='FILTER',
+                        help='Filter like "number_of_purchases>=2" (repeatable, ANDed).')
+    parser.add_argument('--column', action='append', default=[], help="Extra feature column to output (repeatable).")
+    parser.add_argument('--format', choices=SEGMENT_FORMATS, default='ndjson')
+    parser.add_argument('--chunk-size', type=int, default=SEGMENT_CHUNK_SIZE)
+    parser.add_argument('--model', help="Model artifact path (default: pltv_model.pkl).")
+    parser.add_argument('--out', help="Output file (default: stdout).")
+    args = parser.parse_args()
+
+    import joblib
+    from model import MODEL_PATH
+
+    try:
+        filters = [parse_filter(expression) for expression in args.where]
+        columns = parse_columns(args.column)
+    except ValueError as exc:
+        parser.error(str(exc))
+    artifact = joblib.load(args.model or MODEL_PATH)
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        for chunk in iter_segment_output(artifact['model'], artifact['features'], filters, columns,
+                                         args.format, args.chunk_size, artifact.get('fill_missing', True)):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
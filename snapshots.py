@@ -0,0 +1,256 @@
+"""
+Per-customer feature snapshots with tail replay.
+
+A snapshot stores the aggregate state behind a customer's features (sums, counts,
+first/last timestamps, distinct item/brand sets) together with the id of the last event
+it covers. A full recompute loads the snapshot and folds in only the events after that
+watermark, so its cost is bounded by recent activity rather than lifetime activity.
+
+The fold below produces the same feature columns as features.calculate_features.
+"""
+import argparse
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import db
+from ingest import calculate_purchase_value, event_epoch_seconds, item_quantity, normalize_stored_events
+from windows import MAX_WINDOW_DAYS, bucket_increment, utc_day, window_features, window_start
+
+# Snapshot a customer once this many events have accumulated after its watermark
+SNAPSHOT_MIN_TAIL_EVENTS = int(os.environ.get("SNAPSHOT_MIN_TAIL_EVENTS", "50"))
+# Events younger than this are never compacted, so an insert that commits slightly out of
+# id order cannot end up below a watermark without having been folded into the snapshot.
+SNAPSHOT_SAFETY_LAG = timedelta(seconds=int(os.environ.get("SNAPSHOT_SAFETY_LAG_SECONDS", "300")))
+
+
+class FeatureState:
+    """Mergeable aggregate state for one customer's features."""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.total_purchase_value = state.get('total_purchase_value', 0.0)
+        self.number_of_purchases = state.get('number_of_purchases', 0)
+        self.total_items_purchased = state.get('total_items_purchased', 0.0)
+        self.first_event_ts = state.get('first_event_ts')
+        self.last_purchase_ts = state.get('last_purchase_ts')
+        self.event_counts = dict(state.get('event_counts', {}))
+        self.products_purchased = set(state.get('products_purchased', []))
+        self.brands_purchased = set(state.get('brands_purchased', []))
+        self.products_viewed = set(state.get('products_viewed', []))
+        self.brands_viewed = set(state.get('brands_viewed', []))
+        # ISO day -> bucket (see windows.py), only for days that can still fall inside a window
+        self.daily = {day: list(bucket) for day, bucket in state.get('daily', {}).items()}
+
+    def fold(self, evt, now=None):
+        """Adds one normalized event dict to the state."""
+        now = time.time() if now is None else now
+        ts = event_epoch_seconds(evt, now)
+        self.first_event_ts = ts if self.first_event_ts is None else min(self.first_event_ts, ts)
+
+        event_name = evt.get('event_name') or evt.get('event_type')
+        if not isinstance(event_name, str):
+            return
+        self.event_counts[event_name] = self.event_counts.get(event_name, 0) + 1
+        self._fold_daily(evt, now)
+
+        items = evt.get('items')
+        items = [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+        if event_name == 'purchase':
+            self.number_of_purchases += 1
+            self.total_purchase_value += calculate_purchase_value(evt)
+            self.last_purchase_ts = ts if self.last_purchase_ts is None else max(self.last_purchase_ts, ts)
+            for item in items:
+                self.total_items_purchased += item_quantity(item)
+                if item.get('item_id') is not None:
+                    self.products_purchased.add(item['item_id'])
+                if item.get('item_brand') is not None:
+                    self.brands_purchased.add(item['item_brand'])
+        elif event_name == 'view_item':
+            for item in items:
+                if item.get('item_id') is not None:
+                    self.products_viewed.add(item['item_id'])
+                if item.get('item_brand') is not None:
+                    self.brands_viewed.add(item['item_brand'])
+
+    def _fold_daily(self, evt, now):
+        bucketed = bucket_increment(evt, now)
+        if bucketed is None:
+            return
+        day, increment = bucketed
+        # Time only moves forward, so a day outside the longest window never re-enters it
+        cutoff = window_start(utc_day(now), MAX_WINDOW_DAYS)
+        if day <= cutoff:
+            return
+        key = day.isoformat()
+        if key not in self.daily:
+            for stale in [existing for existing in self.daily if existing <= cutoff.isoformat()]:
+                del self.daily[stale]
+            self.daily[key] = [0, 0.0, 0, 0]
+        bucket = self.daily[key]
+        for i, value in enumerate(increment):
+            bucket[i] += value
+
+    def to_dict(self):
+        """JSON-serializable form stored in customer_feature_snapshots.state."""
+        return {
+            'total_purchase_value': self.total_purchase_value,
+            'number_of_purchases': self.number_of_purchases,
+            'total_items_purchased': self.total_items_purchased,
+            'first_event_ts': self.first_event_ts,
+            'last_purchase_ts': self.last_purchase_ts,
+            'event_counts': self.event_counts,
+            'products_purchased': sorted(self.products_purchased, key=str),
+            'brands_purchased': sorted(self.brands_purchased, key=str),
+            'products_viewed': sorted(self.products_viewed, key=str),
+            'brands_viewed': sorted(self.brands_viewed, key=str),
+            'daily': self.daily,
+        }
+
+    def copy(self):
+        return FeatureState(self.to_dict())
+
+    def features(self, customer_id, now=None):
+        """Returns the customer's feature row, with the same columns as calculate_features."""
+        now = time.time() if now is None else now
+        days_since_last_purchase = 0
+        if self.last_purchase_ts is not None:
+            days_since_last_purchase = math.floor((now - self.last_purchase_ts) / 86400)
+        time_since_first_event = 1
+        if self.first_event_ts is not None:
+            time_since_first_event = max(math.floor((now - self.first_event_ts) / 86400), 1)
+        number_of_purchases = self.number_of_purchases
+        return {
+            'customer_id': customer_id,
+            'total_purchase_value': self.total_purchase_value,
+            'number_of_purchases': number_of_purchases,
+            'average_purchase_value': self.total_purchase_value / number_of_purchases if number_of_purchases else 0.0,
+            'total_items_purchased': self.total_items_purchased,
+            'distinct_products_purchased': len(self.products_purchased),
+            'distinct_brands_purchased': len(self.brands_purchased),
+            'distinct_products_viewed': len(self.products_viewed),
+            'distinct_brands_viewed': len(self.brands_viewed),
+            'number_of_page_views': self.event_counts.get('page_view', 0),
+            'days_since_last_purchase': days_since_last_purchase,
+            'time_since_first_event': time_since_first_event,
+            'purchase_frequency': number_of_purchases / time_since_first_event,
+            'pltv': self.total_purchase_value,
+            'add_to_cart_count': self.event_counts.get('add_to_cart', 0),
+            'begin_checkout_count': self.event_counts.get('begin_checkout', 0),
+            **window_features(self.daily, utc_day(now)),
+            'first_event_at': self.first_event_ts,
+            'last_purchase_at': self.last_purchase_ts,
+        }
+
+
+def fold_tail(customer_id, snapshot, tail_events, now=None):
+    """
+    Folds a customer's tail events into their snapshot.
+
+    Args:
+        snapshot: (last_event_id, state) or None.
+        tail_events: (event_id, event_data, created_at) rows after the watermark, in id order.
+
+    Returns:
+        tuple: (state, compacted) where state covers every event, and compacted is a new
+        (customer_id, last_event_id, state_dict) snapshot when the tail was long enough to
+        compact, else None.
+    """
+    now = time.time() if now is None else now
+    last_event_id, state_dict = snapshot if snapshot else (0, None)
+    state = FeatureState(state_dict)
+    compacted = None
+
+    if len(tail_events) >= SNAPSHOT_MIN_TAIL_EVENTS:
+        cutoff = datetime.now(timezone.utc) - SNAPSHOT_SAFETY_LAG
+        compactable = [row for row in tail_events if row[2] is not None and row[2] < cutoff]
+        if compactable:
+            # Fold events up to the last old-enough id into the new snapshot, then the rest on top
+            watermark = max(row[0] for row in compactable)
+            head = [row for row in tail_events if row[0] <= watermark]
+            tail_events = [row for row in tail_events if row[0] > watermark]
+            for evt in normalize_stored_events(customer_id, [row[1] for row in head]):
+                state.fold(evt, now)
+            compacted = (customer_id, watermark, state.to_dict())
+
+    if tail_events:
+        state = state.copy() if compacted else state
+        for evt in normalize_stored_events(customer_id, [row[1] for row in tail_events]):
+            state.fold(evt, now)
+    return state, compacted
+
+
+def recompute_customer_from_snapshot(customer_id):
+    """
+    Rebuilds one customer's features from their snapshot plus the events after its
+    watermark, compacting a new snapshot when the tail has grown long.
+    Returns the feature dict, or None when the customer has no events.
+    """
+    snapshot = db.get_customer_snapshot(customer_id)
+    tail_events = db.get_customer_events_after(customer_id, snapshot[0] if snapshot else 0)
+    if snapshot is None and not tail_events:
+        return None
+    state, compacted = fold_tail(customer_id, snapshot, tail_events)
+    if compacted:
+        db.upsert_customer_snapshots([compacted])
+    return state.features(customer_id)
+
+
+def iter_customer_features(customer_ids=None, compact=True, snapshot_batch_size=500):
+    """
+    Streams feature rows for every customer (or only customer_ids) from snapshots plus
+    tails, in one server-side scan. New snapshots are written in batches when compact is set.
+    """
+    pending_snapshots = []
+    now = time.time()
+
+    def finish(customer_id, snapshot, tail_events):
+        state, compacted = fold_tail(customer_id, snapshot, tail_events, now)
+        if compacted and compact:
+            pending_snapshots.append(compacted)
+            if len(pending_snapshots) >= snapshot_batch_size:
+                db.upsert_customer_snapshots(pending_snapshots)
+                pending_snapshots.clear()
+        if snapshot is None and not tail_events:
+            return None
+        return state.features(customer_id, now)
+
+    current_id, snapshot, tail_events = None, None, []
+    for customer_id, last_event_id, state, event_id, event_data, created_at in db.iter_customer_event_tails(customer_ids):
+        if customer_id != current_id:
+            if current_id is not None:
+                row = finish(current_id, snapshot, tail_events)
+                if row:
+                    yield row
+            current_id = customer_id
+            snapshot = (last_event_id, state) if last_event_id is not None else None
+            tail_events = []
+        if event_id is not None:
+            tail_events.append((event_id, event_data, created_at))
+    if current_id is not None:
+        row = finish(current_id, snapshot, tail_events)
+        if row:
+            yield row
+
+    if pending_snapshots:
+        db.upsert_customer_snapshots(pending_snapshots)
+
+
+def compute_all_customer_features(compact=True):
+    """Returns a DataFrame with one feature row per customer, built from snapshots plus tails."""
+    # Imported here so the API and the recompute workers do not pay for pandas at startup
+    import pandas as pd
+
+    return pd.DataFrame(list(iter_customer_features(compact=compact)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact per-customer feature snapshots.")
+    parser.add_argument('--min-tail-events', type=int, default=SNAPSHOT_MIN_TAIL_EVENTS,
+                        help="Only snapshot customers with at least this many events after their watermark.")
+    args = parser.parse_args()
+    SNAPSHOT_MIN_TAIL_EVENTS = args.min_tail_events
+
+    count = sum(1 for _ in iter_customer_features(compact=True))
+    print(f"Compaction pass complete for {count} customers.")
@@ -0,0 +1,67 @@
+import api
+from admission import AdmissionController
+
+
+def controller(max_in_flight=2, max_pool_utilization=0.5, pool=(0, 10)):
+    usage = {"pool": pool}
+    budgets = {
+        "ingest": {"max_in_flight": max_in_flight, "max_pool_utilization": max_pool_utilization},
+        "predict": {"max_in_flight": 0, "max_pool_utilization": 0},
+    }
+    return AdmissionController(budgets, lambda: usage["pool"], retry_after=3), usage
+
+
+def test_in_flight_limit_sheds_with_429_until_a_request_leaves():
+    admission, _ = controller(max_in_flight=2)
+    assert admission.try_enter("ingest") is None
+    assert admission.try_enter("ingest") is None
+
+    rejection = admission.try_enter("ingest")
+    assert rejection.status == 429
+    assert rejection.retry_after == 3
+
+    admission.leave("ingest")
+    assert admission.try_enter("ingest") is None
+    stats = admission.stats()["classes"]["ingest"]
+    assert stats["in_flight"] == 2
+    assert stats["admitted"] == 3
+    assert stats["shed_in_flight"] == 1
+
+
+def test_pool_ceiling_sheds_with_503():
+    admission, usage = controller(max_pool_utilization=0.5)
+    usage["pool"] = (5, 10)
+
+    rejection = admission.try_enter("ingest")
+    assert rejection.status == 503
+    assert rejection.retry_after == 3
+    # The other class has no ceiling and still gets in
+    assert admission.try_enter("predict") is None
+
+    usage["pool"] = (4, 10)
+    assert admission.try_enter("ingest") is None
+    assert admission.stats()["classes"]["ingest"]["shed_pool"] == 1
+
+
+def test_leave_balances_every_admitted_request():
+    admission, _ = controller(max_in_flight=3)
+    for _ in range(3):
+        assert admission.try_enter("ingest") is None
+    for _ in range(3):
+        admission.leave("ingest")
+
+    assert admission.stats()["classes"]["ingest"]["in_flight"] == 0
+    assert all(admission.try_enter("ingest") is None for _ in range(3))
+
+
+def test_shed_requests_are_answered_with_retry_after(monkeypatch):
+    admission, usage = controller()
+    usage["pool"] = (10, 10)
+    monkeypatch.setattr(api, "admission", admission)
+
+    response = api.app.test_client().post("/event", json={"events": []})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    # A shed request never entered, so nothing is left in flight
+    assert admission.stats()["classes"]["ingest"]["in_flight"] == 0
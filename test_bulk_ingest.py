@@ -0,0 +1,58 @@
+import gzip
+import json
+import os
+import time
+
+import requests
+
+from database import db
+from test_utils import clear_database
+
+# --- Configuration ---
+API_BASE_URL = os.environ.get("PLTV_API_BASE_URL", "http://127.0.0.1:5000")
+
+
+def post_ndjson(lines, compress=False):
+    body = "".join(line + "\n" for line in lines).encode("utf-8")
+    headers = {"Content-Type": "application/x-ndjson"}
+    if compress:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    response = requests.post(f"{API_BASE_URL}/events/bulk", data=body, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def test_bulk_ndjson_counts_accepted_and_rejected_lines():
+    customer_id = "bulk_test_customer_001"
+    clear_database()
+    now = int(time.time() * 1_000_000)
+
+    result = post_ndjson([
+        json.dumps({"event_name": "PAGE_VIEW", "client_id": customer_id, "timestamp_micros": now}),
+        json.dumps({"event_name": "add_to_cart", "user_pseudo_id": customer_id, "timestamp_micros": now + 1}),
+        "{not json",
+        json.dumps({"event_name": "page_view", "timestamp_micros": now + 2}),
+    ])
+
+    assert result["accepted_lines"] == 2
+    assert result["rejected_lines"] == 2
+    assert [error["line"] for error in result["errors"]] == [3, 4]
+
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 1
+    assert features["add_to_cart_count"] == 1
+
+
+def test_bulk_gzip_body_is_deduplicated_on_resend():
+    customer_id = "bulk_test_customer_002"
+    now = int(time.time() * 1_000_000)
+    lines = [json.dumps({"event_name": "page_view", "client_id": customer_id, "timestamp_micros": now + i}) for i in range(5)]
+
+    first = post_ndjson(lines, compress=True)
+    assert first["accepted"] == 5
+
+    second = post_ndjson(lines, compress=True)
+    assert second["accepted"] == 0
+    assert second["duplicates"] == 5
+    assert len(db.get_customer_events(customer_id)) == 5
@@ -0,0 +1,52 @@
+import requests
+import time
+import os
+
+from database import db
+from test_utils import clear_database
+
+# --- Configuration ---
+API_BASE_URL = os.environ.get("PLTV_API_BASE_URL", "http://127.0.0.1:5000")
+
+
+def post_payload(payload):
+    response = requests.post(f"{API_BASE_URL}/event", json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+def test_resent_events_are_ignored():
+    """Retried payloads must not be stored twice or inflate the incremental counters."""
+    customer_id = "dedup_test_customer_001"
+    clear_database()
+
+    payload = {"events": [
+        {"event_name": "page_view", "client_id": customer_id, "timestamp_micros": int(time.time() * 1_000_000)},
+        {"event_name": "add_to_cart", "client_id": customer_id, "timestamp_micros": int(time.time() * 1_000_000) + 1,
+         "items": [{"item_id": "SKU_1", "item_brand": "Brand A", "quantity": 1}]},
+    ]}
+
+    first = post_payload(payload)
+    assert first["accepted"] == 2
+    assert first["duplicates"] == 0
+
+    # Simulate an sGTM retry of the exact same payload
+    second = post_payload(payload)
+    assert second["accepted"] == 0
+    assert second["duplicates"] == 2
+
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 1
+    assert features["add_to_cart_count"] == 1
+    assert len(db.get_customer_events(customer_id)) == 2
+
+
+def test_duplicates_within_one_payload_are_ignored():
+    customer_id = "dedup_test_customer_002"
+    event = {"event_name": "page_view", "client_id": customer_id, "timestamp_micros": int(time.time() * 1_000_000)}
+
+    result = post_payload({"events": [event, dict(event)]})
+    assert result["accepted"] == 1
+
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 1
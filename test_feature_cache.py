@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import feature_cache
+from database import db
+from test_utils import clear_database
+
+
+def cached(directory):
+    return feature_cache.load_feature_frame(directory=str(directory)).set_index("customer_id")
+
+
+def test_merge_overwrites_existing_customers_and_inserts_new_ones_in_order():
+    base = {"customer_id": np.array(["a", "c", "e"]), "pltv": np.array([1.0, 3.0, 5.0])}
+    changed = {"customer_id": np.array(["d", "c", "bb", "f"]), "pltv": np.array([4.0, 30.0, 2.0, 6.0])}
+
+    merged = feature_cache._merge(base, changed)
+
+    assert merged["customer_id"].tolist() == ["a", "bb", "c", "d", "e", "f"]
+    assert merged["pltv"].tolist() == [1.0, 2.0, 30.0, 4.0, 5.0, 6.0]
+
+
+def test_refresh_reads_only_changed_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(feature_cache, "FEATURE_CACHE_OVERLAP_SECONDS", 0)
+    clear_database()
+    db.upsert_customer_features_many([{"customer_id": f"cache_customer_{i}", "pltv": float(i)} for i in range(3)])
+    manifest = feature_cache.refresh(directory=str(tmp_path))
+    assert manifest["rows"] == 3
+
+    db.upsert_customer_features_many([{"customer_id": "cache_customer_1", "pltv": 10.0},
+                                      {"customer_id": "cache_customer_9", "pltv": 9.0}])
+    manifest = feature_cache.refresh(directory=str(tmp_path))
+
+    assert manifest["generation"] == 2
+    assert manifest["rows"] == 4
+    assert manifest["refreshed_rows"] == 2
+    assert cached(tmp_path)["pltv"].to_dict() == {
+        "cache_customer_0": 0.0, "cache_customer_1": 10.0, "cache_customer_2": 2.0, "cache_customer_9": 9.0,
+    }
+
+
+def test_refresh_rereads_rows_committed_behind_the_watermark(tmp_path):
+    """A row whose updated_at is older than the watermark, but within the overlap, is still picked up."""
+    clear_database()
+    db.upsert_customer_features_many([{"customer_id": "cache_customer_0", "pltv": 1.0},
+                                      {"customer_id": "cache_customer_1", "pltv": 2.0}])
+    manifest = feature_cache.refresh(directory=str(tmp_path))
+    watermark = datetime.fromisoformat(manifest["watermark"])
+
+    late = watermark - timedelta(seconds=feature_cache.FEATURE_CACHE_OVERLAP_SECONDS / 2)
+    stale = watermark - timedelta(seconds=feature_cache.FEATURE_CACHE_OVERLAP_SECONDS * 2)
+    with db.get_cursor(commit=True) as cur:
+        cur.execute("UPDATE customer_feature_aggregates SET pltv = 20.0, updated_at = %s WHERE customer_id = %s",
+                    (late, "cache_customer_0"))
+        cur.execute("UPDATE customer_feature_aggregates SET pltv = 30.0, updated_at = %s WHERE customer_id = %s",
+                    (stale, "cache_customer_1"))
+        cur.execute("UPDATE customer_feature_counters SET updated_at = %s", (stale,))
+
+    manifest = feature_cache.refresh(directory=str(tmp_path))
+
+    assert manifest["refreshed_rows"] == 1
+    # The watermark never moves backwards
+    assert datetime.fromisoformat(manifest["watermark"]) == watermark
+    assert cached(tmp_path)["pltv"].to_dict() == {"cache_customer_0": 20.0, "cache_customer_1": 2.0}
+
+
+def test_refresh_rebuilds_when_the_column_set_changes(tmp_path, monkeypatch):
+    clear_database()
+    db.upsert_customer_features_many([{"customer_id": f"cache_customer_{i}", "pltv": float(i)} for i in range(3)])
+    columns = feature_cache.CACHE_COLUMNS
+    monkeypatch.setattr(feature_cache, "CACHE_COLUMNS", ["pltv"])
+    assert feature_cache.refresh(directory=str(tmp_path))["columns"] == ["pltv"]
+
+    monkeypatch.setattr(feature_cache, "CACHE_COLUMNS", columns)
+    manifest = feature_cache.refresh(directory=str(tmp_path))
+
+    assert manifest["columns"] == columns
+    assert manifest["refreshed_rows"] == 3
+    assert set(cached(tmp_path).columns) == set(columns)
@@ -0,0 +1,195 @@
+import time
+
+from database import HOT_FEATURE_COLUMNS, db
+from test_utils import clear_database, send_event
+
+
+def table_row(table, customer_id):
+    with db.get_cursor() as cur:
+        cur.execute(f"SELECT * FROM {table} WHERE customer_id = %s", (customer_id,))
+        row = cur.fetchone()
+        return dict(zip([desc[0] for desc in cur.description], row)) if row else None
+
+
+def table_columns(table):
+    with db.get_cursor() as cur:
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+        """, (table,))
+        return {row[0] for row in cur.fetchall()}
+
+
+def test_schema_is_created_on_an_empty_database_and_rerun():
+    """create_all_tables works from nothing (clear_database drops every table) and is idempotent."""
+    clear_database()
+    db.create_all_tables()
+
+    assert not set(HOT_FEATURE_COLUMNS) & table_columns("customer_feature_aggregates")
+    assert set(HOT_FEATURE_COLUMNS) <= table_columns("customer_feature_counters")
+    assert set(HOT_FEATURE_COLUMNS) <= table_columns("customer_features")
+
+
+def test_wide_customer_features_table_is_split_in_place():
+    """A pre-split wide customer_features table is migrated, counters included."""
+    customer_id = "feature_storage_customer_003"
+    clear_database()
+    with db.get_cursor(commit=True) as cur:
+        cur.execute("DROP TABLE customer_feature_counters, customer_feature_aggregates CASCADE")
+        cur.execute("""
+            CREATE TABLE customer_features (
+                id SERIAL PRIMARY KEY,
+                customer_id VARCHAR(255) UNIQUE NOT NULL,
+                total_purchase_value FLOAT DEFAULT 0,
+                number_of_purchases INTEGER DEFAULT 0,
+                average_purchase_value FLOAT DEFAULT 0,
+                total_items_purchased INTEGER DEFAULT 0,
+                distinct_products_purchased INTEGER DEFAULT 0,
+                distinct_brands_purchased INTEGER DEFAULT 0,
+                distinct_products_viewed INTEGER DEFAULT 0,
+                distinct_brands_viewed INTEGER DEFAULT 0,
+                number_of_page_views INTEGER DEFAULT 0,
+                days_since_last_purchase INTEGER DEFAULT 0,
+                time_since_first_event INTEGER DEFAULT 0,
+                purchase_frequency FLOAT DEFAULT 0,
+                pltv FLOAT DEFAULT 0,
+                add_to_cart_count INTEGER DEFAULT 0,
+                begin_checkout_count INTEGER DEFAULT 0,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            INSERT INTO customer_features (customer_id, number_of_purchases, total_purchase_value,
+                                           number_of_page_views, add_to_cart_count, begin_checkout_count)
+            VALUES (%s, 1, 20.0, 5, 2, 1)
+        """, (customer_id,))
+
+    db.create_all_tables()
+
+    assert not set(HOT_FEATURE_COLUMNS) & table_columns("customer_feature_aggregates")
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_purchases"] == 1
+    assert features["number_of_page_views"] == 5
+    assert features["add_to_cart_count"] == 2
+    assert features["begin_checkout_count"] == 1
+
+
+def test_counters_and_aggregates_are_stored_apart():
+    """Page views only touch the counters table; customer_features joins both."""
+    customer_id = "feature_storage_customer_001"
+    clear_database()
+
+    send_event(customer_id, "page_view")
+    send_event(customer_id, "page_view")
+    send_event(customer_id, "add_to_cart")
+    aggregates_before = table_row("customer_feature_aggregates", customer_id)
+    assert aggregates_before is not None
+    assert aggregates_before["number_of_purchases"] == 0
+    assert "number_of_page_views" not in aggregates_before
+
+    counters = table_row("customer_feature_counters", customer_id)
+    assert counters["number_of_page_views"] == 2
+    assert counters["add_to_cart_count"] == 1
+    # Counter bumps leave the cold row untouched
+    assert table_row("customer_feature_aggregates", customer_id)["updated_at"] == aggregates_before["updated_at"]
+
+    send_event(customer_id, "purchase", {"value": 40.0})
+    time.sleep(0.5)
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 2
+    assert features["add_to_cart_count"] == 1
+    assert features["number_of_purchases"] == 1
+    assert features["total_purchase_value"] == 40.0
+
+
+def test_full_upsert_writes_both_tables():
+    customer_id = "feature_storage_customer_002"
+    db.upsert_customer_features({"customer_id": customer_id, "number_of_page_views": 7, "pltv": 12.5})
+
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 7
+    assert features["pltv"] == 12.5
+    assert features["begin_checkout_count"] == 0
+
+
+def test_rolling_window_features_are_summed_from_daily_buckets():
+    """Events land in today's daily bucket and show up in every window."""
+    customer_id = "feature_storage_customer_002"
+    clear_database()
+
+    send_event(customer_id, "page_view")
+    send_event(customer_id, "add_to_cart")
+    send_event(customer_id, "purchase", {"value": 25.0})
+    time.sleep(0.5)
+
+    with db.get_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM customer_daily_activity WHERE customer_id = %s", (customer_id,))
+        assert cur.fetchone()[0] == 1
+
+    features = db.get_customer_features(customer_id)
+    for days in (7, 30, 90):
+        assert features[f"page_views_{days}d"] == 1
+        assert features[f"add_to_cart_{days}d"] == 1
+        assert features[f"purchases_{days}d"] == 1
+        assert features[f"purchase_value_{days}d"] == 25.0
+
+
+def test_imported_events_land_in_daily_buckets():
+    """Events bulk-loaded by the export importer count in the rolling windows like ingested ones."""
+    import json
+    from ingest import prepare_event
+
+    customer_id = "feature_storage_customer_003"
+    clear_database()
+    now = time.time()
+    events = [
+        {"client_id": customer_id, "event_name": "page_view", "event_timestamp": int(now * 1e9)},
+        {"client_id": customer_id, "event_name": "purchase", "event_timestamp": int(now * 1e9), "value": 30.0},
+        # Older than the longest window: stored, but not bucketed
+        {"client_id": customer_id, "event_name": "page_view", "event_timestamp": int((now - 200 * 86400) * 1e9)},
+    ]
+    rows = []
+    for event in events:
+        prepared_customer, event_record, _, fingerprint = prepare_event(event)
+        rows.append((prepared_customer, json.dumps(event_record), fingerprint))
+
+    assert db.copy_import_chunk("test-import", rows, 0) == 3
+    # Re-importing the same chunk inserts nothing and adds nothing to the buckets
+    assert db.copy_import_chunk("test-import", rows, 0) == 0
+
+    # The view only lists customers once backfill_features.py has run, so read the buckets
+    with db.get_cursor() as cur:
+        cur.execute("""
+            SELECT SUM(purchases), SUM(purchase_value), SUM(page_views), COUNT(*)
+            FROM customer_daily_activity WHERE customer_id = %s
+        """, (customer_id,))
+        assert cur.fetchone() == (1, 30.0, 1, 1)
+
+
+def test_time_relative_features_age_without_new_events():
+    """The view derives recency from the stored event times, so inactive customers keep ageing."""
+    from ingest import prepare_event
+
+    customer_id = "feature_storage_customer_004"
+    clear_database()
+    now = time.time()
+    db.ingest_events([
+        prepare_event({"client_id": customer_id, "event_name": "page_view", "event_timestamp": int((now - 40 * 86400) * 1e9)}),
+        prepare_event({"client_id": customer_id, "event_name": "purchase", "value": 10.0,
+                       "event_timestamp": int((now - 10 * 86400) * 1e9)}),
+    ])
+
+    features = db.get_customer_features(customer_id)
+    assert features["days_since_last_purchase"] == 10
+    assert features["time_since_first_event"] == 40
+    assert features["purchase_frequency"] == 1 / 40
+
+    # Rows without event times (written before they were stored) keep their stored values
+    legacy_id = "feature_storage_customer_005"
+    db.upsert_customer_features({"customer_id": legacy_id, "number_of_purchases": 2,
+                                 "days_since_last_purchase": 3, "time_since_first_event": 8, "purchase_frequency": 0.25})
+    db.ingest_events([prepare_event({"client_id": legacy_id, "event_name": "page_view"})])
+    features = db.get_customer_features(legacy_id)
+    assert features["days_since_last_purchase"] == 3
+    assert features["time_since_first_event"] == 8
+    assert features["purchase_frequency"] == 0.25
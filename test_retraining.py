@@ -100,3 +100,97 @@ def test_model_retraining():
     assert pred_2 != pred_3, f"Prediction after retraining ({pred_3}) should be different from the pre-retraining prediction ({pred_2})."
 
     print("\n✅ ✅ ✅ TEST PASSED: Model reloading works as expected! ✅ ✅ ✅")
+
+
+def test_retrain_status_reports_stage_profile():
+    """/retrain/status returns the per-stage profile of the last retrain."""
+    clear_database()
+    for i in range(4):
+        send_event(f"retrain_profile_customer_{i:03d}", "purchase", {"value": 50.0 * (i + 1)})
+
+    if not trigger_retraining(wait_time=0):
+        pytest.skip("RETRAIN_SECRET_KEY is not set.")
+
+    deadline = time.time() + 120
+    status = None
+    while time.time() < deadline:
+        status = requests.get(f"{API_BASE_URL}/retrain/status").json()
+        if status["state"] != "running":
+            break
+        time.sleep(1)
+
+    assert status["state"] == "succeeded", status
+    stages = {stage["stage"]: stage for stage in status["profile"]["stages"]}
+    assert "grid_search" in stages and "save_model" in stages
+    assert stages["grid_search"]["rows_in"] > 0
+    for stage in stages.values():
+        assert stage["wall_seconds"] >= 0 and stage["cpu_seconds"] >= 0
+
+
+def test_overlapping_retrains_report_the_latest_job(monkeypatch):
+    """A retrain started while another runs becomes the current job; the older one cannot overwrite its status."""
+    import threading
+    import api
+    import model
+
+    release_first = threading.Event()
+    calls = []
+
+    def fake_retrain(profiler=None):
+        calls.append(profiler)
+        if len(calls) == 1:
+            release_first.wait(10)
+        return f"run {len(calls)}"
+
+    monkeypatch.setattr(model, "retrain_and_save_model", fake_retrain)
+    monkeypatch.setattr(api, "load_model_artifact", lambda: None)
+
+    first = api.start_retrain_job()
+    second = api.start_retrain_job()
+    assert second != first
+    second_profiler = api.retrain_profiler
+
+    release_first.set()
+    deadline = time.time() + 10
+    while api.retrain_status["state"] == "running" and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert api.retrain_status["job_id"] == second
+    assert api.retrain_status["state"] == "succeeded"
+    assert api.retrain_status["result"] == "run 2"
+    assert api.retrain_profiler is second_profiler
+    assert calls[1] is second_profiler
+
+
+def test_training_snapshot_follows_the_artifact_on_disk(monkeypatch, tmp_path):
+    """A worker that did not retrain evaluates the scheduler against the artifact another worker saved."""
+    import joblib
+    import api
+
+    artifact_path = tmp_path / "pltv_model.pkl"
+    monkeypatch.setattr(api, "model_path", str(artifact_path))
+    joblib.dump({"model": "old", "features": ["f"], "training_snapshot": {"event_watermark": 1}}, artifact_path)
+    api.load_model_artifact()
+    assert api.get_training_snapshot() == {"event_watermark": 1}
+
+    # Another worker retrains and replaces the file
+    joblib.dump({"model": "new", "features": ["f"], "training_snapshot": {"event_watermark": 2}}, artifact_path)
+    mtime = os.path.getmtime(artifact_path) + 1
+    os.utime(artifact_path, (mtime, mtime))
+    assert api.get_training_snapshot() == {"event_watermark": 2}
+    assert api.model == "new"
+
+    # Back to the real artifact for the tests that follow
+    monkeypatch.undo()
+    api.load_model_artifact()
+
+
+def test_retrain_decisions_endpoint_reports_thresholds():
+    response = requests.get(f"{API_BASE_URL}/retrain/decisions", params={"limit": 5})
+    response.raise_for_status()
+    body = response.json()
+    assert set(body["thresholds"]) >= {"min_interval_seconds", "min_new_events", "max_feature_psi"}
+    assert len(body["decisions"]) <= 5
+    for decision in body["decisions"]:
+        assert decision["action"] in ("retrain", "wait", "skip", "error")
+        assert decision["reasons"]
@@ -0,0 +1,51 @@
+from sampling import StratifiedReservoirSampler, sample_training_rows, stratum_of
+
+
+def population(counts):
+    """Feature rows for {(number_of_purchases, total_purchase_value): customers}."""
+    rows = []
+    for (purchases, value), size in counts.items():
+        rows.extend({"customer_id": f"{purchases}-{value}-{i}", "number_of_purchases": purchases,
+                     "total_purchase_value": value} for i in range(size))
+    return rows
+
+
+def test_rare_strata_keep_the_minimum_share():
+    rows = population({(0, 0.0): 9000, (1, 20.0): 900, (10, 9000.0): 100})
+    sampled, stats = sample_training_rows(rows, target_size=500, min_per_stratum=50)
+
+    per_stratum = {}
+    for row in sampled:
+        per_stratum[stratum_of(row)] = per_stratum.get(stratum_of(row), 0) + 1
+    # Proportional shares would be 450 / 45 / 5; the floor lifts the small strata to 50
+    assert per_stratum == {(0, 0): 450, (1, 0): 50, (4, 4): 50}
+    assert stats["population"] == 10000
+    assert stats["sampled"] == 550
+
+
+def test_floor_never_exceeds_the_stratum_size():
+    rows = population({(0, 0.0): 5000, (10, 9000.0): 10})
+    sampled, _ = sample_training_rows(rows, target_size=100, min_per_stratum=50)
+
+    assert sum(1 for row in sampled if row["number_of_purchases"] == 10) == 10
+
+
+def test_sample_weights_sum_to_the_population():
+    rows = population({(0, 0.0): 7000, (2, 120.0): 2500, (5, 600.0): 450, (10, 9000.0): 50})
+    sampled, stats = sample_training_rows(rows, target_size=800, min_per_stratum=40)
+
+    assert len(sampled) == stats["sampled"] < len(rows)
+    assert abs(sum(row["sample_weight"] for row in sampled) - len(rows)) < 1e-6
+    for key, stratum in stats["strata"].items():
+        weights = {row["sample_weight"] for row in sampled if "%d:%d" % stratum_of(row) == key}
+        assert weights == {stratum["population"] / stratum["sampled"]}
+
+
+def test_small_population_is_kept_whole_with_unit_weights():
+    sampler = StratifiedReservoirSampler(target_size=100, min_per_stratum=10)
+    for row in population({(0, 0.0): 30, (3, 300.0): 20}):
+        sampler.add(row)
+
+    sampled = sampler.sample()
+    assert len(sampled) == 50
+    assert {row["sample_weight"] for row in sampled} == {1.0}
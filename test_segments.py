@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+import os
+
+import pytest
+import requests
+
+from database import db
+
+# --- Configuration ---
+API_BASE_URL = os.environ.get("PLTV_API_BASE_URL", "http://127.0.0.1:5000")
+
+
+def test_invalid_segment_filter_is_rejected():
+    response = requests.get(f"{API_BASE_URL}/predict/segment", params={"where": "not_a_column>=2"})
+    assert response.status_code == 400
+    response = requests.get(f"{API_BASE_URL}/predict/segment", params={"where": "number_of_purchases>=two"})
+    assert response.status_code == 400
+
+
+def test_segment_export_streams_matching_customers():
+    db.upsert_customer_features({"customer_id": "segment_test_customer_001", "number_of_purchases": 3, "pltv": 90.0})
+    db.upsert_customer_features({"customer_id": "segment_test_customer_002", "number_of_purchases": 1, "pltv": 10.0})
+
+    response = requests.get(f"{API_BASE_URL}/predict/segment", stream=True, params={
+        "where": ["number_of_purchases>=2", "pltv>50"], "column": "number_of_purchases",
+    })
+    if response.status_code == 503:
+        pytest.skip("No trained model loaded in the API.")
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.iter_lines() if line]
+    customer_ids = {record["customer_id"] for record in records}
+    assert "segment_test_customer_001" in customer_ids
+    assert "segment_test_customer_002" not in customer_ids
+    assert all(record["number_of_purchases"] >= 2 and "pltv" in record for record in records)
+
+    response = requests.post(f"{API_BASE_URL}/predict/segment", json={
+        "where": ["number_of_purchases>=2", "pltv>50"], "format": "csv",
+    })
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert {row["customer_id"] for row in rows} == customer_ids
+
+
+class RecordingModel:
+    """Stands in for a trained model and keeps the feature frames it was asked to score."""
+
+    def __init__(self):
+        self.frames = []
+
+    def predict(self, X):
+        self.frames.append(X)
+        return [0.0] * len(X)
+
+
+def test_segment_scoring_keeps_missing_features_for_models_trained_on_nan():
+    from segments import iter_scored_chunks
+
+    customer_id = "segment_test_customer_003"
+    db.upsert_customer_features({"customer_id": customer_id, "number_of_purchases": 0, "days_since_last_purchase": None})
+    filters = [("number_of_purchases", "=", 0)]
+
+    for fill_missing in (True, False):
+        model = RecordingModel()
+        for _ in iter_scored_chunks(model, ["days_since_last_purchase"], filters, fill_missing=fill_missing):
+            pass
+        X = model.frames[0]
+        assert X["days_since_last_purchase"].isna().any() != fill_missing
@@ -0,0 +1,106 @@
+import time
+
+import snapshots
+from database import db
+from features import calculate_customer_features
+from ingest import normalize_stored_events, prepare_event
+from test_utils import clear_database
+
+CUSTOMER_ID = "snapshot_customer_001"
+
+
+def ingest(count, start, event_name="page_view"):
+    now = time.time()
+    db.ingest_events([
+        prepare_event({"client_id": CUSTOMER_ID, "event_name": event_name, "value": 5.0,
+                       "timestamp_micros": int((now - (start + i) * 3600) * 1e6)})
+        for i in range(count)
+    ])
+
+
+def age_events(seconds):
+    """Moves every stored event's created_at back, past the snapshot safety lag."""
+    with db.get_cursor(commit=True) as cur:
+        cur.execute("UPDATE customer_events_normalized SET created_at = created_at - make_interval(secs => %s)",
+                    (seconds,))
+
+
+def event_ids():
+    return [row[0] for row in db.get_customer_events_after(CUSTOMER_ID, 0)]
+
+
+def full_replay():
+    stored = [row[1] for row in db.get_customer_events_after(CUSTOMER_ID, 0)]
+    return calculate_customer_features(CUSTOMER_ID, normalize_stored_events(CUSTOMER_ID, stored))
+
+
+def assert_same_features(actual, expected):
+    for column, value in expected.items():
+        if column == "customer_id":
+            continue
+        assert abs(float(actual[column]) - float(value)) < 1e-6, column
+
+
+def test_short_tail_is_folded_without_a_snapshot(monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_MIN_TAIL_EVENTS", 5)
+    clear_database()
+    ingest(4, start=10)
+    age_events(3600)
+
+    features = snapshots.recompute_customer_from_snapshot(CUSTOMER_ID)
+
+    assert db.get_customer_snapshot(CUSTOMER_ID) is None
+    assert features["number_of_page_views"] == 4
+
+
+def test_snapshot_watermark_stops_at_the_safety_lag(monkeypatch):
+    """Only events older than the safety lag are compacted; younger ones stay in the tail."""
+    monkeypatch.setattr(snapshots, "SNAPSHOT_MIN_TAIL_EVENTS", 5)
+    clear_database()
+    ingest(6, start=20)
+    age_events(snapshots.SNAPSHOT_SAFETY_LAG.total_seconds() + 60)
+    old_ids = event_ids()
+    ingest(3, start=1, event_name="purchase")
+
+    features = snapshots.recompute_customer_from_snapshot(CUSTOMER_ID)
+
+    last_event_id, state = db.get_customer_snapshot(CUSTOMER_ID)
+    assert last_event_id == max(old_ids)
+    assert state["event_counts"] == {"page_view": 6}
+    assert state["number_of_purchases"] == 0
+    assert features["number_of_page_views"] == 6
+    assert features["number_of_purchases"] == 3
+
+
+def test_snapshot_plus_tail_equals_a_full_replay(monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_MIN_TAIL_EVENTS", 5)
+    clear_database()
+    ingest(5, start=100)
+    ingest(3, start=90, event_name="purchase")
+    age_events(snapshots.SNAPSHOT_SAFETY_LAG.total_seconds() + 60)
+    snapshots.recompute_customer_from_snapshot(CUSTOMER_ID)
+    assert db.get_customer_snapshot(CUSTOMER_ID)[0] == max(event_ids())
+
+    ingest(2, start=2)
+    ingest(1, start=1, event_name="purchase")
+    features = snapshots.recompute_customer_from_snapshot(CUSTOMER_ID)
+
+    assert features["number_of_purchases"] == 4
+    assert features["number_of_page_views"] == 7
+    assert_same_features(features, full_replay())
+
+
+def test_fold_tail_is_read_only_until_the_tail_is_long_enough(monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_MIN_TAIL_EVENTS", 5)
+    clear_database()
+    ingest(5, start=10)
+    age_events(snapshots.SNAPSHOT_SAFETY_LAG.total_seconds() + 60)
+    tail = db.get_customer_events_after(CUSTOMER_ID, 0)
+
+    state, compacted = snapshots.fold_tail(CUSTOMER_ID, None, tail[:4])
+    assert compacted is None
+    assert state.event_counts == {"page_view": 4}
+
+    state, compacted = snapshots.fold_tail(CUSTOMER_ID, None, tail)
+    assert compacted[:2] == (CUSTOMER_ID, tail[-1][0])
+    assert state.event_counts == {"page_view": 5}
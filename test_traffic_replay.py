@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import time
+
+from database import db
+from replay_traffic import replay, shift_timestamps
+from test_utils import clear_database
+from traffic_capture import TrafficCapture, iter_capture
+
+# --- Configuration ---
+API_BASE_URL = os.environ.get("PLTV_API_BASE_URL", "http://127.0.0.1:5000")
+
+
+def test_captured_traffic_replays_in_order(tmp_path):
+    """A capture replays at max speed, and --shift-timestamps turns it into new events."""
+    customer_id = "traffic_replay_customer_001"
+    clear_database()
+
+    capture = TrafficCapture(str(tmp_path))
+    captured_at = time.time() - 3600
+    for i, event_name in enumerate(["page_view", "add_to_cart", "purchase"]):
+        body = json.dumps({"events": [{
+            "event_name": event_name, "client_id": customer_id, "value": 10.0,
+            "timestamp_micros": int((captured_at + i) * 1_000_000),
+        }]})
+        capture.capture("/event", body, "application/json", customer_id=customer_id, arrived_at=captured_at + i)
+    capture.close()
+    assert [record["t"] for record in iter_capture([str(tmp_path)])] == [captured_at, captured_at + 1, captured_at + 2]
+
+    first = asyncio.run(replay(iter_capture([str(tmp_path)]), API_BASE_URL, speed=0, concurrency=1))
+    assert first["requests"] == 3
+    assert first["error_rate"] == 0
+    assert first["by_path"]["/event"]["status_counts"] == {200: 3}
+
+    # Same payloads again are duplicates; shifted timestamps make them new events
+    asyncio.run(replay(iter_capture([str(tmp_path)]), API_BASE_URL, speed=0, concurrency=1))
+    asyncio.run(replay(iter_capture([str(tmp_path)]), API_BASE_URL, speed=0, concurrency=1, shift=True))
+    time.sleep(0.5)
+    features = db.get_customer_features(customer_id)
+    assert features["number_of_page_views"] == 2
+    assert features["add_to_cart_count"] == 2
+
+
+def test_shift_timestamps_keeps_the_type_of_each_timestamp():
+    body = json.dumps({"events": [{
+        "event_timestamp": "1700000000000000001",
+        "event_time_ms": "1700000000000.5",
+        "timestamp_micros": 1700000000000000,
+        "event_time_micros": "not a number",
+    }]})
+    event = json.loads(shift_timestamps(body, 10))["events"][0]
+    assert event["event_timestamp"] == "1700000010000000001"
+    assert event["event_time_ms"] == "1700000010000.5"
+    assert event["timestamp_micros"] == 1700000010000000
+    assert event["event_time_micros"] == "not a number"
@@ -0,0 +1,107 @@
+"""
+Opt-in capture of incoming /event request bodies, for replaying real traffic against a
+test deployment (see replay_traffic.py).
+
+Each sampled request is appended as one NDJSON line to rotating segment files:
+
+    {"t": <arrival time, epoch seconds>, "path": "/event", "content_type": ..., "body": <raw body>}
+
+The body is kept verbatim, so replays reproduce the real payload sizes and event mix.
+Sampling is by customer (a hash of the first event's client id), not by request, so every
+captured customer keeps all of their requests and the per-customer bursts survive.
+
+Enable by setting TRAFFIC_CAPTURE_DIR. TRAFFIC_CAPTURE_SAMPLE_RATE (0-1, default 1) sets
+the share of customers captured; segments rotate like the event archive's, after
+TRAFFIC_CAPTURE_SEGMENT_MB of data or TRAFFIC_CAPTURE_SEGMENT_SECONDS of age.
+"""
+import atexit
+import glob
+import gzip
+import heapq
+import json
+import os
+import random
+import time
+import zlib
+
+from event_archive import RotatingSegmentWriter
+
+TRAFFIC_CAPTURE_DIR = os.environ.get("TRAFFIC_CAPTURE_DIR")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+TRAFFIC_CAPTURE_SEGMENT_MB = float(os.environ.get("TRAFFIC_CAPTURE_SEGMENT_MB", "64"))
+TRAFFIC_CAPTURE_SEGMENT_SECONDS = float(os.environ.get("TRAFFIC_CAPTURE_SEGMENT_SECONDS", "3600"))
+
+
+class TrafficCapture:
+    """Appends sampled request bodies with their arrival time to rotating NDJSON segments."""
+
+    def __init__(self, directory, sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE,
+                 segment_mb=TRAFFIC_CAPTURE_SEGMENT_MB, segment_seconds=TRAFFIC_CAPTURE_SEGMENT_SECONDS):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.writer = RotatingSegmentWriter(
+            directory, 'traffic', max_bytes=int(segment_mb * 1024 * 1024), max_seconds=segment_seconds
+        )
+
+    def sampled(self, customer_id):
+        """Whether requests of customer_id are captured (random per request without an id)."""
+        if self.sample_rate >= 1:
+            return True
+        if customer_id is None:
+            return random.random() < self.sample_rate
+        return zlib.crc32(str(customer_id).encode('utf-8')) / 2**32 < self.sample_rate
+
+    def capture(self, path, body, content_type=None, customer_id=None, arrived_at=None):
+        """Records one request body (bytes or str) if its customer is sampled."""
+        if not self.sampled(customer_id):
+            return
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='replace')
+        self.writer.write({
+            't': arrived_at if arrived_at is not None else time.time(),
+            'path': path,
+            'content_type': content_type,
+            'body': body,
+        })
+
+    def close(self):
+        self.writer.close()
+
+
+def _iter_segment(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as segment:
+        try:
+            for line in segment:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A crash can leave a truncated last line in the active segment
+                    continue
+        except EOFError:
+            # Active or crashed segment without a gzip trailer: everything sync-flushed was read
+            return
+
+
+def iter_capture(paths):
+    """
+    Yields captured requests in arrival order from capture files and/or directories of
+    segments. Every segment is in order already (one writer per process), so they are
+    merged lazily rather than loaded and sorted.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, 'traffic-*.ndjson*'))))
+        else:
+            files.append(path)
+    return heapq.merge(*(_iter_segment(path) for path in files), key=lambda record: record['t'])
+
+
+# --- Global Capture Instance (None when capture is disabled) ---
+traffic_capture = TrafficCapture(TRAFFIC_CAPTURE_DIR) if TRAFFIC_CAPTURE_DIR else None
+if traffic_capture is not None:
+    atexit.register(traffic_capture.close)
@@ -0,0 +1,81 @@
+"""
+Rolling-window features: purchases, purchase value, page views and add-to-carts over the
+last 7/30/90 days.
+
+Serving keeps per-customer daily buckets (customer_daily_activity), incremented on ingest
+and summed over the window when features are read. The batch paths (calculate_features,
+the snapshot fold, DuckDB) compute the same columns from raw events. One definition is
+shared by all of them:
+
+    an event's day is the UTC calendar date of its timestamp (ingest.event_epoch_seconds),
+    and the N-day window holds the events whose day is after today (UTC) minus N days,
+    i.e. today and the N - 1 days before it.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from ingest import calculate_purchase_value, event_epoch_seconds
+
+WINDOW_DAYS = (7, 30, 90)
+MAX_WINDOW_DAYS = max(WINDOW_DAYS)
+# Columns of customer_daily_activity, in bucket order
+BUCKET_COLUMNS = ['purchases', 'purchase_value', 'page_views', 'add_to_cart']
+# Event name -> index of the bucket column it increments by one
+_COUNTED_EVENTS = {'purchase': 0, 'page_view': 2, 'add_to_cart': 3}
+
+WINDOW_FEATURE_COLUMNS = [f"{column}_{days}d" for days in WINDOW_DAYS for column in BUCKET_COLUMNS]
+
+
+def utc_day(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).date()
+
+
+def window_start(today, days):
+    """Days strictly after this date are inside the days-long window ending today."""
+    return today - timedelta(days=days)
+
+
+def bucket_increment(evt, now):
+    """Returns (day, [purchases, value, page_views, add_to_cart]) for a counted event, else None."""
+    event_name = evt.get('event_name') or evt.get('event_type')
+    if event_name not in _COUNTED_EVENTS:
+        return None
+    increment = [0, 0.0, 0, 0]
+    increment[_COUNTED_EVENTS[event_name]] = 1
+    if event_name == 'purchase':
+        increment[1] = calculate_purchase_value(evt)
+    return utc_day(event_epoch_seconds(evt, now)), increment
+
+
+def aggregate_daily_activity(records, now):
+    """
+    Folds a batch of (customer_id, event_record, ...) tuples into daily buckets.
+
+    Returns:
+        dict: (customer_id, day) -> [purchases, purchase_value, page_views, add_to_cart].
+    """
+    buckets = {}
+    for record in records:
+        bucketed = bucket_increment(record[1], now)
+        if bucketed is None:
+            continue
+        day, increment = bucketed
+        bucket = buckets.setdefault((record[0], day), [0, 0.0, 0, 0])
+        for i, value in enumerate(increment):
+            bucket[i] += value
+    return buckets
+
+
+def window_features(daily, today):
+    """
+    Sums daily buckets over every window. daily maps a date (or ISO date string) to its
+    bucket list; today is the UTC date the windows end on.
+    """
+    features = dict.fromkeys(WINDOW_FEATURE_COLUMNS, 0)
+    for day, bucket in daily.items():
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        for days in WINDOW_DAYS:
+            if day > window_start(today, days):
+                for column, value in zip(BUCKET_COLUMNS, bucket):
+                    features[f"{column}_{days}d"] += value
+    return features